@@ -1,17 +1,34 @@
 import os
 import io
 import base64
+import hashlib
+import asyncio
+import json
+import math
+import shutil
+import struct
+import tempfile
+import time
 import numpy as np
 from typing import List, Optional
 from PIL import Image
 import torch
-from transformers import CLIPProcessor, CLIPModel, BlipProcessor, BlipForConditionalGeneration
-from diffusers import StableDiffusionPipeline
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Header, Depends, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 import logging
 
+from reference_store import ReferenceStore, DEFAULT_COLLECTION, validate_collection_name
+from lanes import (create_lanes, RequestBudget, LaneOverloaded, DeadlineExceeded,
+                   PRIORITY_NAMES)
+from audit import AuditLog
+from video import FrameSampler, Timeline, open_video
+from perceptual_hash import NearDuplicateIndex
+from compact_index import INDEX_MODES, rerank_similarities
+from model_store import MODEL_IDS, load_all
+import augment
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -34,8 +51,29 @@ blip_model = None
 blip_processor = None
 sd_pipeline = None
 device = None
-reference_embeddings = []
-reference_captions = []
+reference_store = None
+temporary_store_root = None  # set when no REFERENCE_STORE_DIR is configured; removed at shutdown
+lanes = {}
+audit_log = None
+near_duplicates = None
+model_load_timings = {}
+
+CLIP_MODEL_ID = MODEL_IDS["clip"]
+AUDIT_TOP_K = 5
+TRANSFER_CHUNK_ROWS = 65536
+MAX_TILES = 64
+MAX_TILE_OVERLAP = 0.5
+RARE_EVENT_THRESHOLD = 0.7
+STREAM_FRAME_HEADER = struct.Struct("!Q")
+MAX_STREAM_CREDITS = 64
+MAX_VIDEO_FRAMES = 36000
+MAX_VIDEO_BATCH = 64
+REFERENCE_INDEX = os.getenv("REFERENCE_INDEX", "float32")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "256"))
+AUGMENT_MAX_IMAGES = int(os.getenv("AUGMENT_MAX_IMAGES", "256"))
+AUGMENT_MAX_BATCH = 16
+
+stream_stats = {"open": 0, "frames": 0, "batches": 0, "errors": 0}
 
 def get_device():
     """Determine the best available device (GPU if available, else CPU)"""
@@ -45,43 +83,139 @@ def get_device():
         return torch.device("cpu")
 
 def load_models():
-    """Load all required models at startup"""
-    global clip_model, clip_processor, blip_model, blip_processor, sd_pipeline, device
+    """Load all required models at startup (concurrently, from MODEL_DIR when set)"""
+    global clip_model, clip_processor, blip_model, blip_processor, sd_pipeline, device, model_load_timings
     
     device = get_device()
     logger.info(f"Using device: {device}")
-    
+
+    if os.getenv("STUB_MODELS") == "1":
+        # Tiny random models with the same interfaces, for offline benchmarking
+        from stub_models import load_stub_models
+        logger.info("Loading stub models (STUB_MODELS=1)...")
+        clip_model, clip_processor, blip_model, blip_processor, sd_pipeline = load_stub_models(device)
+        return
+
     try:
-        # Load CLIP model for embeddings and similarity
-        logger.info("Loading CLIP model...")
-        clip_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-        clip_processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
-        clip_model.to(device)
-        
-        # Load BLIP model for image captioning
-        logger.info("Loading BLIP model...")
-        blip_processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
-        blip_model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base")
-        blip_model.to(device)
-        
-        # Load Stable Diffusion for image generation
-        logger.info("Loading Stable Diffusion model...")
-        sd_pipeline = StableDiffusionPipeline.from_pretrained(
-            "runwayml/stable-diffusion-v1-5",
-            torch_dtype=torch.float16 if device.type == "cuda" else torch.float32
-        )
-        sd_pipeline.to(device)
+        # CLIP for embeddings and similarity, BLIP for captioning, Stable Diffusion for generation
+        logger.info(f"Loading CLIP, BLIP and Stable Diffusion from {os.getenv('MODEL_DIR') or 'the Hugging Face hub'}...")
+        models, model_load_timings = load_all(device)
+        clip_model, clip_processor = models["clip"]
+        blip_model, blip_processor = models["blip"]
+        sd_pipeline = models["sd"]
         
+        for name, phases in model_load_timings.items():
+            logger.info(f"Loaded {name}: {phases}")
         logger.info("All models loaded successfully!")
         
     except Exception as e:
         logger.error(f"Error loading models: {str(e)}")
         raise e
 
+def init_reference_store():
+    """Open the shared reference store (a private temp dir, removed at shutdown, unless REFERENCE_STORE_DIR is set)"""
+    global reference_store, temporary_store_root
+    root = os.getenv("REFERENCE_STORE_DIR")
+    if not root:
+        root = temporary_store_root = tempfile.mkdtemp(prefix="rare-event-refs-")
+    reference_store = ReferenceStore(root)
+    logger.info(f"Reference store: {root}")
+
 @app.on_event("startup")
 async def startup_event():
     """Load models when the application starts"""
-    load_models()
+    # serve.py loads the models once before forking workers
+    if clip_model is None:
+        load_models()
+    init_reference_store()
+    init_lanes()
+    init_audit_log()
+    init_near_duplicates()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush buffered audit records and remove a temporary reference store before the process exits"""
+    if audit_log is not None:
+        audit_log.close()
+    if temporary_store_root is not None:
+        shutil.rmtree(temporary_store_root, ignore_errors=True)
+
+def init_audit_log():
+    """Start the background audit writer if AUDIT_DIR is set (per worker, like the lanes)"""
+    global audit_log
+    audit_log = AuditLog.from_env()
+    if audit_log is not None:
+        logger.info(f"Audit log: {audit_log.directory}")
+
+def init_near_duplicates():
+    """Enable the perceptual-hash short-circuit if NEAR_DUPLICATE_CACHE_SIZE is set"""
+    global near_duplicates
+    near_duplicates = NearDuplicateIndex.from_env()
+    if near_duplicates is not None:
+        logger.info(f"Near-duplicate index: {near_duplicates.capacity} {near_duplicates.algorithm} hashes, "
+                    f"max distance {near_duplicates.max_distance}")
+
+def input_hash(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def audit_classification(input_digest: str, references, similarities: np.ndarray,
+                         label: str, score: float, started: float, **extra):
+    """Queue one classification record; never blocks on disk I/O"""
+    if audit_log is None:
+        return
+    best = top_k_indices(similarities, AUDIT_TOP_K)
+    audit_log.record({
+        "ts": round(time.time(), 3),
+        "pid": os.getpid(),
+        "input_hash": input_digest,
+        "collection": references.collection,
+        "version": references.version,
+        "top_k": [int(i) for i in best],
+        "similarities": [round(float(similarities[i]), 5) for i in best],
+        "score": round(score, 5),
+        "label": label,
+        "latency_ms": round(1000 * (time.perf_counter() - started), 2),
+        **extra,
+    })
+
+def init_lanes():
+    """Start one execution lane per model (threads do not survive fork, so per worker)"""
+    global lanes
+    lanes = create_lanes()
+
+def request_budget(default_priority: str):
+    """
+    Dependency reading a request's priority class and deadline from headers
+
+    X-Priority: interactive | batch (default depends on the endpoint)
+    X-Deadline-Ms: time budget in milliseconds from arrival
+    """
+    def dependency(
+        x_priority: Optional[str] = Header(None),
+        x_deadline_ms: Optional[float] = Header(None)
+    ) -> RequestBudget:
+        priority = (x_priority or default_priority).lower()
+        if priority not in PRIORITY_NAMES:
+            raise HTTPException(status_code=400, detail=f"X-Priority must be one of {list(PRIORITY_NAMES)}")
+        if x_deadline_ms is not None and x_deadline_ms <= 0:
+            raise HTTPException(status_code=400, detail="X-Deadline-Ms must be positive")
+        timeout = x_deadline_ms / 1000.0 if x_deadline_ms is not None else None
+        return RequestBudget.from_timeout(PRIORITY_NAMES[priority], timeout)
+    return dependency
+
+def admit(lane: str, budget: RequestBudget):
+    """Shed the request with 429 if the lane cannot start it within its budget"""
+    try:
+        lanes[lane].admit(budget)
+    except LaneOverloaded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+def get_collection_name(collection: str) -> str:
+    """Validate a collection name from a request"""
+    try:
+        return validate_collection_name(collection)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 def preprocess_image(image_bytes: bytes) -> Image.Image:
     """Convert bytes to PIL Image"""
@@ -99,142 +233,1070 @@ def compute_clip_embedding(image: Image.Image) -> np.ndarray:
         image_features = image_features / image_features.norm(dim=-1, keepdim=True)
     return image_features.cpu().numpy()
 
-def compute_similarity(embedding1: np.ndarray, embedding2: np.ndarray) -> float:
-    """Compute cosine similarity between two embeddings"""
-    return float(np.dot(embedding1.flatten(), embedding2.flatten()))
+def compute_clip_features(image: Image.Image):
+    """
+    Compute the CLIP image embedding and per-patch embeddings in one forward pass
+
+    The patch tokens of the last vision layer are passed through the same
+    post-layernorm and projection as the pooled token, so they live in the
+    joint embedding space and can be scored against reference embeddings.
+    """
+    inputs = clip_processor(images=image, return_tensors="pt").to(device)
+    with torch.no_grad():
+        vision_outputs = clip_model.vision_model(pixel_values=inputs["pixel_values"])
+        image_features = clip_model.visual_projection(vision_outputs.pooler_output)
+        patch_tokens = clip_model.vision_model.post_layernorm(vision_outputs.last_hidden_state[:, 1:])
+        patch_features = clip_model.visual_projection(patch_tokens)
+        # Normalize the features
+        image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+        patch_features = patch_features / patch_features.norm(dim=-1, keepdim=True)
+    return image_features.cpu().numpy(), patch_features[0].cpu().numpy()
+
+class TileLimitExceeded(Exception):
+    """Tiling would cut an image into more than MAX_TILES tiles"""
+
+def tile_side(width: int, height: int, scale: int, overlap: float):
+    """Side length and stride of the square tiles, `scale` tiles across the shorter side"""
+    side = min(width, height) / (scale - (scale - 1) * overlap)
+    return side, side * (1 - overlap)
+
+def tile_count(length: int, side: float, stride: float) -> int:
+    """Tiles needed along one axis so the last one ends at the edge"""
+    return max(1, math.ceil((length - side) / stride - 1e-6) + 1)
+
+def tile_boxes(width: int, height: int, scale: int, overlap: float):
+    """
+    Square, overlapping tiles covering the image, `scale` tiles across the shorter side
+
+    Returns (rows, cols, boxes) with boxes as (left, top, right, bottom) in
+    row-major order. Square tiles survive CLIP's center crop intact; along
+    the longer side tiles are spread evenly, so the last one ends at the edge.
+    """
+    side, stride = tile_side(width, height, scale, overlap)
+
+    def offsets(length):
+        count = tile_count(length, side, stride)
+        step = (length - side) / (count - 1) if count > 1 else 0.0
+        return [round(i * step) for i in range(count)]
+
+    size = round(side)
+    xs, ys = offsets(width), offsets(height)
+    return len(ys), len(xs), [(x, y, x + size, y + size) for y in ys for x in xs]
+
+def tile_grids(width: int, height: int, scales: List[int], overlap: float):
+    """One tile grid per scale; raises TileLimitExceeded beyond MAX_TILES tiles in total, before cutting any"""
+    count = 0
+    for scale in scales:
+        side, stride = tile_side(width, height, scale, overlap)
+        count += tile_count(width, side, stride) * tile_count(height, side, stride)
+    if count > MAX_TILES:
+        raise TileLimitExceeded(f"tile_scales {scales} would cut this {width}x{height} image into {count} tiles "
+                                f"(at most {MAX_TILES}); use fewer or smaller scales or less overlap")
+    return [tile_boxes(width, height, scale, overlap) for scale in scales]
+
+def compute_clip_embeddings(images: List[Image.Image]) -> np.ndarray:
+    """Compute normalized CLIP embeddings for several images in one batched forward"""
+    inputs = clip_processor(images=images, return_tensors="pt").to(device)
+    with torch.no_grad():
+        image_features = clip_model.get_image_features(**inputs)
+        image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+    return image_features.cpu().numpy()
+
+async def embed_images(images: List[Image.Image], budget: RequestBudget):
+    """
+    CLIP embeddings for decoded images, reusing those of recent near-duplicates
+
+    Returns the (N, dim) embeddings and, per image, the Hamming distance of
+    the near-duplicate it was served from (None when CLIP ran for it). The
+    CLIP lane only admits the budget when some image misses the cache, so
+    near-duplicates are still answered while CLIP is overloaded; otherwise
+    LaneOverloaded is raised.
+    """
+    distances = [None] * len(images)
+    if near_duplicates is None:
+        lanes["clip"].admit(budget)
+        return await lanes["clip"].run(compute_clip_embeddings, images, budget=budget), distances
+    
+    keys = [near_duplicates.hash(image) for image in images]
+    rows, misses = [None] * len(images), []
+    for i, key in enumerate(keys):
+        match = near_duplicates.lookup(key)
+        if match is None:
+            misses.append(i)
+        else:
+            rows[i], distances[i] = match
+    if misses:
+        lanes["clip"].admit(budget)
+        computed = await lanes["clip"].run(compute_clip_embeddings, [images[i] for i in misses], budget=budget)
+        for i, embedding in zip(misses, computed):
+            rows[i] = embedding
+            near_duplicates.add(keys[i], embedding)
+    return np.stack(rows), distances
+
+def compute_clip_tile_embeddings(image: Image.Image, boxes, batch_size: int) -> np.ndarray:
+    """Crop tiles and compute their normalized CLIP embeddings in batches"""
+    embeddings = []
+    for start in range(0, len(boxes), batch_size):
+        tiles = [image.crop(box) for box in boxes[start:start + batch_size]]
+        embeddings.append(compute_clip_embeddings(tiles))
+    return np.concatenate(embeddings, axis=0)
+
+def parse_tile_scales(tile_scales: str) -> List[int]:
+    """Validate a comma-separated list of tiles-per-side values"""
+    try:
+        scales = sorted({int(part) for part in tile_scales.split(",") if part.strip()})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="tile_scales must be comma-separated integers, e.g. '1,2,3'")
+    if not scales or scales[0] < 1:
+        raise HTTPException(status_code=400, detail="tile_scales must be positive integers")
+    # The tile limit depends on the image's shape and is checked in tile_grids
+    return scales
+
+def compute_patch_heatmap(patch_embeddings: np.ndarray, reference_embedding: np.ndarray) -> np.ndarray:
+    """Score every patch against one reference and scale to [0, 1] on the patch grid"""
+    side = int(round(np.sqrt(patch_embeddings.shape[0])))
+    scores = (patch_embeddings @ reference_embedding.flatten()).reshape(side, side)
+    low, high = scores.min(), scores.max()
+    if high - low < 1e-8:
+        return np.zeros_like(scores)
+    return (scores - low) / (high - low)
+
+def encode_heatmap_png(heatmap: np.ndarray) -> str:
+    """Encode a [0, 1] heatmap as a grayscale PNG data URI at patch-grid resolution"""
+    buffer = io.BytesIO()
+    Image.fromarray((heatmap * 255).round().astype(np.uint8), mode="L").save(buffer, format="PNG")
+    return f"data:image/png;base64,{base64.b64encode(buffer.getvalue()).decode()}"
+
+def compute_clip_text_embeddings(texts: List[str]) -> np.ndarray:
+    """Compute normalized CLIP text embeddings for a batch of captions"""
+    inputs = clip_processor(text=texts, return_tensors="pt", padding=True, truncation=True).to(device)
+    with torch.no_grad():
+        text_features = clip_model.get_text_features(**inputs)
+        text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+    return text_features.cpu().numpy()
+
+def reference_similarities(references, queries: np.ndarray, candidates: int = RERANK_CANDIDATES):
+    """
+    (T, R) similarities of query rows to every reference image, and which are exact
+
+    With a compact index the scan runs over float16 rows or PQ codes, and each
+    query's best candidates are re-scored exactly from the float32 memmap;
+    the returned (T, R) mask marks those exact entries (None without an index,
+    when everything is exact). Take maxima and rankings from exact_similarities.
+    """
+    if references.index is None:
+        return queries @ references.embeddings.T, None
+    return rerank_similarities(references.index, references.embeddings, queries, candidates)
+
+def mask_inexact(matrix: np.ndarray, exact: Optional[np.ndarray]) -> np.ndarray:
+    """Entries not scored exactly set to -inf, so they never win a max or a ranking"""
+    return matrix if exact is None else np.where(exact, matrix, -np.inf)
+
+def exact_similarities(references, queries: np.ndarray, candidates: int = RERANK_CANDIDATES) -> np.ndarray:
+    """reference_similarities with the approximate entries masked: maxima and top results match a float32 scan"""
+    return mask_inexact(*reference_similarities(references, queries, candidates))
+
+async def update_reference_index(collection: str):
+    """Bring the collection's compact index up to date after a write (REFERENCE_INDEX)"""
+    if REFERENCE_INDEX != "float32":
+        await run_in_threadpool(reference_store.build_index, collection, REFERENCE_INDEX,
+                                int(os.getenv("REFERENCE_INDEX_PQ_M", "0")) or None)
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first"""
+    k = min(k, scores.shape[0])
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates])]
 
 @app.post("/upload_references")
 async def upload_references(
     files: List[UploadFile] = File(...),
-    captions: List[str] = Form(...)
+    captions: List[str] = Form(...),
+    collection: str = Form(DEFAULT_COLLECTION),
+    budget: RequestBudget = Depends(request_budget("batch"))
 ):
     """
     Upload reference images with captions for few-shot learning
     """
-    global reference_embeddings, reference_captions
-    
+    collection = get_collection_name(collection)
+
     if len(files) != len(captions):
         raise HTTPException(
             status_code=400, 
             detail="Number of files must match number of captions"
         )
     
+    admit("clip", budget)
+    
     try:
-        reference_embeddings = []
-        reference_captions = []
+        embeddings = []
         
-        for file, caption in zip(files, captions):
+        for file in files:
             # Read and preprocess image
             image_bytes = await file.read()
             image = preprocess_image(image_bytes)
             
             # Compute embedding
-            embedding = compute_clip_embedding(image)
-            
-            reference_embeddings.append(embedding)
-            reference_captions.append(caption)
+            embeddings.append(await lanes["clip"].run(compute_clip_embedding, image, budget=budget))
+        
+        # Embed the captions once here so search and fused scoring never re-encode them
+        text_embeddings = await lanes["clip"].run(compute_clip_text_embeddings, captions, budget=budget)
         
-        logger.info(f"Uploaded {len(reference_embeddings)} reference images")
+        # Publish to the shared store so every worker sees the new version; the write
+        # (and waiting for another worker's flock) stays off the event loop
+        references = await run_in_threadpool(
+            reference_store.replace,
+            collection,
+            np.concatenate(embeddings, axis=0),
+            [{"caption": caption} for caption in captions],
+            model_id=CLIP_MODEL_ID,
+            text_embeddings=text_embeddings
+        )
+        await update_reference_index(collection)
+        
+        logger.info(f"Uploaded {len(references)} reference images to '{collection}' ({references.version})")
         
         return JSONResponse({
             "status": "success",
-            "count": len(reference_embeddings),
-            "message": f"Successfully uploaded {len(reference_embeddings)} reference images"
+            "collection": collection,
+            "version": references.version,
+            "count": len(references),
+            "message": f"Successfully uploaded {len(references)} reference images"
         })
         
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         logger.error(f"Error uploading references: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/classify")
-async def classify_image(file: UploadFile = File(...)):
+async def classify_image(
+    file: UploadFile = File(...),
+    collection: str = Form(DEFAULT_COLLECTION),
+    text_weight: float = Form(0.0),
+    heatmap: bool = Form(False),
+    heatmap_format: str = Form("array"),
+    tiled: bool = Form(False),
+    tile_scales: str = Form("1,2,3"),
+    tile_overlap: float = Form(0.25),
+    tile_batch_size: int = Form(MAX_TILES),
+    budget: RequestBudget = Depends(request_budget("interactive"))
+):
     """
     Classify a new image as 'Rare Event' or 'Normal'
+
+    With text_weight > 0 the response adds fused_similarity, (1 - text_weight)
+    times the image-image similarity plus text_weight times the image-caption
+    similarity (caption embeddings cached at upload); it ranks references and
+    tiles. The label always compares the image-image similarity with
+    RARE_EVENT_THRESHOLD: CLIP image-caption cosines sit far lower (around
+    0.2-0.35) than image-image ones, so a fused value is not on that scale.
+    With heatmap=true the response also carries a patch-grid localization map
+    (7x7 for ViT-B/32, covering the processor's center crop) scored against
+    the best-matching reference, taken from the same forward pass.
+    When the near-duplicate index is enabled, an image whose perceptual hash
+    is close to a recent one reuses that embedding ("near_duplicate": true);
+    the CLIP lane only sheds the request (429) when the lookup misses.
+    With tiled=true the image is also cut into overlapping square tiles
+    (tile_scales lists tiles across the shorter side, one grid per scale), so
+    small defects are not lost in the 224 px downscale; elongated images get
+    more tiles along the longer side, and at most MAX_TILES in total are
+    accepted (400 otherwise). All tiles are encoded
+    in tile_batch_size batches and scored in one matrix product; the response
+    adds a per-tile score grid per scale and stage latencies.
     """
-    if not reference_embeddings:
+    started = time.perf_counter()
+    references = reference_store.get(get_collection_name(collection))
+    if references is None or len(references) == 0:
         raise HTTPException(
             status_code=400,
             detail="No reference images uploaded. Please upload references first."
         )
+    if not 0.0 <= text_weight <= 1.0:
+        raise HTTPException(status_code=400, detail="text_weight must be between 0 and 1")
+    if text_weight > 0 and references.text_embeddings is None:
+        raise HTTPException(status_code=400, detail="Collection has no caption embeddings")
+    if heatmap_format not in ("array", "png"):
+        raise HTTPException(status_code=400, detail="heatmap_format must be 'array' or 'png'")
+    if tiled:
+        scales = parse_tile_scales(tile_scales)
+        if heatmap:
+            raise HTTPException(status_code=400, detail="heatmap is not available in tiled mode")
+        if not 0.0 <= tile_overlap <= MAX_TILE_OVERLAP:
+            raise HTTPException(status_code=400, detail=f"tile_overlap must be in [0, {MAX_TILE_OVERLAP}]")
+        if tile_batch_size < 1:
+            raise HTTPException(status_code=400, detail="tile_batch_size must be at least 1")
     
     try:
         # Read and preprocess image
         image_bytes = await file.read()
         image = preprocess_image(image_bytes)
         
-        # Compute embedding for the new image
-        new_embedding = compute_clip_embedding(image)
+        # Compute embedding for the new image (plus patch embeddings for the heatmap)
+        hash_distance = None
+        if tiled:
+            tiling_start = time.perf_counter()
+            grids = tile_grids(image.width, image.height, scales, tile_overlap)
+            boxes = [box for _, _, grid_boxes in grids for box in grid_boxes]
+            inference_start = time.perf_counter()
+            lanes["clip"].admit(budget)
+            new_embedding = await lanes["clip"].run(
+                compute_clip_tile_embeddings, image, boxes, tile_batch_size, budget=budget
+            )
+            scoring_start = time.perf_counter()
+        elif heatmap:
+            lanes["clip"].admit(budget)
+            new_embedding, patch_embeddings = await lanes["clip"].run(
+                compute_clip_features, image, budget=budget
+            )
+        else:
+            new_embedding, (hash_distance,) = await embed_images([image], budget)
         
-        # Compute similarities with all reference images
-        similarities = []
-        for ref_embedding in reference_embeddings:
-            similarity = compute_similarity(new_embedding, ref_embedding)
-            similarities.append(similarity)
+        # Score every query row (the image, or each tile) against all references in one matrix product
+        # With a compact index, entries outside each row's re-ranked candidates are approximate:
+        # they are reported in all_similarities but never decide the maximum or the label
+        similarity_matrix, exact = reference_similarities(references, new_embedding)
+        similarities = similarity_matrix.max(axis=0)
+        exact_similarity_matrix = mask_inexact(similarity_matrix, exact)
+        score_matrix = exact_similarity_matrix
         
         # Get the maximum similarity
-        max_similarity = max(similarities)
+        max_similarity = float(exact_similarity_matrix.max())
+        score = max_similarity
         
-        # Classification threshold (you can adjust this)
-        threshold = 0.7
+        response = {
+            "similarity": float(max_similarity),
+            "all_similarities": [float(s) for s in similarities],
+            "all_similarities_approximate": exact is not None,
+            "near_duplicate": hash_distance is not None
+        }
+        if hash_distance is not None:
+            response["hash_distance"] = hash_distance
+        
+        if text_weight > 0:
+            text_matrix = new_embedding @ references.text_embeddings.T
+            score_matrix = mask_inexact((1.0 - text_weight) * similarity_matrix + text_weight * text_matrix, exact)
+            score = float(score_matrix.max())
+            response["fused_similarity"] = score
+            response["text_similarities"] = [float(s) for s in text_matrix.max(axis=0)]
+        
+        if tiled:
+            tile_scores = score_matrix.max(axis=1)
+            tile_references = score_matrix.argmax(axis=1)
+            best_tile = int(tile_scores.argmax())
+            tiles, offset = [], 0
+            for scale, (rows, cols, grid_boxes) in zip(scales, grids):
+                count = rows * cols
+                tiles.append({
+                    "scale": scale,
+                    "grid": [rows, cols],
+                    "tile_size": grid_boxes[0][2] - grid_boxes[0][0],
+                    "scores": np.round(tile_scores[offset:offset + count], 4).reshape(rows, cols).tolist(),
+                    "references": tile_references[offset:offset + count].reshape(rows, cols).tolist()
+                })
+                offset += count
+            finished = time.perf_counter()
+            response["tiles"] = tiles
+            response["tile_count"] = len(boxes)
+            response["tile_batch_size"] = min(tile_batch_size, len(boxes))
+            response["best_tile"] = {
+                "box": list(boxes[best_tile]),
+                "score": float(tile_scores[best_tile]),
+                "reference": int(tile_references[best_tile])
+            }
+            response["latency_ms"] = {
+                "tiling": round(1000 * (inference_start - tiling_start), 2),
+                "inference": round(1000 * (scoring_start - inference_start), 2),
+                "scoring": round(1000 * (finished - scoring_start), 2),
+                "total": round(1000 * (finished - started), 2)
+            }
+        
+        if heatmap:
+            best = int(exact_similarity_matrix.max(axis=0).argmax())
+            heatmap_grid = compute_patch_heatmap(patch_embeddings, references.embeddings[best])
+            response["heatmap_reference"] = best
+            response["heatmap_shape"] = list(heatmap_grid.shape)
+            if heatmap_format == "png":
+                response["heatmap"] = encode_heatmap_png(heatmap_grid)
+            else:
+                response["heatmap"] = np.round(heatmap_grid, 3).tolist()
+        
+        # Classification threshold (you can adjust this); the fused score only ranks
+        threshold = RARE_EVENT_THRESHOLD
         
         if max_similarity > threshold:
             label = "Rare Event"
         else:
             label = "Normal"
         
+        audit_classification(input_hash(image_bytes), references, exact_similarity_matrix.max(axis=0),
+                             label, score, started)
+        
+        return JSONResponse({"label": label, **response})
+        
+    except LaneOverloaded as e:
+        # Admitted only once the near-duplicate lookup missed
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except TileLimitExceeded as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error classifying image: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.websocket("/ws/classify")
+async def classify_stream(
+    websocket: WebSocket,
+    collection: str = DEFAULT_COLLECTION,
+    credits: int = 8,
+    max_batch: int = 16,
+    text_weight: float = 0.0,
+    deadline_ms: Optional[float] = None
+):
+    """
+    Classify a stream of frames over one persistent connection
+
+    After the {"type": "ready"} message the client sends binary frames: an
+    8-byte big-endian sequence id followed by the encoded image. Each frame is
+    answered in arrival order with a JSON message tagged with its "seq". The
+    server reads at most `credits` frames ahead of the results it has sent,
+    so a client that keeps more in flight is held back by TCP flow control
+    instead of growing a server-side buffer. Frames that are waiting together
+    are classified in one batched CLIP forward of up to max_batch images.
+    With text_weight > 0, "score" is the fused similarity that picks the
+    reference, while the label still comes from "similarity" (see /classify).
+    Text frames, and frames with an empty image, get an error message in turn
+    and the stream goes on; an unexpected server error sends a final error
+    message and closes the connection with code 1011.
+    """
+    await websocket.accept()
+    try:
+        collection = validate_collection_name(collection)
+        if not 1 <= credits <= MAX_STREAM_CREDITS:
+            raise ValueError(f"credits must be between 1 and {MAX_STREAM_CREDITS}")
+        if not 1 <= max_batch <= MAX_STREAM_CREDITS:
+            raise ValueError(f"max_batch must be between 1 and {MAX_STREAM_CREDITS}")
+        if not 0.0 <= text_weight <= 1.0:
+            raise ValueError("text_weight must be between 0 and 1")
+        if deadline_ms is not None and deadline_ms <= 0:
+            raise ValueError("deadline_ms must be positive")
+        references = reference_store.get(collection)
+        if references is None or len(references) == 0:
+            raise ValueError("No reference images uploaded for this collection.")
+        if text_weight > 0 and references.text_embeddings is None:
+            raise ValueError("Collection has no caption embeddings")
+    except ValueError as e:
+        await websocket.send_json({"type": "error", "detail": str(e)})
+        await websocket.close(code=1008)
+        return
+    
+    await websocket.send_json({
+        "type": "ready",
+        "collection": collection,
+        "version": references.version,
+        "credits": credits,
+        "max_batch": max_batch
+    })
+    
+    window = asyncio.Semaphore(credits)
+    pending = asyncio.Queue()
+    stream_stats["open"] += 1
+    
+    async def receive_frames():
+        try:
+            while True:
+                await window.acquire()
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                # perf_counter times the frame's latency; the budget's deadline is on the lanes' monotonic clock
+                budget = RequestBudget.from_timeout(PRIORITY_NAMES["interactive"],
+                                                    deadline_ms / 1000.0 if deadline_ms is not None else None)
+                # A text frame is queued as None and answered in order with an error
+                await pending.put((message.get("bytes"), time.perf_counter(), budget))
+        except Exception as e:
+            logger.error(f"Error receiving stream frames: {str(e)}")
+        finally:
+            pending.put_nowait(None)
+    
+    async def classify_batch(batch):
+        """Answer one micro-batch; undecodable frames get per-frame errors"""
+        results, images, decoded = {}, [], []
+        for i, (frame, received, _) in enumerate(batch):
+            if frame is None:
+                results[i] = {"type": "error", "seq": None,
+                              "detail": "Expected a binary frame: an 8-byte sequence id followed by the image"}
+                continue
+            if len(frame) < STREAM_FRAME_HEADER.size:
+                results[i] = {"type": "error", "seq": None, "detail": "Frame shorter than its 8-byte sequence header"}
+                continue
+            if len(frame) == STREAM_FRAME_HEADER.size:
+                results[i] = {"type": "error", "detail": "Empty image after the sequence header"}
+                continue
+            try:
+                images.append(preprocess_image(frame[STREAM_FRAME_HEADER.size:]))
+                decoded.append(i)
+            except Exception as e:
+                results[i] = {"type": "error", "detail": f"Cannot decode image: {e}"}
+        
+        if decoded:
+            # The oldest frame's deadline is the earliest in the batch
+            budget = batch[decoded[0]][2]
+            references = reference_store.get(collection)
+            try:
+                if references is None or len(references) == 0:
+                    raise ValueError("Collection no longer has references")
+                embeddings, distances = await embed_images(images, budget)
+                similarity_matrix, exact = reference_similarities(references, embeddings)
+                score_matrix = similarity_matrix
+                if text_weight > 0:
+                    score_matrix = ((1.0 - text_weight) * similarity_matrix
+                                    + text_weight * (embeddings @ references.text_embeddings.T))
+                similarity_matrix = mask_inexact(similarity_matrix, exact)
+                score_matrix = mask_inexact(score_matrix, exact)
+                for row, i in enumerate(decoded):
+                    frame, received, _ = batch[i]
+                    similarity = float(similarity_matrix[row].max())
+                    score = float(score_matrix[row].max())
+                    # As in /classify, the fused score picks the reference but never the label
+                    label = "Rare Event" if similarity > RARE_EVENT_THRESHOLD else "Normal"
+                    audit_classification(input_hash(frame[STREAM_FRAME_HEADER.size:]), references,
+                                         similarity_matrix[row], label, score, received)
+                    results[i] = {
+                        "type": "result",
+                        "label": label,
+                        "similarity": similarity,
+                        "score": score,
+                        "reference": int(score_matrix[row].argmax()),
+                        "near_duplicate": distances[row] is not None,
+                        "version": references.version,
+                        "batch_size": len(decoded),
+                        "latency_ms": round(1000 * (time.perf_counter() - received), 2)
+                    }
+            except LaneOverloaded as e:
+                for i in decoded:
+                    results[i] = {"type": "error", "detail": str(e), "retry_after": e.retry_after}
+            except (DeadlineExceeded, ValueError) as e:
+                for i in decoded:
+                    results[i] = {"type": "error", "detail": str(e)}
+            stream_stats["batches"] += 1
+        
+        for i, (frame, _, _) in enumerate(batch):
+            message = results[i]
+            if frame is not None and len(frame) >= STREAM_FRAME_HEADER.size:
+                message["seq"] = STREAM_FRAME_HEADER.unpack_from(frame)[0]
+            if message["type"] == "error":
+                stream_stats["errors"] += 1
+            stream_stats["frames"] += 1
+            await websocket.send_json(message)
+            window.release()
+    
+    receiver = asyncio.create_task(receive_frames())
+    try:
+        while True:
+            item = await pending.get()
+            if item is None:
+                break
+            # Everything that arrived while the previous batch ran goes into this one
+            batch = [item]
+            closed = False
+            while len(batch) < max_batch and not pending.empty():
+                item = pending.get_nowait()
+                if item is None:
+                    closed = True
+                    break
+                batch.append(item)
+            await classify_batch(batch)
+            if closed:
+                break
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"Error in classification stream: {str(e)}")
+        try:
+            await websocket.send_json({"type": "error", "seq": None, "detail": f"Stream failed: {str(e)}"})
+            await websocket.close(code=1011)
+        except WebSocketDisconnect:
+            pass
+    finally:
+        receiver.cancel()
+        stream_stats["open"] -= 1
+
+def classify_video_file(upload, suffix: str, references, sampler: FrameSampler,
+                        batch_size: int, budget: RequestBudget) -> dict:
+    """
+    Decode, sample, embed and score a video in batches (runs in a worker thread)
+
+    When the budget's deadline passes part way, the batches already scored are
+    returned as a truncated timeline; DeadlineExceeded is only raised when
+    nothing was scored.
+    """
+    started = time.perf_counter()
+    inference = 0.0
+    timeline = Timeline(RARE_EVENT_THRESHOLD)
+    classified, scored_until, deadline_exceeded = 0, 0.0, False
+    digest = hashlib.blake2b(digest_size=16)
+    with tempfile.NamedTemporaryFile(suffix=suffix) as tmp:
+        # OpenCV needs a path; copy the spooled upload in 1 MiB pieces, hashing it for the audit log
+        for chunk in iter(lambda: upload.read(1 << 20), b""):
+            digest.update(chunk)
+            tmp.write(chunk)
+        tmp.flush()
+        video_hash = digest.hexdigest()
+        cap, info = open_video(tmp.name)
+        try:
+            for batch in sampler.batches(cap, info, batch_size):
+                inference_start = time.perf_counter()
+                try:
+                    embeddings = lanes["clip"].submit(
+                        compute_clip_embeddings, [image for _, image in batch], budget=budget
+                    ).result()
+                except DeadlineExceeded:
+                    if classified == 0:
+                        raise
+                    deadline_exceeded = True
+                    break
+                inference += time.perf_counter() - inference_start
+                scores = exact_similarities(references, embeddings)
+                for (timestamp, _), row in zip(batch, scores):
+                    score = float(row.max())
+                    timeline.add(timestamp, score, int(row.argmax()))
+                    # One audit record per sampled frame, keyed by the video and the frame's time
+                    audit_classification(video_hash, references, row,
+                                         "Rare Event" if score > RARE_EVENT_THRESHOLD else "Normal",
+                                         score, started, frame_time=round(timestamp, 3))
+                classified += len(batch)
+                scored_until = batch[-1][0]
+        finally:
+            cap.release()
+    
+    elapsed = time.perf_counter() - started
+    duration = max(info.duration, sampler.decoded / info.fps)
+    # With max_frames reached or the deadline passed, nothing after the last scored sample was looked at
+    truncated = sampler.truncated or deadline_exceeded
+    analyzed_until = scored_until if truncated else duration
+    return {
+        "video": {"fps": info.fps, "frames": sampler.decoded, "duration": round(duration, 3),
+                  "width": info.width, "height": info.height},
+        "segments": timeline.finish(analyzed_until),
+        "truncated": truncated,
+        "deadline_exceeded": deadline_exceeded,
+        "analyzed_until": round(analyzed_until, 3),
+        "sampled_frames": classified,
+        "candidate_frames": sampler.candidates,
+        "throughput": {
+            "decoded_fps": round(sampler.decoded / elapsed, 1),
+            "classified_fps": round(classified / inference, 1) if inference > 0 else None,
+            "elapsed_s": round(elapsed, 3),
+            "inference_s": round(inference, 3)
+        }
+    }
+
+@app.post("/classify_video")
+async def classify_video(
+    file: UploadFile = File(...),
+    collection: str = Form(DEFAULT_COLLECTION),
+    sample_fps: float = Form(1.0),
+    scene_threshold: Optional[float] = Form(None),
+    batch_size: int = Form(16),
+    max_frames: int = Form(3600),
+    budget: RequestBudget = Depends(request_budget("batch"))
+):
+    """
+    Classify a video file into a timeline of Rare Event / Normal segments
+
+    Frames are sampled at sample_fps; with scene_threshold (mean absolute
+    grayscale difference, 0-255) a sample is only classified when the scene
+    changed since the last classified one. Samples go through CLIP in
+    batch_size batches, and consecutive samples with the same label are merged
+    into segments with their peak and mean scores. When max_frames samples
+    are reached before the end, "truncated" is true and the timeline stops at
+    the last sample ("analyzed_until"). The same partial timeline is returned,
+    with "deadline_exceeded": true, when the deadline passes after at least
+    one batch was scored (504 otherwise).
+    """
+    references = reference_store.get(get_collection_name(collection))
+    if references is None or len(references) == 0:
+        raise HTTPException(status_code=400, detail="No reference images uploaded for this collection.")
+    if not 0 < sample_fps <= 60:
+        raise HTTPException(status_code=400, detail="sample_fps must be in (0, 60]")
+    if scene_threshold is not None and not 0 <= scene_threshold <= 255:
+        raise HTTPException(status_code=400, detail="scene_threshold must be between 0 and 255")
+    if not 1 <= batch_size <= MAX_VIDEO_BATCH:
+        raise HTTPException(status_code=400, detail=f"batch_size must be between 1 and {MAX_VIDEO_BATCH}")
+    if not 1 <= max_frames <= MAX_VIDEO_FRAMES:
+        raise HTTPException(status_code=400, detail=f"max_frames must be between 1 and {MAX_VIDEO_FRAMES}")
+    
+    admit("clip", budget)
+    
+    try:
+        sampler = FrameSampler(sample_fps, scene_threshold, max_frames)
+        suffix = os.path.splitext(file.filename or "")[1] or ".mp4"
+        result = await run_in_threadpool(
+            classify_video_file, file.file, suffix, references, sampler, batch_size, budget
+        )
+        
+        logger.info(f"Classified video '{file.filename}': {result['sampled_frames']} samples, "
+                    f"{result['throughput']['decoded_fps']} decoded frames/s")
+        
+        return JSONResponse({"collection": references.collection, "version": references.version, **result})
+        
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error classifying video: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/search")
+async def search_references(
+    text: Optional[str] = Form(None),
+    file: Optional[UploadFile] = File(None),
+    collection: str = Form(DEFAULT_COLLECTION),
+    modality: str = Form("image"),
+    top_k: int = Form(5),
+    budget: RequestBudget = Depends(request_budget("interactive"))
+):
+    """
+    Return the top-k references for a text or image query
+
+    modality selects which reference matrix is searched: "image" embeddings
+    or the cached caption "text" embeddings. Both live in CLIP's joint space,
+    so any query type can be scored against either with one matrix product.
+    """
+    references = reference_store.get(get_collection_name(collection))
+    if references is None or len(references) == 0:
+        raise HTTPException(status_code=400, detail="No reference images uploaded for this collection.")
+    if (text is None) == (file is None):
+        raise HTTPException(status_code=400, detail="Provide exactly one of 'text' or 'file'")
+    if modality not in ("image", "text"):
+        raise HTTPException(status_code=400, detail="modality must be 'image' or 'text'")
+    if top_k < 1:
+        raise HTTPException(status_code=400, detail="top_k must be at least 1")
+    
+    matrix = references.embeddings if modality == "image" else references.text_embeddings
+    if matrix is None:
+        raise HTTPException(status_code=400, detail="Collection has no caption embeddings")
+    
+    admit("clip", budget)
+    
+    try:
+        if text is not None:
+            query = await lanes["clip"].run(compute_clip_text_embeddings, [text], budget=budget)
+        else:
+            image = preprocess_image(await file.read())
+            query = await lanes["clip"].run(compute_clip_embedding, image, budget=budget)
+        
+        if modality == "image":
+            scores = exact_similarities(references, query, max(RERANK_CANDIDATES, 4 * top_k))[0]
+        else:
+            scores = matrix @ query.flatten()
+        best = top_k_indices(scores, top_k)
+        
         return JSONResponse({
-            "label": label,
-            "similarity": float(max_similarity),
-            "all_similarities": [float(s) for s in similarities]
+            "collection": references.collection,
+            "modality": modality,
+            "results": [
+                {"index": int(i), "caption": references.items[i].get("caption", ""), "score": float(scores[i])}
+                for i in best
+            ]
         })
         
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
-        logger.error(f"Error classifying image: {str(e)}")
+        logger.error(f"Error searching references: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def read_npy_header(f):
+    """Parse a .npy header from a file object, returning (rows, dim, dtype)"""
+    try:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        elif version == (2, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        else:
+            raise ValueError(f"unsupported .npy version {version}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid .npy file: {e}")
+    if len(shape) != 2 or fortran_order or dtype.kind != "f":
+        raise HTTPException(status_code=400, detail="Expected a C-ordered 2-D float .npy matrix")
+    return shape[0], shape[1], dtype
+
+def iter_npy_rows(f, rows: int, dim: int, dtype: np.dtype):
+    """Yield float32 chunks of a .npy body without reading it all into memory"""
+    for start in range(0, rows, TRANSFER_CHUNK_ROWS):
+        n = min(TRANSFER_CHUNK_ROWS, rows - start)
+        data = f.read(n * dim * dtype.itemsize)
+        if len(data) != n * dim * dtype.itemsize:
+            raise ValueError(f".npy data ends after {start} of {rows} rows")
+        yield np.frombuffer(data, dtype=dtype).reshape(n, dim).astype(np.float32)
+
+def iter_items(f):
+    """Yield items from JSON lines: objects like {"caption": ...} or bare caption strings"""
+    for line in f:
+        line = line.strip()
+        if not line:
+            continue
+        item = json.loads(line)
+        yield item if isinstance(item, dict) else {"caption": str(item)}
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Scale rows to unit length like the embeddings computed here"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    if not np.isfinite(matrix).all() or (norms == 0).any():
+        raise ValueError("Embeddings contain NaN/Inf or all-zero rows")
+    return matrix / norms
+
+def import_chunks(embeddings_file, rows, dim, dtype, items_file, text_file, text_dtype,
+                  encode_captions, budget):
+    """Pair embedding, item and text embedding chunks for ReferenceStore.import_chunks"""
+    text_chunks = iter_npy_rows(text_file, rows, dim, text_dtype) if text_file is not None else None
+    items = iter_items(io.TextIOWrapper(items_file, encoding="utf-8"))
+    for embeddings in iter_npy_rows(embeddings_file, rows, dim, dtype):
+        chunk_items = [item for _, item in zip(range(embeddings.shape[0]), items)]
+        if len(chunk_items) != embeddings.shape[0]:
+            raise ValueError(f"Fewer items than the {rows} embedding rows")
+        text_embeddings = None
+        if text_chunks is not None:
+            text_embeddings = normalize_rows(next(text_chunks))
+        elif encode_captions:
+            captions = [item.get("caption", "") for item in chunk_items]
+            text_embeddings = np.concatenate([
+                lanes["clip"].submit(compute_clip_text_embeddings, captions[i:i + 256], budget=budget).result()
+                for i in range(0, len(captions), 256)
+            ])
+        yield normalize_rows(embeddings), chunk_items, text_embeddings
+    if next(items, None) is not None:
+        raise ValueError(f"More items than the {rows} embedding rows")
+
+@app.post("/import_references")
+async def import_references(
+    embeddings: UploadFile = File(...),
+    items: UploadFile = File(...),
+    text_embeddings: Optional[UploadFile] = File(None),
+    model_id: str = Form(...),
+    collection: str = Form(DEFAULT_COLLECTION),
+    mode: str = Form("replace"),
+    encode_captions: bool = Form(False),
+    budget: RequestBudget = Depends(request_budget("batch"))
+):
+    """
+    Ingest precomputed CLIP embeddings without running the image model
+
+    embeddings: (N, dim) float .npy. items: N JSON lines, each an object with
+    a "caption" (as produced by /export_references) or a bare string.
+    text_embeddings: optional (N, dim) .npy of caption embeddings; without it,
+    encode_captions=true embeds the captions here, otherwise the collection
+    supports image similarity only. Uploads are spooled to disk and ingested
+    in chunks, and the rows are published together once all are written.
+    """
+    collection = get_collection_name(collection)
+    if mode not in ("replace", "append"):
+        raise HTTPException(status_code=400, detail="mode must be 'replace' or 'append'")
+    if model_id != CLIP_MODEL_ID:
+        raise HTTPException(status_code=400, detail=f"model_id must be {CLIP_MODEL_ID!r}, got {model_id!r}")
+    if text_embeddings is not None and encode_captions:
+        raise HTTPException(status_code=400, detail="Send text_embeddings or set encode_captions, not both")
+    
+    expected_dim = clip_model.config.projection_dim
+    rows, dim, dtype = read_npy_header(embeddings.file)
+    if dim != expected_dim:
+        raise HTTPException(status_code=400, detail=f"Embedding dimension {dim} does not match model dimension {expected_dim}")
+    text_dtype = None
+    if text_embeddings is not None:
+        text_rows, text_dim, text_dtype = read_npy_header(text_embeddings.file)
+        if (text_rows, text_dim) != (rows, expected_dim):
+            raise HTTPException(status_code=400, detail=f"text_embeddings must have shape ({rows}, {expected_dim})")
+    
+    has_text = text_embeddings is not None or encode_captions
+    if encode_captions:
+        admit("clip", budget)
+    
+    try:
+        chunks = import_chunks(
+            embeddings.file, rows, dim, dtype, items.file,
+            text_embeddings.file if text_embeddings is not None else None, text_dtype,
+            encode_captions, budget
+        )
+        references = await run_in_threadpool(
+            reference_store.import_chunks, collection, chunks, dim,
+            expected_dim if has_text else None, CLIP_MODEL_ID, mode == "append"
+        )
+        await update_reference_index(collection)
+        
+        logger.info(f"Imported {rows} precomputed references into '{collection}' ({references.version})")
+        
+        return JSONResponse({
+            "status": "success",
+            "collection": collection,
+            "version": references.version,
+            "imported": rows,
+            "count": len(references),
+            "text_embeddings": references.text_embeddings is not None
+        })
+        
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error importing references: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def stream_npy(matrix: np.ndarray):
+    """Yield a float32 matrix as .npy bytes, one chunk of rows at a time"""
+    header = io.BytesIO()
+    np.lib.format.write_array_header_1_0(
+        header, {"descr": "<f4", "fortran_order": False, "shape": tuple(matrix.shape)}
+    )
+    yield header.getvalue()
+    for start in range(0, matrix.shape[0], TRANSFER_CHUNK_ROWS):
+        yield np.ascontiguousarray(matrix[start:start + TRANSFER_CHUNK_ROWS], dtype="<f4").tobytes()
+
+def stream_items(items: List[dict]):
+    """Yield items as JSON lines in chunks"""
+    for start in range(0, len(items), TRANSFER_CHUNK_ROWS):
+        yield "".join(json.dumps(item) + "\n" for item in items[start:start + TRANSFER_CHUNK_ROWS])
+
+@app.get("/export_references")
+async def export_references(collection: str = DEFAULT_COLLECTION, part: str = "embeddings",
+                            snapshot: Optional[str] = None):
+    """
+    Stream one part of a collection: "embeddings" or "text_embeddings" as .npy,
+    or "items" as JSON lines
+
+    Appends keep the version, so the X-Reference-Snapshot header
+    ("<version>:<count>") identifies the exported rows. Pass it back as
+    snapshot when fetching the other parts and they cover exactly the same
+    rows even if rows were appended in between (409 once the collection was
+    replaced); the parts can then be fed to /import_references together.
+    """
+    references = reference_store.get(get_collection_name(collection))
+    if references is None:
+        raise HTTPException(status_code=404, detail=f"Collection '{collection}' does not exist")
+    if part not in ("embeddings", "text_embeddings", "items"):
+        raise HTTPException(status_code=400, detail="part must be 'embeddings', 'text_embeddings' or 'items'")
+    if part == "text_embeddings" and references.text_embeddings is None:
+        raise HTTPException(status_code=404, detail="Collection has no caption embeddings")
+    count = len(references)
+    if snapshot is not None:
+        version, _, rows = snapshot.rpartition(":")
+        if not version or not rows.isdigit():
+            raise HTTPException(status_code=400, detail="snapshot must be '<version>:<count>' as in X-Reference-Snapshot")
+        if version != references.version or int(rows) > count:
+            raise HTTPException(status_code=409, detail=f"Snapshot {snapshot} is gone: the collection is now "
+                                                        f"{references.version}:{count}")
+        count = int(rows)
+    
+    headers = {
+        "X-Model-Id": references.model_id or "",
+        "X-Reference-Version": references.version,
+        "X-Reference-Count": str(count),
+        "X-Reference-Snapshot": f"{references.version}:{count}",
+    }
+    if part == "items":
+        headers["Content-Disposition"] = f'attachment; filename="{references.collection}-items.jsonl"'
+        return StreamingResponse(stream_items(references.items[:count]), media_type="application/x-ndjson",
+                                 headers=headers)
+    
+    matrix = (references.embeddings if part == "embeddings" else references.text_embeddings)[:count]
+    headers["X-Embedding-Dim"] = str(matrix.shape[1])
+    headers["Content-Disposition"] = f'attachment; filename="{references.collection}-{part}.npy"'
+    return StreamingResponse(stream_npy(matrix), media_type="application/octet-stream", headers=headers)
+
+def generate_description(image: Image.Image) -> str:
+    """Caption an image with BLIP"""
+    inputs = blip_processor(image, return_tensors="pt").to(device)
+    with torch.no_grad():
+        out = blip_model.generate(**inputs, max_length=50, num_beams=5)
+    return blip_processor.decode(out[0], skip_special_tokens=True)
+
+def run_stable_diffusion(caption: str, num_inference_steps: int) -> Image.Image:
+    """Generate one 512x512 image for a caption"""
+    with torch.no_grad():
+        result = sd_pipeline(
+            caption,
+            num_inference_steps=num_inference_steps,
+            guidance_scale=7.5,
+            height=512,
+            width=512
+        )
+    return result.images[0]
+
+def generate_image_batch(captions: List[str], num_inference_steps: int, seed: int) -> torch.Tensor:
+    """Generate 512x512 images for several captions in one call, as (N, 3, H, W) tensors in [0, 1]"""
+    generator = torch.Generator(device=device).manual_seed(seed)
+    with torch.no_grad():
+        result = sd_pipeline(
+            captions,
+            num_inference_steps=num_inference_steps,
+            guidance_scale=7.5,
+            height=512,
+            width=512,
+            generator=generator,
+            output_type="pt"
+        )
+    return result.images
+
+def encode_generated(images: torch.Tensor, captions: Optional[List[str]]):
+    """CLIP image embeddings straight from generated tensors, plus caption embeddings if requested"""
+    size, mean, std = augment.clip_preprocessing(clip_processor)
+    pixel_values = augment.clip_pixel_values(images.to(device), size, mean, std).to(next(clip_model.parameters()).dtype)
+    with torch.no_grad():
+        image_features = clip_model.get_image_features(pixel_values=pixel_values)
+        image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+    text_embeddings = compute_clip_text_embeddings(captions) if captions is not None else None
+    return image_features.float().cpu().numpy(), text_embeddings
+
 @app.post("/describe")
-async def describe_image(file: UploadFile = File(...)):
+async def describe_image(
+    file: UploadFile = File(...),
+    budget: RequestBudget = Depends(request_budget("batch"))
+):
     """
     Generate a descriptive caption for an uploaded image
     """
+    admit("blip", budget)
+    
     try:
         # Read and preprocess image
         image_bytes = await file.read()
         image = preprocess_image(image_bytes)
         
         # Generate caption using BLIP
-        inputs = blip_processor(image, return_tensors="pt").to(device)
-        
-        with torch.no_grad():
-            out = blip_model.generate(**inputs, max_length=50, num_beams=5)
-        
-        description = blip_processor.decode(out[0], skip_special_tokens=True)
+        description = await lanes["blip"].run(generate_description, image, budget=budget)
         
         return JSONResponse({
             "description": description
         })
         
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         logger.error(f"Error describing image: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/generate")
-async def generate_image(caption: str = Form(...)):
+async def generate_image(
+    caption: str = Form(...),
+    num_inference_steps: int = Form(20),
+    budget: RequestBudget = Depends(request_budget("batch"))
+):
     """
     Generate a synthetic image based on a text caption
     """
+    admit("sd", budget)
+    
     try:
         # Generate image using Stable Diffusion
-        with torch.no_grad():
-            result = sd_pipeline(
-                caption,
-                num_inference_steps=20,
-                guidance_scale=7.5,
-                height=512,
-                width=512
-            )
-        
-        generated_image = result.images[0]
+        generated_image = await lanes["sd"].run(
+            run_stable_diffusion, caption, num_inference_steps, budget=budget
+        )
         
         # Convert to base64
         buffer = io.BytesIO()
@@ -246,13 +1308,135 @@ async def generate_image(caption: str = Form(...)):
             "caption": caption
         })
         
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         logger.error(f"Error generating image: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/augment_references")
+async def augment_references(
+    collection: str = Form(DEFAULT_COLLECTION),
+    templates: Optional[List[str]] = Form(None),
+    variants_per_caption: int = Form(1),
+    max_images: int = Form(32),
+    batch_size: int = Form(4),
+    num_inference_steps: int = Form(20),
+    min_similarity: float = Form(0.6),
+    max_similarity: float = Form(0.95),
+    seed: int = Form(0),
+    budget: RequestBudget = Depends(request_budget("batch"))
+):
+    """
+    Grow a collection with synthetic images generated from its own captions
+
+    Each caption is run through the templates (each containing "{caption}"),
+    up to max_images prompts. Images are generated batch_size at a time and
+    embedded without leaving the device; those whose best similarity to the
+    real references lies in [min_similarity, max_similarity] are appended
+    after every batch with source "synthetic" and their provenance. Rows
+    appended before an error stay in the collection.
+    """
+    collection = get_collection_name(collection)
+    references = reference_store.get(collection)
+    if references is None or len(references) == 0:
+        raise HTTPException(status_code=400, detail="No reference images uploaded for this collection.")
+    if not 1 <= batch_size <= AUGMENT_MAX_BATCH:
+        raise HTTPException(status_code=400, detail=f"batch_size must be between 1 and {AUGMENT_MAX_BATCH}")
+    if not 1 <= max_images <= AUGMENT_MAX_IMAGES:
+        raise HTTPException(status_code=400, detail=f"max_images must be between 1 and {AUGMENT_MAX_IMAGES}")
+    if variants_per_caption < 1 or num_inference_steps < 1:
+        raise HTTPException(status_code=400, detail="variants_per_caption and num_inference_steps must be positive")
+    if not -1.0 <= min_similarity <= max_similarity <= 1.0:
+        raise HTTPException(status_code=400, detail="Need -1 <= min_similarity <= max_similarity <= 1")
+    try:
+        prompts = augment.build_prompts(references.items, templates or augment.DEFAULT_TEMPLATES,
+                                        variants_per_caption, max_images)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not prompts:
+        raise HTTPException(status_code=400, detail="The collection has no real captions to build prompts from")
+    admit("sd", budget)
+    admit("clip", budget)
+    
+    try:
+        result = await run_in_threadpool(
+            augment.run, reference_store, collection, prompts,
+            lambda lane, fn, *args: lanes[lane].submit(fn, *args, budget=budget),
+            lambda captions, batch_seed: generate_image_batch(captions, num_inference_steps, batch_seed),
+            encode_generated, exact_similarities,
+            batch_size, min_similarity, max_similarity, seed,
+            {"generator": MODEL_IDS["sd"], "num_inference_steps": num_inference_steps},
+            CLIP_MODEL_ID
+        )
+        if result["accepted"]:
+            await update_reference_index(collection)
+        
+        logger.info(f"Augmented '{collection}': {result['accepted']} of {result['generated']} "
+                    f"synthetic images kept ({result['version']}, job {result['job']})")
+        
+        return JSONResponse({"status": "success", "collection": collection, **result})
+        
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error augmenting references: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/build_index")
+async def build_index(
+    collection: str = Form(DEFAULT_COLLECTION),
+    mode: str = Form(...),
+    pq_m: int = Form(0)
+):
+    """
+    Build, extend or drop a collection's compact index
+
+    mode: "float16" (half the bytes), "pq" (pq_m bytes per reference, default
+    dim / 16) or "float32" (drop the index and scan the full matrix).
+    """
+    collection = get_collection_name(collection)
+    if mode not in INDEX_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {list(INDEX_MODES)}")
+    if reference_store.get(collection) is None:
+        raise HTTPException(status_code=404, detail=f"Collection '{collection}' does not exist")
+    
+    try:
+        started = time.perf_counter()
+        references = await run_in_threadpool(reference_store.build_index, collection, mode, pq_m or None)
+        
+        return JSONResponse({
+            "status": "success",
+            "collection": collection,
+            "version": references.version,
+            "index": describe_index(references),
+            "build_seconds": round(time.perf_counter() - started, 3)
+        })
+        
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error building index: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def describe_index(references) -> dict:
+    """Index mode, coverage and bytes per reference scanned per query"""
+    if references.index is None:
+        return {"mode": "float32", "rows": len(references),
+                "bytes_per_reference": references.embeddings.shape[1] * 4}
+    return {
+        "mode": references.index.mode,
+        "rows": references.index.rows,
+        "unindexed_rows": len(references) - references.index.rows,
+        "bytes_per_reference": round(references.index.nbytes / max(1, references.index.rows), 2)
+    }
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
+    default_references = reference_store.get(DEFAULT_COLLECTION)
     return JSONResponse({
         "status": "healthy",
         "device": str(device),
@@ -261,7 +1445,29 @@ async def health_check():
             "blip": blip_model is not None,
             "stable_diffusion": sd_pipeline is not None
         },
-        "reference_count": len(reference_embeddings)
+        "lanes": {name: lane.stats() for name, lane in lanes.items()},
+        "model_load_seconds": model_load_timings,
+        "pid": os.getpid(),
+        "reference_count": len(default_references) if default_references is not None else 0,
+        "collections": {
+            name: len(reference_store.get(name) or [])
+            for name in reference_store.collections()
+        },
+        "indexes": {
+            name: describe_index(reference_store.get(name))
+            for name in reference_store.collections()
+        }
+    })
+
+@app.get("/metrics")
+async def metrics():
+    """Per-lane admission, shedding, expiry and utilization counters"""
+    return JSONResponse({
+        "pid": os.getpid(),
+        "lanes": {name: lane.stats() for name, lane in lanes.items()},
+        "audit": audit_log.stats() if audit_log is not None else None,
+        "streams": dict(stream_stats),
+        "near_duplicates": near_duplicates.stats() if near_duplicates is not None else None
     })
 
 @app.get("/")
@@ -273,9 +1479,17 @@ async def root():
         "endpoints": [
             "/upload_references - POST: Upload reference images with captions",
             "/classify - POST: Classify an image as Rare Event or Normal",
+            "/search - POST: Find the top-k references for a text or image query",
+            "/ws/classify - WebSocket: Stream frames for batched classification",
+            "/classify_video - POST: Classify sampled video frames into a segment timeline",
+            "/import_references - POST: Ingest precomputed embeddings (.npy) and captions",
+            "/export_references - GET: Stream a collection's embeddings (.npy) or items",
+            "/build_index - POST: Build a float16 or product-quantized reference index",
             "/describe - POST: Generate description for an image",
             "/generate - POST: Generate synthetic image from caption",
-            "/health - GET: Health check"
+            "/augment_references - POST: Generate, filter and append synthetic references",
+            "/health - GET: Health check",
+            "/metrics - GET: Lane admission and utilization counters"
         ]
     })
 
@@ -0,0 +1,260 @@
+"""
+Non-blocking audit log of classification results.
+
+The request path only calls `AuditLog.record()`, which puts a dict on a
+bounded in-memory queue and never blocks or touches the disk. A background
+thread drains the queue in batches and appends compact JSON lines to
+append-only files that rotate by size:
+
+    <AUDIT_DIR>/audit-<YYYYmmdd-HHMMSS>-<pid>-<seq>.jsonl
+
+When the queue is full, AUDIT_ON_FULL decides what is lost: "drop_newest"
+(default) rejects the incoming record, "drop_oldest" evicts the oldest
+buffered one to keep the most recent history. Either way the drop is counted
+and reported in stats().
+
+Configuration:
+    AUDIT_DIR             enable auditing and write files here
+    AUDIT_QUEUE_SIZE      buffered records before dropping (default 10000)
+    AUDIT_BATCH_SIZE      records per write (default 256)
+    AUDIT_FLUSH_INTERVAL  max seconds a record waits for its batch (default 1.0)
+    AUDIT_MAX_FILE_MB     rotate files after this size (default 64)
+    AUDIT_ON_FULL         drop_newest | drop_oldest
+
+Offline analysis:
+    python audit.py /var/log/rare-event-audit --collection default --since 2025-01-01
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DROP_NEWEST = "drop_newest"
+DROP_OLDEST = "drop_oldest"
+
+
+class AuditLog:
+    """Bounded queue plus a background writer producing rotating JSONL files"""
+
+    def __init__(self, directory: str, queue_size: int = 10000, batch_size: int = 256,
+                 flush_interval: float = 1.0, max_file_bytes: int = 64 * 1024 * 1024,
+                 on_full: str = DROP_NEWEST):
+        if on_full not in (DROP_NEWEST, DROP_OLDEST):
+            raise ValueError(f"Unknown AUDIT_ON_FULL policy: {on_full}")
+        self.directory = directory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_file_bytes = max_file_bytes
+        self.on_full = on_full
+        os.makedirs(directory, exist_ok=True)
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._enqueued = 0
+        self._dropped = 0
+        self._written = 0
+        self._batches = 0
+        self._files = 0
+        self._file = None
+        self._file_bytes = 0
+        self._thread = threading.Thread(target=self._writer, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_env(cls) -> Optional["AuditLog"]:
+        directory = os.getenv("AUDIT_DIR")
+        if not directory:
+            return None
+        return cls(
+            directory,
+            queue_size=int(os.getenv("AUDIT_QUEUE_SIZE", "10000")),
+            batch_size=int(os.getenv("AUDIT_BATCH_SIZE", "256")),
+            flush_interval=float(os.getenv("AUDIT_FLUSH_INTERVAL", "1.0")),
+            max_file_bytes=int(float(os.getenv("AUDIT_MAX_FILE_MB", "64")) * 1024 * 1024),
+            on_full=os.getenv("AUDIT_ON_FULL", DROP_NEWEST),
+        )
+
+    # ---- request path ----
+
+    def record(self, entry: dict) -> bool:
+        """Enqueue one record without blocking; returns False if it was dropped"""
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            evicted = accepted = False
+            if self.on_full == DROP_OLDEST:
+                try:
+                    self._queue.get_nowait()
+                    evicted = True
+                except queue.Empty:
+                    pass
+                try:
+                    # Another producer may have taken the freed slot
+                    self._queue.put_nowait(entry)
+                    accepted = True
+                except queue.Full:
+                    pass
+            with self._lock:
+                self._dropped += evicted + (not accepted)
+                self._enqueued += accepted
+            return accepted
+        with self._lock:
+            self._enqueued += 1
+        return True
+
+    # ---- background writer ----
+
+    def _next_batch(self) -> List[dict]:
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _writer(self):
+        while not self._stop.is_set() or not self._queue.empty():
+            batch = self._next_batch()
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    logger.error(f"Audit write failed, {len(batch)} records lost: {e}")
+                    with self._lock:
+                        self._dropped += len(batch)
+        if self._file is not None:
+            self._file.close()
+
+    def _open_file(self):
+        if self._file is not None:
+            self._file.close()
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(self.directory, f"audit-{stamp}-{os.getpid()}-{self._files}.jsonl")
+        self._file = open(path, "a", encoding="utf-8")
+        self._file_bytes = self._file.tell()
+        self._files += 1
+
+    def _write(self, batch: List[dict]):
+        if self._file is None or self._file_bytes >= self.max_file_bytes:
+            self._open_file()
+        data = "".join(json.dumps(entry, separators=(",", ":")) + "\n" for entry in batch)
+        self._file.write(data)
+        self._file.flush()
+        self._file_bytes += len(data)
+        with self._lock:
+            self._written += len(batch)
+            self._batches += 1
+
+    def close(self, timeout: float = 10.0):
+        """Flush everything still buffered and stop the writer"""
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "directory": self.directory,
+                "buffered": self._queue.qsize(),
+                "enqueued": self._enqueued,
+                "written": self._written,
+                "dropped": self._dropped,
+                "batches": self._batches,
+                "files": self._files,
+                "on_full": self.on_full,
+            }
+
+
+def _parse_time(value) -> Optional[float]:
+    if value is None or isinstance(value, (int, float)):
+        return value
+    return datetime.fromisoformat(value).timestamp()
+
+
+def read_audit(directory: str, since=None, until=None, collection: Optional[str] = None,
+               label: Optional[str] = None) -> Iterator[dict]:
+    """
+    Iterate audit records from all files in a directory, oldest file first
+
+    since/until accept epoch seconds or ISO-8601 strings. A torn last line left
+    by a crash mid-write is skipped.
+    """
+    since, until = _parse_time(since), _parse_time(until)
+    for path in sorted(glob.glob(os.path.join(directory, "audit-*.jsonl"))):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if since is not None and entry.get("ts", 0) < since:
+                    continue
+                if until is not None and entry.get("ts", 0) >= until:
+                    continue
+                if collection is not None and entry.get("collection") != collection:
+                    continue
+                if label is not None and entry.get("label") != label:
+                    continue
+                yield entry
+
+
+def to_columns(records) -> dict:
+    """Turn records into a dict of equal-length column lists (e.g. for pandas.DataFrame)"""
+    columns = {}
+    for i, entry in enumerate(records):
+        for key in entry:
+            if key not in columns:
+                columns[key] = [None] * i
+        for key, values in columns.items():
+            values.append(entry.get(key))
+    return columns
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query classification audit files")
+    parser.add_argument("directory")
+    parser.add_argument("--since")
+    parser.add_argument("--until")
+    parser.add_argument("--collection")
+    parser.add_argument("--label")
+    parser.add_argument("--summary", action="store_true", help="Print counts and latency instead of records")
+    args = parser.parse_args(argv)
+
+    records = read_audit(args.directory, args.since, args.until, args.collection, args.label)
+    if not args.summary:
+        for entry in records:
+            print(json.dumps(entry))
+        return 0
+
+    count, labels, latencies = 0, {}, []
+    for entry in records:
+        count += 1
+        labels[entry.get("label")] = labels.get(entry.get("label"), 0) + 1
+        latencies.append(entry.get("latency_ms", 0.0))
+    latencies.sort()
+    print(json.dumps({
+        "records": count,
+        "labels": labels,
+        "latency_p50_ms": latencies[len(latencies) // 2] if latencies else None,
+        "latency_max_ms": latencies[-1] if latencies else None,
+    }, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
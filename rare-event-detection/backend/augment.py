@@ -0,0 +1,246 @@
+"""
+Synthetic augmentation: generate, embed and grow a collection in one job.
+
+Prompts are built from a collection's captions through templates such as
+"{caption}, close-up". Stable Diffusion renders them in batches with
+output_type="pt", and the (N, 3, H, W) tensors in [0, 1] go straight into
+CLIP after an on-device resize, center crop and normalization; nothing is
+encoded to PNG or base64 on the way. While CLIP embeds one batch, Stable
+Diffusion already renders the next.
+
+A generated image is kept when its similarity falls inside a band:
+
+    below min_similarity   (best match among the real, non-synthetic
+                           references) it has drifted away from the rare event
+    above max_similarity   (best match among all rows, earlier survivors
+                           included) it is a near-copy and adds nothing
+
+Survivors are appended after every batch, so a long job grows the collection
+as it goes, and each row records where it came from in its "provenance".
+"""
+
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+DEFAULT_TEMPLATES = (
+    "{caption}",
+    "a close-up photo of {caption}",
+    "{caption}, different lighting",
+    "{caption}, seen from another angle",
+)
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+
+
+def is_synthetic(item: dict) -> bool:
+    return item.get("source") == "synthetic"
+
+
+def build_prompts(items: Sequence[dict], templates: Sequence[str], variants_per_caption: int,
+                  max_prompts: int) -> List[dict]:
+    """
+    Prompts for every real reference's caption, one template per variant
+
+    Ordered variant by variant across all captions, so a max_prompts cut
+    still covers as many source captions as possible. Synthetic rows are
+    skipped: templates applied to their captions would compound.
+    """
+    for template in templates:
+        if "{caption}" not in template:
+            raise ValueError(f"Template {template!r} has no {{caption}} placeholder")
+    prompts = []
+    for variant in range(variants_per_caption):
+        template = templates[variant % len(templates)]
+        for row, item in enumerate(items):
+            caption = item.get("caption", "")
+            if is_synthetic(item) or not caption.strip():
+                continue
+            if len(prompts) == max_prompts:
+                return prompts
+            prompts.append({"prompt": template.format(caption=caption), "template": template, "source_row": row})
+    return prompts
+
+
+def clip_preprocessing(processor) -> Tuple[int, Tuple[float, ...], Tuple[float, ...]]:
+    """Crop size, mean and std from a CLIPProcessor's image processor"""
+    image_processor = getattr(processor, "image_processor", None)
+    crop_size = getattr(image_processor, "crop_size", None) or {"height": 224}
+    size = crop_size["height"] if isinstance(crop_size, dict) else int(crop_size)
+    mean = tuple(getattr(image_processor, "image_mean", None) or CLIP_MEAN)
+    std = tuple(getattr(image_processor, "image_std", None) or CLIP_STD)
+    return size, mean, std
+
+
+def clip_pixel_values(images: torch.Tensor, size: int = 224, mean=CLIP_MEAN, std=CLIP_STD) -> torch.Tensor:
+    """The CLIP processor's resize, center crop and normalization as tensor ops on the images' device"""
+    height, width = images.shape[-2:]
+    scale = size / min(height, width)
+    resized = F.interpolate(images.float(), size=(max(size, round(height * scale)), max(size, round(width * scale))),
+                            mode="bicubic", align_corners=False, antialias=True)
+    top = (resized.shape[-2] - size) // 2
+    left = (resized.shape[-1] - size) // 2
+    cropped = resized[..., top:top + size, left:left + size].clamp(0.0, 1.0)
+    mean = torch.tensor(mean, device=images.device).view(1, 3, 1, 1)
+    std = torch.tensor(std, device=images.device).view(1, 3, 1, 1)
+    return (cropped - mean) / std
+
+
+def select_in_band(embeddings: np.ndarray, real_best: np.ndarray, overall_best: np.ndarray,
+                   min_similarity: float, max_similarity: float) -> Tuple[List[int], int, int]:
+    """Rows to keep, plus the counts rejected as off-topic and as redundant"""
+    kept, off_topic, redundant = [], 0, 0
+    for i in range(embeddings.shape[0]):
+        if real_best[i] < min_similarity:
+            off_topic += 1
+        elif overall_best[i] > max_similarity or (kept and float((embeddings[kept] @ embeddings[i]).max()) > max_similarity):
+            redundant += 1
+        else:
+            kept.append(i)
+    return kept, off_topic, redundant
+
+
+class StageStats:
+    """Busy seconds and items per pipeline stage; stages overlap, so the wall time is kept apart"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.seconds: Dict[str, float] = defaultdict(float)
+        self.items: Dict[str, int] = defaultdict(int)
+
+    def add(self, stage: str, seconds: float, items: int):
+        with self._lock:
+            self.seconds[stage] += seconds
+            self.items[stage] += items
+
+    def timed(self, stage: str, fn: Callable):
+        """Wrap fn so each call adds its duration, and the length of its first argument, to the stage"""
+        def wrapper(*args):
+            start = time.perf_counter()
+            result = fn(*args)
+            self.add(stage, time.perf_counter() - start, len(args[0]))
+            return result
+        return wrapper
+
+    def report(self) -> Dict[str, dict]:
+        with self._lock:
+            return {
+                stage: {
+                    "seconds": round(seconds, 3),
+                    "items": self.items[stage],
+                    "items_per_second": round(self.items[stage] / seconds, 2) if seconds > 0 else None,
+                }
+                for stage, seconds in self.seconds.items()
+            }
+
+
+def run(store, collection: str, prompts: List[dict],
+        submit: Callable[..., Future],
+        generate: Callable[[List[str], int], torch.Tensor],
+        encode: Callable[[torch.Tensor, Optional[List[str]]], Tuple[np.ndarray, Optional[np.ndarray]]],
+        similarities: Callable[[object, np.ndarray], np.ndarray],
+        batch_size: int, min_similarity: float, max_similarity: float, seed: int,
+        provenance: dict, model_id: Optional[str] = None) -> dict:
+    """
+    Generate, embed, filter and append prompts batch by batch
+
+    submit(lane, fn, *args) runs fn on the named model lane ("sd" or "clip")
+    and returns a Future. generate(prompts, seed) returns (N, 3, H, W) images
+    in [0, 1]; encode(images, prompts or None) returns normalized image
+    embeddings and, when prompts are given, their text embeddings.
+    similarities(references, embeddings) returns (N, R) scores in which
+    entries that were not scored exactly are -inf; they only decide the
+    redundancy check. The min_similarity check, and the similarity stored in
+    provenance, are scored exactly against the real rows.
+    """
+    references = store.get(collection)
+    if references is None or len(references) == 0:
+        raise ValueError("No reference images uploaded for this collection.")
+    # Synthetic rows, from this job or earlier ones, never vouch for being on-topic
+    real_rows = np.array([i for i, item in enumerate(references.items) if not is_synthetic(item)])
+    if len(real_rows) == 0:
+        raise ValueError("The collection has no real references to compare against")
+    version = references.version
+    with_text = references.text_embeddings is not None
+    provenance = {"job": uuid.uuid4().hex[:12], **provenance}
+
+    stats = StageStats()
+    generate = stats.timed("generate", generate)
+    encode = stats.timed("encode", encode)
+    batches = [prompts[start:start + batch_size] for start in range(0, len(prompts), batch_size)]
+    accepted, off_topic, redundant = 0, 0, 0
+    started = time.perf_counter()
+
+    def render(b: int) -> Future:
+        return submit("sd", generate, [p["prompt"] for p in batches[b]], seed + b * batch_size)
+
+    next_images = render(0) if batches else None
+    try:
+        for b, batch in enumerate(batches):
+            images = next_images.result()
+            # Keep SD busy on the next batch while CLIP embeds this one
+            next_images = render(b + 1) if b + 1 < len(batches) else None
+            texts = [p["prompt"] for p in batch] if with_text else None
+            image_embeddings, text_embeddings = submit("clip", encode, images, texts).result()
+            del images
+
+            filter_start = time.perf_counter()
+            references = store.get(collection)
+            if references is None or references.version != version:
+                # Appends keep the version; a new one means the rows were replaced under us
+                raise ValueError(f"Collection '{collection}' was replaced while augmenting")
+            # A real row outside the re-ranked candidates is -inf in the masked
+            # scores; acceptance hinges on these rows, so score them exactly
+            real_best = (image_embeddings @ references.embeddings[real_rows].T).max(axis=1)
+            overall_best = np.maximum(similarities(references, image_embeddings).max(axis=1), real_best)
+            kept, rejected_off_topic, rejected_redundant = select_in_band(
+                image_embeddings, real_best, overall_best, min_similarity, max_similarity
+            )
+            off_topic += rejected_off_topic
+            redundant += rejected_redundant
+            stats.add("filter", time.perf_counter() - filter_start, len(batch))
+
+            if not kept:
+                continue
+            store_start = time.perf_counter()
+            items = [
+                {
+                    "caption": batch[i]["prompt"],
+                    "source": "synthetic",
+                    "provenance": {
+                        **provenance,
+                        "template": batch[i]["template"],
+                        "source_row": batch[i]["source_row"],
+                        "source_version": version,
+                        "batch_seed": seed + b * batch_size,
+                        "batch_position": i,
+                        "similarity": round(float(real_best[i]), 4),
+                    },
+                }
+                for i in kept
+            ]
+            references = store.append(collection, image_embeddings[kept], items, model_id,
+                                      text_embeddings[kept] if with_text else None)
+            accepted += len(kept)
+            stats.add("store", time.perf_counter() - store_start, len(kept))
+    finally:
+        if next_images is not None:
+            next_images.cancel()
+
+    return {
+        "job": provenance["job"],
+        "version": references.version,
+        "count": len(references),
+        "generated": len(prompts),
+        "accepted": accepted,
+        "rejected": {"off_topic": off_topic, "redundant": redundant},
+        "stages": stats.report(),
+        "wall_seconds": round(time.perf_counter() - started, 3),
+    }
@@ -0,0 +1,295 @@
+"""
+Per-model execution lanes.
+
+Every model gets a lane: one dedicated worker thread with its own torch
+intra-op thread budget and, optionally, a CPU affinity mask. OpenMP/MKL thread
+counts and affinity are per calling thread, so a Stable Diffusion job running
+in its lane cannot take the cores reserved for CLIP, and interactive
+classification keeps its latency while generation runs on the same host.
+Endpoints submit work with `await lane.run(fn, ...)`, which also keeps the
+event loop free while a model is busy.
+
+Lanes also do admission control. Work carries a priority class (interactive
+before batch) and an optional deadline. A request whose estimated queue wait,
+derived from measured service and queue-wait times, exceeds its deadline or
+the class limit is shed up front (the API answers 429 with Retry-After), and
+queued work whose deadline has passed is dropped before it reaches the model.
+
+Configuration (per lane, NAME is CLIP, BLIP or SD):
+    NAME_THREADS   torch intra-op threads for the lane
+    NAME_CORES     optional CPU list to pin the lane to, e.g. "0-3" or "0,2,4"
+    LANE_THREAD_BUDGET  threads split between lanes without NAME_THREADS
+                        (default: the cores available to the process; serve.py
+                        sets it per worker, so N workers share the host)
+Admission limits (seconds of estimated queue wait, per priority class):
+    MAX_QUEUE_WAIT_INTERACTIVE   default 5
+    MAX_QUEUE_WAIT_BATCH         default 300
+"""
+
+import asyncio
+import itertools
+import logging
+import math
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+UTILIZATION_WINDOW = 60.0
+EWMA_ALPHA = 0.2
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+PRIORITY_NAMES = {"interactive": PRIORITY_INTERACTIVE, "batch": PRIORITY_BATCH}
+
+
+class DeadlineExceeded(Exception):
+    """Queued work whose deadline passed before it reached the model"""
+
+
+class LaneOverloaded(Exception):
+    """Work shed at admission because the estimated queue wait is too long"""
+
+    def __init__(self, lane: str, estimated_wait: float):
+        super().__init__(f"Lane '{lane}' overloaded: estimated queue wait {estimated_wait:.2f}s")
+        self.retry_after = max(1, math.ceil(estimated_wait))
+
+
+@dataclass
+class RequestBudget:
+    """Priority class and optional absolute deadline (time.monotonic()) of a request"""
+    priority: int = PRIORITY_INTERACTIVE
+    deadline: Optional[float] = None
+
+    @classmethod
+    def from_timeout(cls, priority: int, timeout_s: Optional[float]) -> "RequestBudget":
+        deadline = time.monotonic() + timeout_s if timeout_s is not None else None
+        return cls(priority, deadline)
+
+    def remaining(self) -> Optional[float]:
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+
+def ewma(previous: Optional[float], value: float) -> float:
+    """Exponentially weighted moving average seeded by the first sample"""
+    return value if previous is None else EWMA_ALPHA * value + (1 - EWMA_ALPHA) * previous
+
+
+def max_queue_waits() -> Dict[int, float]:
+    return {
+        PRIORITY_INTERACTIVE: float(os.getenv("MAX_QUEUE_WAIT_INTERACTIVE", "5")),
+        PRIORITY_BATCH: float(os.getenv("MAX_QUEUE_WAIT_BATCH", "300")),
+    }
+
+
+def parse_cpu_list(spec: Optional[str]) -> Optional[List[int]]:
+    """Parse "0-3,6" into [0, 1, 2, 3, 6]"""
+    if not spec:
+        return None
+    cores = []
+    for part in spec.split(","):
+        part = part.strip()
+        if "-" in part:
+            start, end = part.split("-")
+            cores.extend(range(int(start), int(end) + 1))
+        elif part:
+            cores.append(int(part))
+    return cores or None
+
+
+def available_cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class ModelLane:
+    """A single-threaded executor with its own CPU thread budget and utilization stats"""
+
+    def __init__(self, name: str, num_threads: int, cores: Optional[List[int]] = None):
+        self.name = name
+        self.num_threads = max(1, num_threads)
+        self.cores = cores
+        self.max_queue_wait = max_queue_waits()
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._queued = {p: 0 for p in PRIORITY_NAMES.values()}
+        self._admitted = {p: 0 for p in PRIORITY_NAMES.values()}
+        self._shed = {p: 0 for p in PRIORITY_NAMES.values()}
+        self._expired = {p: 0 for p in PRIORITY_NAMES.values()}
+        self._queue_wait_ewma = {p: None for p in PRIORITY_NAMES.values()}
+        self._service_ewma = None
+        self._busy_intervals = deque()  # (end_time, seconds) of recent jobs
+        self._busy_total = 0.0
+        self._completed = 0
+        self._failed = 0
+        self._running_since = None
+        self._started_at = time.monotonic()
+        self._thread = threading.Thread(target=self._worker, name=f"lane-{name}", daemon=True)
+        self._thread.start()
+
+    def _configure_thread(self):
+        if self.cores and hasattr(os, "sched_setaffinity"):
+            try:
+                # pid 0 is the calling thread; OpenMP workers it spawns inherit the mask
+                os.sched_setaffinity(0, self.cores)
+            except OSError as e:
+                logger.warning(f"Lane {self.name}: could not pin to cores {self.cores}: {e}")
+        # get_num_threads() runs torch's lazy per-thread init first; otherwise that
+        # init would later overwrite this thread's budget with the global default
+        torch.get_num_threads()
+        torch.set_num_threads(self.num_threads)
+
+    def _worker(self):
+        self._configure_thread()
+        while True:
+            priority, _, job = self._queue.get()
+            if job is None:
+                break
+            future, fn, args, budget, enqueued = job
+            with self._lock:
+                self._queued[priority] -= 1
+            if not future.set_running_or_notify_cancel():
+                continue
+            start = time.monotonic()
+            self._update_ewma(self._queue_wait_ewma, priority, start - enqueued)
+            if budget.expired():
+                # Nobody will collect this result any more; skip the model call
+                with self._lock:
+                    self._expired[priority] += 1
+                future.set_exception(DeadlineExceeded(
+                    f"Deadline passed after {start - enqueued:.2f}s in the '{self.name}' queue"))
+                continue
+            self._running_since = start
+            try:
+                future.set_result(fn(*args))
+                failed = False
+            except BaseException as e:
+                future.set_exception(e)
+                failed = True
+            finally:
+                self._running_since = None
+            self._record(start, time.monotonic(), failed)
+
+    def _update_ewma(self, table: dict, key, value: float):
+        with self._lock:
+            table[key] = ewma(table[key], value)
+
+    def _record(self, start: float, end: float, failed: bool):
+        with self._lock:
+            self._service_ewma = ewma(self._service_ewma, end - start)
+            self._busy_intervals.append((end, end - start))
+            self._busy_total += end - start
+            if failed:
+                self._failed += 1
+            else:
+                self._completed += 1
+            self._trim(end)
+
+    def _trim(self, now: float):
+        while self._busy_intervals and self._busy_intervals[0][0] < now - UTILIZATION_WINDOW:
+            self._busy_intervals.popleft()
+
+    def estimated_wait(self, priority: int) -> float:
+        """Expected queue wait for new work of this class, from measured timings"""
+        with self._lock:
+            running_since = self._running_since
+            queued = sum(n for p, n in self._queued.items() if p <= priority)
+            if queued == 0 and running_since is None:
+                return 0.0
+            # Until the first job finishes, the running job's age is the best service estimate
+            elapsed = time.monotonic() - running_since if running_since is not None else 0.0
+            service = max(self._service_ewma or 0.0, elapsed)
+            backlog = (queued + (1 if running_since is not None else 0)) * service - elapsed
+            # Backlog times measured service time, floored by the recently measured wait
+            return max(backlog, self._queue_wait_ewma[priority] or 0.0)
+
+    def admit(self, budget: RequestBudget):
+        """Shed work early (LaneOverloaded) when it cannot start within its budget"""
+        estimate = self.estimated_wait(budget.priority)
+        limit = self.max_queue_wait[budget.priority]
+        remaining = budget.remaining()
+        if remaining is not None:
+            limit = min(limit, remaining)
+        if estimate > limit or (remaining is not None and remaining <= 0):
+            with self._lock:
+                self._shed[budget.priority] += 1
+            raise LaneOverloaded(self.name, estimate)
+        with self._lock:
+            self._admitted[budget.priority] += 1
+
+    def submit(self, fn, *args, budget: Optional[RequestBudget] = None) -> Future:
+        budget = budget or RequestBudget()
+        future = Future()
+        with self._lock:
+            self._queued[budget.priority] += 1
+        self._queue.put((budget.priority, next(self._sequence),
+                         (future, fn, args, budget, time.monotonic())))
+        return future
+
+    async def run(self, fn, *args, budget: Optional[RequestBudget] = None):
+        """Run fn in this lane and await its result without blocking the event loop"""
+        return await asyncio.wrap_future(self.submit(fn, *args, budget=budget))
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            window = min(UTILIZATION_WINDOW, now - self._started_at) or 1e-9
+            recent_busy = sum(seconds for _, seconds in self._busy_intervals)
+            by_class = {
+                name: {
+                    "queued": self._queued[p],
+                    "admitted": self._admitted[p],
+                    "shed": self._shed[p],
+                    "expired": self._expired[p],
+                    "queue_wait_ms": round(1000 * (self._queue_wait_ewma[p] or 0.0), 2),
+                }
+                for name, p in PRIORITY_NAMES.items()
+            }
+            return {
+                "threads": self.num_threads,
+                "cores": self.cores,
+                "queue_depth": sum(self._queued.values()),
+                "running": self._running_since is not None,
+                "completed": self._completed,
+                "failed": self._failed,
+                "busy_seconds": round(self._busy_total, 3),
+                "utilization": round(min(1.0, recent_busy / window), 3),
+                "service_ms": round(1000 * (self._service_ewma or 0.0), 2),
+                "classes": by_class,
+            }
+
+    def shutdown(self):
+        self._queue.put((sys.maxsize, next(self._sequence), None))
+
+
+def create_lanes(names=("clip", "blip", "sd")) -> Dict[str, ModelLane]:
+    """Build one lane per model from the environment, splitting the thread budget by default"""
+    total = int(os.getenv("LANE_THREAD_BUDGET", "0")) or available_cores()
+    # By default the interactive models get a quarter of the cores each, generation the rest
+    defaults = {"clip": max(1, total // 4), "blip": max(1, total // 4)}
+    defaults["sd"] = max(1, total - defaults["clip"] - defaults["blip"])
+
+    lanes = {}
+    for name in names:
+        prefix = name.upper()
+        threads = int(os.getenv(f"{prefix}_THREADS", defaults.get(name, 1)))
+        cores = parse_cpu_list(os.getenv(f"{prefix}_CORES"))
+        lanes[name] = ModelLane(name, threads, cores)
+        logger.info(f"Lane {name}: {threads} threads" + (f", cores {cores}" if cores else ""))
+    return lanes
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Model loading from local snapshots, with per-phase timings.
+
+With MODEL_DIR set, every model loads from <MODEL_DIR>/<name> with
+local_files_only, and the hub is never contacted (HF_HUB_OFFLINE is set
+before the libraries are imported, which is when they read it), which is
+what air-gapped nodes need. Snapshots written by this script hold
+safetensors weights, which are memory-mapped instead of unpickled; with
+low_cpu_mem_usage the weights go straight into the model without a randomly
+initialised copy first. CLIP, BLIP and Stable Diffusion load concurrently,
+and each load is timed in phases:
+
+    resolve      locate the snapshot and the weight files that will be loaded
+    read         pull weight files into the page cache with large sequential reads
+    wait         wait for another model's deserialize phase to finish
+    deserialize  from_pretrained: build modules and map tensors
+    device       move to the target device
+
+Only one deserialize phase runs at a time: from_pretrained switches torch's
+process-wide default dtype while it builds a model (float16 for SD on CUDA),
+and a model built concurrently would pick it up. Reads and device transfers,
+the bulk of the time on cold storage, still overlap.
+
+Create a snapshot once, on a machine with network access:
+    python model_store.py --output /models
+and start the service with MODEL_DIR=/models.
+"""
+
+import argparse
+import glob
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+if os.getenv("MODEL_DIR"):
+    # huggingface_hub and transformers read these once, at import time
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+import torch
+from diffusers import StableDiffusionPipeline
+from transformers import BlipForConditionalGeneration, BlipProcessor, CLIPModel, CLIPProcessor
+
+logger = logging.getLogger(__name__)
+
+MODEL_IDS = {
+    "clip": "openai/clip-vit-base-patch32",
+    "blip": "Salesforce/blip-image-captioning-base",
+    "sd": "runwayml/stable-diffusion-v1-5",
+}
+WEIGHT_PATTERNS = ("*.safetensors", "*.bin")
+# Precision variants such as unet/diffusion_pytorch_model.fp16.safetensors are not loaded without variant=
+VARIANT_WEIGHTS = re.compile(r"\.(fp16|fp32|bf16|ema|non_ema)\.(safetensors|bin)$")
+READ_CHUNK_BYTES = 16 * 1024 * 1024
+
+_deserialize_lock = threading.Lock()
+
+
+class PhaseTimer:
+    """Wall-clock seconds per named phase of one model load"""
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+
+    @contextmanager
+    def deserialize(self):
+        """The deserialize phase, holding the process-wide lock (waiting is timed separately)"""
+        with self.phase("wait"):
+            _deserialize_lock.acquire()
+        try:
+            with self.phase("deserialize"):
+                yield
+        finally:
+            _deserialize_lock.release()
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round(self.phases.get(name, 0.0) + time.perf_counter() - start, 3)
+
+    def as_dict(self) -> Dict[str, float]:
+        return {**self.phases, "total": round(sum(self.phases.values()), 3)}
+
+
+def model_dir() -> Optional[str]:
+    return os.getenv("MODEL_DIR") or None
+
+
+def resolve(name: str):
+    """Return (path or hub id, local_files_only, weight files) for a model"""
+    root = model_dir()
+    if root is None:
+        return MODEL_IDS[name], os.getenv("HF_HUB_OFFLINE") == "1", []
+    path = os.path.join(root, name)
+    if not os.path.isdir(path):
+        raise FileNotFoundError(f"No local snapshot for '{name}' at {path}; create one with model_store.py --output")
+    return path, True, weight_files(path)
+
+
+def weight_files(path: str):
+    """Weight files from_pretrained will read: per directory, safetensors if present, else .bin"""
+    by_directory: Dict[str, Dict[str, list]] = {}
+    for pattern in WEIGHT_PATTERNS:
+        for file in glob.glob(os.path.join(path, "**", pattern), recursive=True):
+            if VARIANT_WEIGHTS.search(file):
+                continue
+            by_directory.setdefault(os.path.dirname(file), {}).setdefault(pattern, []).append(file)
+    return sorted(
+        file for found in by_directory.values()
+        for file in found.get("*.safetensors") or found.get("*.bin", [])
+    )
+
+
+def prefetch(files):
+    """Read files once so later page faults in the mmap'd weights hit the page cache"""
+    buffer = bytearray(READ_CHUNK_BYTES)
+    total = 0
+    for path in files:
+        with open(path, "rb", buffering=0) as f:
+            while True:
+                n = f.readinto(buffer)
+                if not n:
+                    break
+                total += n
+    return total
+
+
+def _safetensors_only(weights) -> Optional[bool]:
+    # Force mmap'd safetensors when the snapshot has them; otherwise let the library decide
+    return True if any(path.endswith(".safetensors") for path in weights) else None
+
+
+def load_clip(device):
+    timer = PhaseTimer()
+    with timer.phase("resolve"):
+        path, local_only, weights = resolve("clip")
+    with timer.phase("read"):
+        prefetch(weights)
+    with timer.deserialize():
+        model = CLIPModel.from_pretrained(path, local_files_only=local_only, low_cpu_mem_usage=True,
+                                          use_safetensors=_safetensors_only(weights))
+        processor = CLIPProcessor.from_pretrained(path, local_files_only=local_only)
+    with timer.phase("device"):
+        model.to(device)
+        model.eval()
+    return (model, processor), timer
+
+
+def load_blip(device):
+    timer = PhaseTimer()
+    with timer.phase("resolve"):
+        path, local_only, weights = resolve("blip")
+    with timer.phase("read"):
+        prefetch(weights)
+    with timer.deserialize():
+        model = BlipForConditionalGeneration.from_pretrained(
+            path, local_files_only=local_only, low_cpu_mem_usage=True, use_safetensors=_safetensors_only(weights)
+        )
+        processor = BlipProcessor.from_pretrained(path, local_files_only=local_only)
+    with timer.phase("device"):
+        model.to(device)
+        model.eval()
+    return (model, processor), timer
+
+
+def load_sd(device):
+    timer = PhaseTimer()
+    with timer.phase("resolve"):
+        path, local_only, weights = resolve("sd")
+    with timer.phase("read"):
+        prefetch(weights)
+    with timer.deserialize():
+        pipeline = StableDiffusionPipeline.from_pretrained(
+            path,
+            torch_dtype=torch.float16 if device.type == "cuda" else torch.float32,
+            local_files_only=local_only,
+            low_cpu_mem_usage=True,
+            use_safetensors=_safetensors_only(weights)
+        )
+    with timer.phase("device"):
+        pipeline.to(device)
+    return pipeline, timer
+
+
+LOADERS = {"clip": load_clip, "blip": load_blip, "sd": load_sd}
+
+
+def load_all(device, names=("clip", "blip", "sd")):
+    """Load the models concurrently, returning ({name: model}, {name: phase timings})"""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(names), thread_name_prefix="load") as pool:
+        futures = {name: pool.submit(LOADERS[name], device) for name in names}
+        results = {name: future.result() for name, future in futures.items()}
+    models = {name: result[0] for name, result in results.items()}
+    timings = {name: result[1].as_dict() for name, result in results.items()}
+    timings["wall"] = round(time.perf_counter() - start, 3)
+    return models, timings
+
+
+def snapshot(output: str, names=("clip", "blip", "sd")):
+    """Download the models once and save them as safetensors snapshots under output/<name>"""
+    savers = {
+        "clip": (CLIPModel, CLIPProcessor),
+        "blip": (BlipForConditionalGeneration, BlipProcessor),
+    }
+    for name in names:
+        path = os.path.join(output, name)
+        logger.info(f"Saving {MODEL_IDS[name]} to {path}")
+        if name == "sd":
+            StableDiffusionPipeline.from_pretrained(MODEL_IDS[name]).save_pretrained(path, safe_serialization=True)
+            continue
+        model_class, processor_class = savers[name]
+        model_class.from_pretrained(MODEL_IDS[name]).save_pretrained(path, safe_serialization=True)
+        processor_class.from_pretrained(MODEL_IDS[name]).save_pretrained(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Snapshot the models for offline, mmap-based loading")
+    parser.add_argument("--output", required=True, help="Directory to use as MODEL_DIR")
+    parser.add_argument("--models", nargs="+", default=list(MODEL_IDS), choices=list(MODEL_IDS))
+    parser.add_argument("--check", action="store_true", help="Load the snapshot back and print phase timings")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    snapshot(args.output, args.models)
+    if args.check:
+        # Loads with local_files_only; the offline variables only take effect for a fresh process
+        os.environ["MODEL_DIR"] = args.output
+        _, timings = load_all(torch.device("cpu"), args.models)
+        print(timings)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
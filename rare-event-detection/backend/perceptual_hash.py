@@ -0,0 +1,149 @@
+"""
+Perceptual hashes and a bounded near-duplicate index.
+
+Near-identical frames (consecutive frames of a static camera, re-encodes of
+the same photo) differ byte for byte, but their 64-bit perceptual hashes are
+only a few bits apart. The index keeps the most recent hashes together with
+their CLIP embeddings. A new image within max_distance bits of one of them
+reuses that embedding and skips the model.
+
+Both hashes only see luminance, so two flat images of different colors hash
+the same. Every entry therefore also keeps the mean color of each cell of a
+2x2 grid, and a hash match only counts when no channel of any cell differs
+by more than max_color_distance.
+
+Configuration:
+    NEAR_DUPLICATE_CACHE_SIZE      recent hashes to keep (default 0 = disabled)
+    NEAR_DUPLICATE_MAX_DISTANCE    Hamming distance still counted as a match (default 4)
+    NEAR_DUPLICATE_HASH            dhash (default, cheapest) or phash (DCT, more robust)
+    NEAR_DUPLICATE_MAX_COLOR_DISTANCE  largest per-channel mean color difference, 0-255 (default 16)
+"""
+
+import os
+import threading
+from typing import Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+HASH_BITS = 64
+COLOR_GRID = 2
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _pack(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def dhash(image: Image.Image) -> int:
+    """Difference hash: sign of horizontal gradients on a 9x8 grayscale thumbnail"""
+    pixels = np.asarray(image.convert("L").resize((9, 8), Image.BOX), dtype=np.int16)
+    return _pack((pixels[:, 1:] > pixels[:, :-1]).flatten())
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)
+    matrix = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+_DCT_32 = _dct_matrix(32)
+
+
+def phash(image: Image.Image) -> int:
+    """DCT hash: low 8x8 frequencies of a 32x32 grayscale thumbnail against their median"""
+    pixels = np.asarray(image.convert("L").resize((32, 32), Image.BOX), dtype=np.float64)
+    low = (_DCT_32 @ pixels @ _DCT_32.T)[:8, :8].flatten()
+    # The DC term only encodes brightness; leave it out of the median
+    return _pack(low > np.median(low[1:]))
+
+
+HASHES = {"dhash": dhash, "phash": phash}
+
+
+def color_signature(image: Image.Image) -> np.ndarray:
+    """Mean RGB of each cell of a COLOR_GRID x COLOR_GRID grid"""
+    cells = image.convert("RGB").resize((COLOR_GRID, COLOR_GRID), Image.BOX)
+    return np.asarray(cells, dtype=np.int16).flatten()
+
+
+ImageKey = Tuple[int, np.ndarray]
+
+
+class NearDuplicateIndex:
+    """Fixed-size ring of recent (hash, colors, value) entries searched by Hamming distance"""
+
+    def __init__(self, capacity: int, max_distance: int = 4, algorithm: str = "dhash",
+                 max_color_distance: int = 16):
+        if algorithm not in HASHES:
+            raise ValueError(f"Unknown hash algorithm {algorithm!r}, expected one of {list(HASHES)}")
+        self.capacity = capacity
+        self.max_distance = max_distance
+        self.algorithm = algorithm
+        self.max_color_distance = max_color_distance
+        self._hash = HASHES[algorithm]
+        self._hashes = np.zeros(capacity, dtype=np.uint64)
+        self._colors = np.zeros((capacity, COLOR_GRID * COLOR_GRID * 3), dtype=np.int16)
+        self._values = [None] * capacity
+        self._size = 0
+        self._next = 0
+        self._lock = threading.Lock()
+        self._lookups = 0
+        self._hits = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["NearDuplicateIndex"]:
+        capacity = int(os.getenv("NEAR_DUPLICATE_CACHE_SIZE", "0"))
+        if capacity <= 0:
+            return None
+        return cls(
+            capacity,
+            max_distance=int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", "4")),
+            algorithm=os.getenv("NEAR_DUPLICATE_HASH", "dhash"),
+            max_color_distance=int(os.getenv("NEAR_DUPLICATE_MAX_COLOR_DISTANCE", "16")),
+        )
+
+    def hash(self, image: Image.Image) -> ImageKey:
+        """Perceptual hash and color signature of an image, as passed to lookup and add"""
+        return self._hash(image), color_signature(image)
+
+    def lookup(self, key: ImageKey) -> Optional[Tuple[object, int]]:
+        """Return (value, distance) of the closest recent hash within max_distance and of a similar color"""
+        image_hash, colors = key
+        with self._lock:
+            self._lookups += 1
+            if self._size == 0:
+                return None
+            differing = (self._hashes[:self._size] ^ np.uint64(image_hash)).view(np.uint8)
+            distances = _POPCOUNT[differing].reshape(self._size, 8).sum(axis=1).astype(np.int16)
+            color_gaps = np.abs(self._colors[:self._size] - colors).max(axis=1)
+            distances[color_gaps > self.max_color_distance] = HASH_BITS + 1
+            best = int(distances.argmin())
+            if distances[best] > self.max_distance:
+                return None
+            self._hits += 1
+            return self._values[best], int(distances[best])
+
+    def add(self, key: ImageKey, value):
+        """Remember a value, evicting the oldest entry once full"""
+        image_hash, colors = key
+        with self._lock:
+            self._hashes[self._next] = image_hash
+            self._colors[self._next] = colors
+            self._values[self._next] = value
+            self._next = (self._next + 1) % self.capacity
+            self._size = min(self._size + 1, self.capacity)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "algorithm": self.algorithm,
+                "capacity": self.capacity,
+                "entries": self._size,
+                "max_distance": self.max_distance,
+                "max_color_distance": self.max_color_distance,
+                "lookups": self._lookups,
+                "hits": self._hits,
+                "hit_rate": round(self._hits / self._lookups, 4) if self._lookups else 0.0,
+            }
@@ -0,0 +1,502 @@
+"""
+Reference embeddings shared between worker processes.
+
+Each collection lives in its own directory under the store root:
+
+    <root>/<collection>/CURRENT                 name of the live version directory
+    <root>/<collection>/v<N>/meta.json          dim, row count and model id
+    <root>/<collection>/v<N>/embeddings.f32     raw float32 image embeddings, row-major
+    <root>/<collection>/v<N>/text_embeddings.f32  caption text embeddings, same rows
+    <root>/<collection>/v<N>/items.jsonl        one JSON object per row (caption, ...)
+    <root>/<collection>/v<N>/INDEX              optional compact index: mode, rows, directory
+    <root>/<collection>/v<N>/index<K>/          float16 rows or PQ codebooks and codes
+
+Readers memory-map the embedding file read-only, so every worker shares one
+page-cache copy instead of holding its own. Writers publish under an flock and
+bump a global generation counter kept in a small mmap'd file; readers compare
+it with the value they last saw (a plain memory read) and only re-open a
+collection after it changed.
+"""
+
+import fcntl
+import json
+import mmap
+import os
+import re
+import shutil
+import struct
+import threading
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from compact_index import INDEX_MODES, default_pq_m, encode_pq, load_index, train_pq
+
+DEFAULT_COLLECTION = "default"
+COLLECTION_NAME = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+GENERATION_FILE = "GENERATION"
+LOCK_FILE = "LOCK"
+CURRENT_FILE = "CURRENT"
+EMBEDDINGS_FILE = "embeddings.f32"
+TEXT_EMBEDDINGS_FILE = "text_embeddings.f32"
+ITEMS_FILE = "items.jsonl"
+META_FILE = "meta.json"
+INDEX_FILE = "INDEX"
+INDEX_CHUNK_ROWS = 65536
+
+
+@dataclass
+class ReferenceSet:
+    """Read-only view of one collection version"""
+    collection: str
+    version: str
+    embeddings: np.ndarray
+    items: List[dict]
+    model_id: Optional[str] = None
+    text_embeddings: Optional[np.ndarray] = None
+    index: Optional[object] = None
+    index_info: Optional[dict] = None
+
+    @property
+    def captions(self) -> List[str]:
+        return [item.get("caption", "") for item in self.items]
+
+    def __len__(self) -> int:
+        return self.embeddings.shape[0]
+
+
+def validate_collection_name(name: str) -> str:
+    """Reject names that could escape the store root"""
+    if not COLLECTION_NAME.match(name) or name in (".", ".."):
+        raise ValueError(f"Invalid collection name: {name!r}")
+    return name
+
+
+def _as_matrix(embeddings: np.ndarray, rows: int, name: str) -> np.ndarray:
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    if embeddings.ndim != 2 or embeddings.shape[0] != rows:
+        raise ValueError(f"{name} must be a (rows, dim) matrix with one item per row")
+    return embeddings
+
+
+def _open_rows(path: str, dim: int, start_row: int, itemsize: int = 4):
+    """Open a row file positioned at start_row, dropping anything a failed writer left past it"""
+    f = open(path, "r+b" if os.path.exists(path) else "wb")
+    f.seek(start_row * dim * itemsize)
+    f.truncate()
+    return f
+
+
+def _write_rows(path: str, embeddings: np.ndarray, start_row: int):
+    """Write rows at start_row"""
+    with _open_rows(path, embeddings.shape[1], start_row) as f:
+        embeddings.tofile(f)
+
+
+def _map_rows(path: str, count: int, dim: int) -> np.ndarray:
+    if count == 0:
+        return np.empty((0, dim), dtype=np.float32)
+    return np.memmap(path, dtype=np.float32, mode="r", shape=(count, dim))
+
+
+def _write_atomic(path: str, data: str):
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "w") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class ReferenceStore:
+    """mmap-backed reference store visible to every worker using the same root"""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+        generation_path = os.path.join(root, GENERATION_FILE)
+        fd = os.open(generation_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < 8:
+                os.ftruncate(fd, 8)
+            self._generation_map = mmap.mmap(fd, 8)
+        finally:
+            os.close(fd)
+
+        self._lock_path = os.path.join(root, LOCK_FILE)
+        # Writers hold _write_lock for their whole (possibly long) write; readers only
+        # take _cache_lock around the cache check and the swap, never the writer's lock
+        self._write_lock = threading.RLock()
+        self._cache_lock = threading.Lock()
+        self._lock_depth = 0
+        self._cache: Dict[str, ReferenceSet] = {}
+        self._checked: Dict[str, int] = {}
+        self._item_offsets: Dict[str, int] = {}
+
+    # ---- generation counter / locking ----
+
+    def generation(self) -> int:
+        return struct.unpack_from("<Q", self._generation_map)[0]
+
+    def _bump_generation(self):
+        struct.pack_into("<Q", self._generation_map, 0, self.generation() + 1)
+        self._generation_map.flush()
+
+    @contextmanager
+    def _locked(self):
+        """Exclusive, re-entrant lock across threads and processes"""
+        with self._write_lock:
+            if self._lock_depth:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            with open(self._lock_path, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._lock_depth = 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth = 0
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # ---- paths / metadata ----
+
+    def _collection_dir(self, collection: str) -> str:
+        return os.path.join(self.root, validate_collection_name(collection))
+
+    def _current_version(self, collection: str) -> Optional[str]:
+        try:
+            with open(os.path.join(self._collection_dir(collection), CURRENT_FILE)) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def _read_meta(self, collection: str, version: str) -> dict:
+        with open(os.path.join(self._collection_dir(collection), version, META_FILE)) as f:
+            return json.load(f)
+
+    def _read_index_info(self, version_dir: str) -> Optional[dict]:
+        try:
+            with open(os.path.join(version_dir, INDEX_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def collections(self) -> List[str]:
+        return sorted(
+            name for name in os.listdir(self.root)
+            if os.path.isfile(os.path.join(self.root, name, CURRENT_FILE))
+        )
+
+    # ---- writers ----
+
+    def replace(self, collection: str, embeddings: np.ndarray, items: List[dict],
+                model_id: Optional[str] = None,
+                text_embeddings: Optional[np.ndarray] = None) -> ReferenceSet:
+        """Publish a new version of a collection, replacing all rows"""
+        embeddings = _as_matrix(embeddings, len(items), "embeddings")
+        if text_embeddings is not None:
+            text_embeddings = _as_matrix(text_embeddings, len(items), "text_embeddings")
+
+        collection_dir = self._collection_dir(collection)
+        with self._locked():
+            os.makedirs(collection_dir, exist_ok=True)
+            previous = self._current_version(collection)
+            number = int(previous[1:]) + 1 if previous else 1
+            version = f"v{number}"
+            version_dir = os.path.join(collection_dir, version)
+            os.makedirs(version_dir, exist_ok=True)
+
+            _write_rows(os.path.join(version_dir, EMBEDDINGS_FILE), embeddings, 0)
+            if text_embeddings is not None:
+                _write_rows(os.path.join(version_dir, TEXT_EMBEDDINGS_FILE), text_embeddings, 0)
+            with open(os.path.join(version_dir, ITEMS_FILE), "w") as f:
+                for item in items:
+                    f.write(json.dumps(item) + "\n")
+            meta = {
+                "dim": int(embeddings.shape[1]),
+                "text_dim": int(text_embeddings.shape[1]) if text_embeddings is not None else None,
+                "count": int(embeddings.shape[0]),
+                "model_id": model_id,
+            }
+            _write_atomic(os.path.join(version_dir, META_FILE), json.dumps(meta))
+            _write_atomic(os.path.join(collection_dir, CURRENT_FILE), version)
+            self._bump_generation()
+            self._prune_versions(collection_dir, version, previous)
+
+        return self.get(collection)
+
+    def _prune_versions(self, collection_dir: str, version: str, previous: Optional[str]):
+        # Keep the previous version around for readers that are mid-reload
+        for name in os.listdir(collection_dir):
+            if name.startswith("v") and name not in (version, previous):
+                shutil.rmtree(os.path.join(collection_dir, name), ignore_errors=True)
+
+    def append(self, collection: str, embeddings: np.ndarray, items: List[dict],
+               model_id: Optional[str] = None,
+               text_embeddings: Optional[np.ndarray] = None) -> ReferenceSet:
+        """Append rows to the live version of a collection (created if missing)"""
+        embeddings = _as_matrix(embeddings, len(items), "embeddings")
+        if text_embeddings is not None:
+            text_embeddings = _as_matrix(text_embeddings, len(items), "text_embeddings")
+
+        with self._locked():
+            version = self._current_version(collection)
+            if version is None:
+                return self.replace(collection, embeddings, items, model_id, text_embeddings)
+
+            version_dir = os.path.join(self._collection_dir(collection), version)
+            meta = self._read_meta(collection, version)
+            if embeddings.shape[1] != meta["dim"]:
+                raise ValueError(f"Embedding dimension {embeddings.shape[1]} does not match "
+                                 f"collection dimension {meta['dim']}")
+            text_dim = meta.get("text_dim")
+            if (text_embeddings is None) != (text_dim is None):
+                raise ValueError("Text embeddings must be provided exactly when the collection has them")
+            if text_embeddings is not None and text_embeddings.shape[1] != text_dim:
+                raise ValueError(f"Text embedding dimension {text_embeddings.shape[1]} does not match "
+                                 f"collection dimension {text_dim}")
+
+            # Rows go in before the count is published, so readers never see partial data
+            _write_rows(os.path.join(version_dir, EMBEDDINGS_FILE), embeddings, meta["count"])
+            if text_embeddings is not None:
+                _write_rows(os.path.join(version_dir, TEXT_EMBEDDINGS_FILE), text_embeddings, meta["count"])
+            with open(os.path.join(version_dir, ITEMS_FILE), "a") as f:
+                for item in items:
+                    f.write(json.dumps(item) + "\n")
+            meta["count"] += int(embeddings.shape[0])
+            _write_atomic(os.path.join(version_dir, META_FILE), json.dumps(meta))
+            self._bump_generation()
+
+        return self.get(collection)
+
+    def import_chunks(self, collection: str,
+                      chunks: Iterable[Tuple[np.ndarray, List[dict], Optional[np.ndarray]]],
+                      dim: int, text_dim: Optional[int] = None, model_id: Optional[str] = None,
+                      append: bool = False) -> ReferenceSet:
+        """
+        Write (embeddings, items, text_embeddings) chunks and publish them once at the end
+
+        Memory stays bounded by one chunk, so arbitrarily large imports work.
+        Without append a fresh version is built next to the live one; with
+        append the live version is extended. Either way readers see the old
+        rows until every chunk is written, and nothing if a chunk fails.
+        """
+        collection_dir = self._collection_dir(collection)
+        with self._locked():
+            os.makedirs(collection_dir, exist_ok=True)
+            previous = self._current_version(collection)
+            if append and previous is not None:
+                version = previous
+                meta = self._read_meta(collection, version)
+                if (meta["dim"], meta.get("text_dim")) != (dim, text_dim):
+                    raise ValueError(f"Import dimensions (dim={dim}, text_dim={text_dim}) do not match the "
+                                     f"collection (dim={meta['dim']}, text_dim={meta.get('text_dim')})")
+                if None not in (model_id, meta.get("model_id")) and model_id != meta["model_id"]:
+                    raise ValueError(f"Model id {model_id!r} does not match the collection's {meta['model_id']!r}")
+            else:
+                version = f"v{int(previous[1:]) + 1}" if previous else "v1"
+                meta = {"dim": dim, "text_dim": text_dim, "count": 0, "model_id": model_id}
+            fresh = version != previous
+            version_dir = os.path.join(collection_dir, version)
+            os.makedirs(version_dir, exist_ok=True)
+            items_path = os.path.join(version_dir, ITEMS_FILE)
+            items_size = 0 if fresh else os.path.getsize(items_path)
+
+            count = meta["count"]
+            try:
+                with ExitStack() as stack:
+                    rows_out = stack.enter_context(
+                        _open_rows(os.path.join(version_dir, EMBEDDINGS_FILE), dim, count))
+                    text_out = None
+                    if text_dim is not None:
+                        text_out = stack.enter_context(
+                            _open_rows(os.path.join(version_dir, TEXT_EMBEDDINGS_FILE), text_dim, count))
+                    items_out = stack.enter_context(open(items_path, "w" if fresh else "a"))
+
+                    for embeddings, items, text_embeddings in chunks:
+                        embeddings = _as_matrix(embeddings, len(items), "embeddings")
+                        if embeddings.shape[1] != dim:
+                            raise ValueError(f"Embedding dimension {embeddings.shape[1]} does not match {dim}")
+                        if (text_embeddings is None) != (text_dim is None):
+                            raise ValueError("Every chunk must carry text embeddings exactly when text_dim is set")
+                        if text_embeddings is not None:
+                            text_embeddings = _as_matrix(text_embeddings, len(items), "text_embeddings")
+                            if text_embeddings.shape[1] != text_dim:
+                                raise ValueError(f"Text embedding dimension {text_embeddings.shape[1]} "
+                                                 f"does not match {text_dim}")
+                            text_embeddings.tofile(text_out)
+                        embeddings.tofile(rows_out)
+                        items_out.write("".join(json.dumps(item) + "\n" for item in items))
+                        count += len(items)
+                if fresh and count == 0:
+                    raise ValueError("Nothing to import")
+            except BaseException:
+                if fresh:
+                    shutil.rmtree(version_dir, ignore_errors=True)
+                else:
+                    # Row files past the published count are ignored and truncated by the next writer
+                    os.truncate(items_path, items_size)
+                raise
+
+            meta["count"] = count
+            _write_atomic(os.path.join(version_dir, META_FILE), json.dumps(meta))
+            if fresh:
+                _write_atomic(os.path.join(collection_dir, CURRENT_FILE), version)
+            self._bump_generation()
+            if fresh:
+                self._prune_versions(collection_dir, version, previous)
+
+        return self.get(collection)
+
+    def build_index(self, collection: str, mode: str, pq_m: Optional[int] = None) -> ReferenceSet:
+        """
+        Build or extend the compact index of the live version
+
+        An index of the same mode is extended with the rows appended since it
+        was built (PQ reuses its codebooks); anything else is rebuilt in a new
+        directory, and readers switch over when INDEX is replaced. Rows not
+        yet covered by the index are scanned exactly by readers.
+        """
+        if mode not in INDEX_MODES:
+            raise ValueError(f"Unknown index mode {mode!r}, expected one of {list(INDEX_MODES)}")
+        with self._locked():
+            version = self._current_version(collection)
+            if version is None:
+                raise ValueError(f"Collection '{collection}' does not exist")
+            version_dir = os.path.join(self._collection_dir(collection), version)
+            meta = self._read_meta(collection, version)
+            count, dim = meta["count"], meta["dim"]
+            current = self._read_index_info(version_dir)
+
+            if mode == "float32":
+                if current is not None:
+                    os.remove(os.path.join(version_dir, INDEX_FILE))
+                    self._bump_generation()
+                    self._prune_indexes(version_dir, None)
+                return self.get(collection)
+
+            embeddings = _map_rows(os.path.join(version_dir, EMBEDDINGS_FILE), count, dim)
+            pq_m = pq_m or default_pq_m(dim)
+            if (current is not None and current["mode"] == mode and current["rows"] <= count
+                    and current.get("m", pq_m) == pq_m):
+                info = dict(current)
+                start = current["rows"]
+                index_dir = os.path.join(version_dir, info["dir"])
+            else:
+                numbers = [int(name[5:]) for name in os.listdir(version_dir)
+                           if name.startswith("index") and name[5:].isdigit()]
+                info = {"dir": f"index{max(numbers, default=0) + 1}", "mode": mode, "rows": 0}
+                start = 0
+                index_dir = os.path.join(version_dir, info["dir"])
+                os.makedirs(index_dir)
+                if mode == "pq":
+                    info.update(m=pq_m, centroids=256)
+                    train_pq(embeddings, pq_m).astype(np.float32).tofile(os.path.join(index_dir, "codebooks.f32"))
+
+            if mode == "float16":
+                with _open_rows(os.path.join(index_dir, "embeddings.f16"), dim, start, itemsize=2) as f:
+                    for row in range(start, count, INDEX_CHUNK_ROWS):
+                        np.asarray(embeddings[row:row + INDEX_CHUNK_ROWS], dtype=np.float16).tofile(f)
+            else:
+                codebooks = np.fromfile(os.path.join(index_dir, "codebooks.f32"), dtype=np.float32)
+                codebooks = codebooks.reshape(info["m"], 256, dim // info["m"])
+                with _open_rows(os.path.join(index_dir, "codes.u8"), info["m"], start, itemsize=1) as f:
+                    for row in range(start, count, INDEX_CHUNK_ROWS):
+                        encode_pq(codebooks, embeddings[row:row + INDEX_CHUNK_ROWS]).tofile(f)
+
+            info["rows"] = count
+            _write_atomic(os.path.join(version_dir, INDEX_FILE), json.dumps(info))
+            self._bump_generation()
+            self._prune_indexes(version_dir, info["dir"])
+
+        return self.get(collection)
+
+    def _prune_indexes(self, version_dir: str, keep: Optional[str]):
+        # Readers still mapping an older index keep their pages after unlink
+        for name in os.listdir(version_dir):
+            if name.startswith("index") and name[5:].isdigit() and name != keep:
+                shutil.rmtree(os.path.join(version_dir, name), ignore_errors=True)
+
+    # ---- readers ----
+
+    def get(self, collection: str = DEFAULT_COLLECTION) -> Optional[ReferenceSet]:
+        """
+        Return the live version of a collection, re-opening it only after a change
+
+        Never waits for a writer, even one in this process: writers publish
+        rows before the count, so loading needs no lock, and the new snapshot
+        is swapped into the cache afterwards.
+        """
+        generation = self.generation()
+        with self._cache_lock:
+            cached = self._cache.get(collection)
+            if cached is not None and self._checked.get(collection) == generation:
+                return cached
+            offset = self._item_offsets.get(collection, 0)
+
+        for _ in range(3):
+            try:
+                snapshot, offset = self._load(collection, cached, offset)
+                break
+            except FileNotFoundError:
+                # A writer swapped versions underneath us; re-read CURRENT
+                cached, offset = None, 0
+        else:
+            snapshot, offset = None, 0
+
+        with self._cache_lock:
+            # Another reader may already have stored a load from a later generation
+            if self._checked.get(collection, -1) <= generation:
+                if snapshot is None:
+                    self._cache.pop(collection, None)
+                    self._item_offsets.pop(collection, None)
+                else:
+                    self._cache[collection] = snapshot
+                    self._item_offsets[collection] = offset
+                self._checked[collection] = generation
+        return snapshot
+
+    def _load(self, collection: str, cached: Optional[ReferenceSet],
+              offset: int) -> Tuple[Optional[ReferenceSet], int]:
+        """Open the live version; items are parsed from offset when cached holds the lines before it"""
+        version = self._current_version(collection)
+        if version is None:
+            return None, 0
+        meta = self._read_meta(collection, version)
+        count, dim = meta["count"], meta["dim"]
+        version_dir = os.path.join(self._collection_dir(collection), version)
+        index_info = self._read_index_info(version_dir)
+        if (cached is not None and cached.version == version and len(cached) == count
+                and cached.index_info == index_info):
+            return cached, offset
+
+        index = None
+        if index_info is not None:
+            index = load_index(os.path.join(version_dir, index_info["dir"]), index_info, dim)
+        embeddings = _map_rows(os.path.join(version_dir, EMBEDDINGS_FILE), count, dim)
+        text_embeddings = None
+        if meta.get("text_dim") is not None:
+            text_embeddings = _map_rows(os.path.join(version_dir, TEXT_EMBEDDINGS_FILE), count, meta["text_dim"])
+
+        # Only parse item lines appended since the last load of the same version
+        if cached is not None and cached.version == version:
+            items = list(cached.items)
+        else:
+            items, offset = [], 0
+        with open(os.path.join(version_dir, ITEMS_FILE), "rb") as f:
+            f.seek(offset)
+            while len(items) < count:
+                line = f.readline()
+                if not line:
+                    break
+                items.append(json.loads(line))
+            offset = f.tell()
+
+        return ReferenceSet(collection, version, embeddings, items, meta.get("model_id"), text_embeddings,
+                            index, index_info), offset
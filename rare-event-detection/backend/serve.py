@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Multi-process server that loads the models once and shares them with its workers.
+
+`uvicorn app:app --workers N` spawns fresh interpreters, so every worker
+downloads/deserializes CLIP, BLIP and Stable Diffusion again and keeps its own
+reference embeddings. This launcher loads the models in the parent, then
+forks the workers: weights are shared copy-on-write, and all workers use the
+same REFERENCE_STORE_DIR, so an upload handled by one worker is picked up by
+the others.
+
+Usage:
+    python serve.py --workers 4 --port 8000
+"""
+
+import argparse
+import gc
+import logging
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+logger = logging.getLogger("serve")
+
+# A worker that dies within CRASH_LOOP_SECONDS of starting is restarted after a
+# delay that doubles each time, up to MAX_RESTART_DELAY
+CRASH_LOOP_SECONDS = 30.0
+MAX_RESTART_DELAY = 60.0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the API from several forked workers")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "2")))
+    parser.add_argument("--threads-per-worker", type=int, default=0,
+                        help="CPU threads per worker, split between its model lanes (default: cores / workers)")
+    parser.add_argument("--log-level", default="info")
+    return parser.parse_args(argv)
+
+
+def bind_socket(host, port):
+    """Create the listening socket in the parent so all workers accept on it"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def freeze_shared_state(backend):
+    """Keep the parent's model pages shared after fork"""
+    for model in (backend.clip_model, backend.blip_model):
+        if model is not None:
+            model.eval()
+            for param in model.parameters():
+                param.requires_grad_(False)
+    # Move everything allocated so far out of the GC's reach, so collections in
+    # the workers do not write to (and thereby copy) the parent's object pages
+    gc.collect()
+    gc.freeze()
+
+
+def run_worker(backend, sock, args, threads):
+    """Body of a forked worker: serve the shared app on the inherited socket"""
+    import torch
+    import uvicorn
+
+    # Model work runs on the lane threads, created at worker startup from this budget
+    os.environ["LANE_THREAD_BUDGET"] = str(threads)
+    torch.set_num_threads(threads)
+    config = uvicorn.Config(backend.app, log_level=args.log_level)
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+
+
+def spawn_worker(backend, sock, args, threads):
+    pid = os.fork()
+    if pid == 0:
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        try:
+            run_worker(backend, sock, args, threads)
+        finally:
+            os._exit(0)
+    return pid
+
+
+def supervise(args):
+    """Load the models, fork the workers and restart crashed ones until stopped"""
+    import app as backend
+    from lanes import available_cores
+
+    start = time.perf_counter()
+    backend.load_models()
+    logger.info(f"Models loaded once in parent in {time.perf_counter() - start:.1f}s")
+
+    workers = max(1, args.workers)
+    if backend.device.type == "cuda" and workers > 1:
+        # A CUDA context cannot be inherited across fork
+        logger.warning("CUDA device detected; forked workers cannot share it, using 1 worker")
+        workers = 1
+
+    threads = args.threads_per_worker or max(1, available_cores() // workers)
+    sock = bind_socket(args.host, args.port)
+    freeze_shared_state(backend)
+
+    children = {}  # pid -> monotonic start time
+    for _ in range(workers):
+        pid = spawn_worker(backend, sock, args, threads)
+        children[pid] = time.monotonic()
+    logger.info(f"Started {workers} workers on {args.host}:{args.port} "
+                f"({threads} threads each), reference store {os.environ['REFERENCE_STORE_DIR']}")
+
+    stopping = False
+    restart_delay = 0.0
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        started = children.pop(pid, None)
+        if stopping:
+            continue
+        if started is not None and time.monotonic() - started < CRASH_LOOP_SECONDS:
+            restart_delay = min(MAX_RESTART_DELAY, max(1.0, 2 * restart_delay))
+        else:
+            restart_delay = 0.0
+        logger.warning(f"Worker {pid} exited with status {status}; restarting in {restart_delay:.0f}s")
+        resume = time.monotonic() + restart_delay
+        while not stopping and time.monotonic() < resume:
+            time.sleep(0.2)
+        if not stopping:
+            children[spawn_worker(backend, sock, args, threads)] = time.monotonic()
+
+    sock.close()
+    return 0
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    # Every worker must open the same reference store; a temporary one is removed on exit
+    temporary_store = None
+    if not os.getenv("REFERENCE_STORE_DIR"):
+        temporary_store = tempfile.mkdtemp(prefix="rare-event-refs-")
+        os.environ["REFERENCE_STORE_DIR"] = temporary_store
+    try:
+        return supervise(args)
+    finally:
+        if temporary_store is not None:
+            shutil.rmtree(temporary_store, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+"""
+Tiny randomly initialized stand-ins for CLIP, BLIP and Stable Diffusion.
+
+They expose the same call signatures the backend uses on the real
+transformers/diffusers objects, so the API can be exercised and benchmarked
+on a CPU box without network access or multi-GB downloads. Enable them with
+STUB_MODELS=1.
+"""
+
+import zlib
+from types import SimpleNamespace
+from typing import List, Optional
+
+import numpy as np
+import torch
+from torch import nn
+from PIL import Image
+
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+
+STUB_VOCAB = [
+    "a", "an", "the", "photo", "of", "image", "with", "rare", "event", "defect",
+    "crack", "lesion", "leaf", "spot", "surface", "metal", "skin", "olive",
+    "dark", "bright", "small", "large", "red", "green", "blue", "gray",
+]
+
+
+class StubBatch(dict):
+    """Minimal BatchEncoding replacement supporting .to(device) and attribute access"""
+
+    def to(self, device):
+        return StubBatch({k: v.to(device) for k, v in self.items()})
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+def images_to_pixel_values(images, size: int) -> torch.Tensor:
+    """Resize PIL images and normalize them the way the CLIP processor does"""
+    if isinstance(images, Image.Image):
+        images = [images]
+    arrays = []
+    for image in images:
+        image = image.convert("RGB").resize((size, size), Image.BICUBIC)
+        arrays.append(np.asarray(image, dtype=np.float32) / 255.0)
+    pixels = torch.from_numpy(np.stack(arrays)).permute(0, 3, 1, 2)
+    mean = torch.tensor(CLIP_MEAN).view(1, 3, 1, 1)
+    std = torch.tensor(CLIP_STD).view(1, 3, 1, 1)
+    return (pixels - mean) / std
+
+
+def tokenize(texts: List[str], vocab_size: int, max_length: int = 32):
+    """Hash words into token ids and pad to the longest sequence"""
+    rows = []
+    for text in texts:
+        ids = [zlib.crc32(word.encode()) % (vocab_size - 1) + 1 for word in text.lower().split()][:max_length]
+        rows.append(ids or [0])
+    width = max(len(r) for r in rows)
+    input_ids = torch.zeros(len(rows), width, dtype=torch.long)
+    attention_mask = torch.zeros(len(rows), width, dtype=torch.long)
+    for i, ids in enumerate(rows):
+        input_ids[i, :len(ids)] = torch.tensor(ids)
+        attention_mask[i, :len(ids)] = 1
+    return input_ids, attention_mask
+
+
+class StubCLIPProcessor:
+    """Same call surface as transformers.CLIPProcessor"""
+
+    def __init__(self, image_size: int = 224, vocab_size: int = 1000):
+        self.image_size = image_size
+        self.vocab_size = vocab_size
+        self.image_processor = SimpleNamespace(
+            crop_size={"height": image_size, "width": image_size},
+            image_mean=list(CLIP_MEAN),
+            image_std=list(CLIP_STD),
+        )
+
+    def __call__(self, text=None, images=None, return_tensors="pt", padding=True, truncation=True):
+        batch = StubBatch()
+        if images is not None:
+            batch["pixel_values"] = images_to_pixel_values(images, self.image_size)
+        if text is not None:
+            texts = [text] if isinstance(text, str) else list(text)
+            batch["input_ids"], batch["attention_mask"] = tokenize(texts, self.vocab_size)
+        return batch
+
+
+class StubVisionTransformer(nn.Module):
+    """One-layer ViT mirroring CLIPVisionTransformer outputs"""
+
+    def __init__(self, hidden_size: int, patch_size: int):
+        super().__init__()
+        self.patch_embed = nn.Conv2d(3, hidden_size, patch_size, stride=patch_size, bias=False)
+        self.class_embedding = nn.Parameter(torch.randn(hidden_size) * 0.02)
+        self.encoder = nn.TransformerEncoderLayer(hidden_size, nhead=4, dim_feedforward=hidden_size * 2,
+                                                  batch_first=True)
+        self.post_layernorm = nn.LayerNorm(hidden_size)
+
+    def forward(self, pixel_values: torch.Tensor, **kwargs):
+        patches = self.patch_embed(pixel_values).flatten(2).transpose(1, 2)
+        cls = self.class_embedding.expand(patches.shape[0], 1, -1)
+        hidden = self.encoder(torch.cat([cls, patches], dim=1))
+        return SimpleNamespace(last_hidden_state=hidden, pooler_output=self.post_layernorm(hidden[:, 0]))
+
+
+class StubCLIPModel(nn.Module):
+    """Tiny randomly initialized model with CLIPModel's feature methods"""
+
+    def __init__(self, hidden_size: int = 64, projection_dim: int = 64, image_size: int = 224,
+                 patch_size: int = 32, vocab_size: int = 1000):
+        super().__init__()
+        self.config = SimpleNamespace(
+            projection_dim=projection_dim,
+            vision_config=SimpleNamespace(image_size=image_size, patch_size=patch_size),
+        )
+        self.vision_model = StubVisionTransformer(hidden_size, patch_size)
+        self.visual_projection = nn.Linear(hidden_size, projection_dim, bias=False)
+        self.token_embedding = nn.Embedding(vocab_size, hidden_size)
+        self.text_projection = nn.Linear(hidden_size, projection_dim, bias=False)
+
+    def get_image_features(self, pixel_values: torch.Tensor, **kwargs) -> torch.Tensor:
+        return self.visual_projection(self.vision_model(pixel_values).pooler_output)
+
+    def get_text_features(self, input_ids: torch.Tensor, attention_mask: Optional[torch.Tensor] = None,
+                          **kwargs) -> torch.Tensor:
+        tokens = self.token_embedding(input_ids)
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        mask = attention_mask.unsqueeze(-1).to(tokens.dtype)
+        pooled = (tokens * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+        return self.text_projection(pooled)
+
+
+class StubBlipProcessor:
+    """Same call surface as transformers.BlipProcessor"""
+
+    def __init__(self, image_size: int = 384):
+        self.image_size = image_size
+
+    def __call__(self, images=None, text=None, return_tensors="pt"):
+        return StubBatch(pixel_values=images_to_pixel_values(images, self.image_size))
+
+    def decode(self, token_ids, skip_special_tokens=True) -> str:
+        return " ".join(STUB_VOCAB[int(t) % len(STUB_VOCAB)] for t in token_ids)
+
+    def batch_decode(self, sequences, skip_special_tokens=True) -> List[str]:
+        return [self.decode(s, skip_special_tokens) for s in sequences]
+
+
+class StubBlipForConditionalGeneration(nn.Module):
+    """Greedy token emitter driven by a small conv encoder"""
+
+    def __init__(self, hidden_size: int = 32):
+        super().__init__()
+        self.encoder = nn.Sequential(
+            nn.Conv2d(3, hidden_size, 16, stride=16),
+            nn.GELU(),
+            nn.AdaptiveAvgPool2d(1),
+            nn.Flatten(),
+        )
+        self.head = nn.Linear(hidden_size, len(STUB_VOCAB))
+        self.step = nn.Linear(len(STUB_VOCAB), hidden_size)
+
+    def generate(self, pixel_values: torch.Tensor, max_length: int = 20, num_beams: int = 1, **kwargs):
+        state = self.encoder(pixel_values)
+        tokens = []
+        for _ in range(min(max_length, 12)):
+            logits = self.head(state)
+            token = logits.argmax(dim=-1)
+            tokens.append(token)
+            state = state + self.step(torch.softmax(logits, dim=-1))
+        return torch.stack(tokens, dim=1)
+
+
+class StubStableDiffusionPipeline(nn.Module):
+    """Runs a few conv denoising steps on a latent and upsamples it to an image"""
+
+    def __init__(self, latent_channels: int = 4):
+        super().__init__()
+        self.latent_channels = latent_channels
+        self.unet = nn.Sequential(
+            nn.Conv2d(latent_channels, 16, 3, padding=1),
+            nn.SiLU(),
+            nn.Conv2d(16, latent_channels, 3, padding=1),
+        )
+        self.decoder = nn.Conv2d(latent_channels, 3, 1)
+
+    def __call__(self, prompt, num_inference_steps: int = 20, guidance_scale: float = 7.5,
+                 height: int = 512, width: int = 512, num_images_per_prompt: int = 1,
+                 generator=None, output_type: str = "pil", **kwargs):
+        prompts = [prompt] if isinstance(prompt, str) else list(prompt)
+        batch = len(prompts) * num_images_per_prompt
+        device = next(self.parameters()).device
+        latents = torch.randn(batch, self.latent_channels, height // 8, width // 8,
+                              generator=generator, device=device)
+        for _ in range(num_inference_steps):
+            latents = latents - 0.1 * self.unet(latents)
+        images = torch.sigmoid(self.decoder(latents))
+        images = nn.functional.interpolate(images, size=(height, width), mode="nearest")
+        if output_type == "pt":
+            return SimpleNamespace(images=images)
+        arrays = (images.permute(0, 2, 3, 1).cpu().numpy() * 255).round().astype("uint8")
+        return SimpleNamespace(images=[Image.fromarray(a) for a in arrays])
+
+
+def load_stub_models(device: torch.device):
+    """Build all stub models on the given device, seeded for reproducibility"""
+    torch.manual_seed(0)
+    clip_model = StubCLIPModel().to(device).eval()
+    blip_model = StubBlipForConditionalGeneration().to(device).eval()
+    sd_pipeline = StubStableDiffusionPipeline().to(device).eval()
+    return clip_model, StubCLIPProcessor(), blip_model, StubBlipProcessor(), sd_pipeline
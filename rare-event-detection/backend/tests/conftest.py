@@ -0,0 +1,64 @@
+import io
+import os
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+# The backend modules import each other as top-level modules (as app.py does)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def unit_rows():
+    """Factory for random normalized float32 rows, reproducible by seed"""
+    def make(rows: int, dim: int = 16, seed: int = 0) -> np.ndarray:
+        matrix = np.random.default_rng(seed).standard_normal((rows, dim)).astype(np.float32)
+        return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+    return make
+
+
+@pytest.fixture
+def store_root(tmp_path):
+    return str(tmp_path / "references")
+
+
+@pytest.fixture(scope="session")
+def backend(tmp_path_factory):
+    """The API module with the tiny offline stub models and a throwaway reference store"""
+    os.environ["STUB_MODELS"] = "1"
+    os.environ["REFERENCE_STORE_DIR"] = str(tmp_path_factory.mktemp("references"))
+    import app
+    return app
+
+
+@pytest.fixture
+def client(backend):
+    from fastapi.testclient import TestClient
+    with TestClient(backend.app) as client:
+        yield client
+
+
+def solid_image(color, size=(224, 224), format="JPEG") -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, format=format)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def image_bytes():
+    """Factory for encoded solid-color images"""
+    return solid_image
+
+
+@pytest.fixture
+def upload(client):
+    """Replace a collection with one solid-color reference image per color"""
+    def upload(collection, colors=("red", "blue", "gray", "orange")):
+        files = [("files", (f"{color}.jpg", solid_image(color), "image/jpeg")) for color in colors]
+        response = client.post("/upload_references", files=files,
+                               data={"captions": [f"a {color} thing" for color in colors], "collection": collection})
+        assert response.status_code == 200, response.text
+        return response.json()
+    return upload
@@ -0,0 +1,126 @@
+import json
+import os
+import queue
+import threading
+import time
+
+import pytest
+
+from audit import DROP_NEWEST, DROP_OLDEST, AuditLog, read_audit, to_columns
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def stalled_log(tmp_path):
+    """AuditLog with room for two queued records whose writer is stuck on its first record"""
+    logs, release = [], threading.Event()
+
+    def make(on_full):
+        log = AuditLog(str(tmp_path), queue_size=2, batch_size=1, flush_interval=0.05, on_full=on_full)
+        write = log._write
+
+        def stalled_write(batch):
+            release.wait(5)
+            write(batch)
+
+        log._write = stalled_write
+        log.record({"n": 0})
+        wait_until(lambda: log._queue.empty())
+        logs.append(log)
+        return log
+
+    yield make
+    release.set()
+    for log in logs:
+        log.close()
+
+
+def test_drop_newest_rejects_the_incoming_record(stalled_log):
+    log = stalled_log(DROP_NEWEST)
+    assert log.record({"n": 1}) and log.record({"n": 2})
+    assert not log.record({"n": 3})
+    assert (log.stats()["enqueued"], log.stats()["dropped"]) == (3, 1)
+
+
+def test_drop_oldest_evicts_a_buffered_record(stalled_log):
+    log = stalled_log(DROP_OLDEST)
+    assert log.record({"n": 1}) and log.record({"n": 2})
+    assert log.record({"n": 3})
+    assert (log.stats()["enqueued"], log.stats()["dropped"]) == (4, 1)
+
+
+def test_drop_oldest_reports_a_lost_retry(stalled_log, monkeypatch):
+    log = stalled_log(DROP_OLDEST)
+    log.record({"n": 1})
+    log.record({"n": 2})
+
+    def empty():
+        raise queue.Empty
+
+    # Nothing evicted, so the retry finds the queue still full
+    monkeypatch.setattr(log._queue, "get_nowait", empty)
+    assert not log.record({"n": 3})
+    assert (log.stats()["enqueued"], log.stats()["dropped"]) == (3, 1)
+
+
+def test_close_writes_everything_buffered_in_order(tmp_path):
+    log = AuditLog(str(tmp_path), batch_size=4, flush_interval=0.05)
+    for n in range(10):
+        log.record({"n": n, "ts": n})
+    log.close()
+
+    assert [entry["n"] for entry in read_audit(str(tmp_path))] == list(range(10))
+    stats = log.stats()
+    assert (stats["enqueued"], stats["written"], stats["dropped"], stats["buffered"]) == (10, 10, 0, 0)
+
+
+def test_files_rotate_by_size(tmp_path):
+    log = AuditLog(str(tmp_path), batch_size=1, flush_interval=0.05, max_file_bytes=100)
+    for n in range(6):
+        log.record({"n": n, "padding": "x" * 40})
+    log.close()
+
+    files = sorted(os.listdir(tmp_path))
+    assert len(files) == log.stats()["files"] == 3
+    assert all(name.startswith("audit-") and name.endswith(".jsonl") for name in files)
+    assert [entry["n"] for entry in read_audit(str(tmp_path))] == list(range(6))
+
+
+def write_records(directory, records, torn=False):
+    with open(os.path.join(directory, "audit-20250101-000000-1-0.jsonl"), "w", encoding="utf-8") as f:
+        for entry in records:
+            f.write(json.dumps(entry) + "\n")
+        if torn:
+            f.write('{"ts": 9, "coll')
+
+
+def test_read_audit_filters_and_skips_a_torn_line(tmp_path):
+    write_records(str(tmp_path), [
+        {"ts": 1, "collection": "a", "label": "Normal"},
+        {"ts": 2, "collection": "b", "label": "Rare Event"},
+        {"ts": 3, "collection": "a", "label": "Rare Event"},
+    ], torn=True)
+
+    def ts(**filters):
+        return [entry["ts"] for entry in read_audit(str(tmp_path), **filters)]
+
+    assert ts() == [1, 2, 3]
+    assert ts(since=2, until=3) == [2]
+    assert ts(collection="a") == [1, 3]
+    assert ts(collection="a", label="Rare Event") == [3]
+
+
+def test_to_columns_fills_missing_keys_with_none():
+    columns = to_columns([{"a": 1}, {"a": 2, "b": "x"}, {"b": "y"}])
+    assert columns == {"a": [1, 2, None], "b": [None, "x", "y"]}
+
+
+def test_unknown_policy_is_rejected(tmp_path):
+    with pytest.raises(ValueError, match="AUDIT_ON_FULL"):
+        AuditLog(str(tmp_path), on_full="block")
@@ -0,0 +1,109 @@
+from concurrent.futures import Future
+
+import numpy as np
+import pytest
+import torch
+
+import augment
+from augment import CLIP_MEAN, CLIP_STD, build_prompts, clip_pixel_values, select_in_band
+from reference_store import ReferenceStore
+
+ITEMS = [
+    {"caption": "a fox"},
+    {"caption": "a fox, close-up", "source": "synthetic"},
+    {"caption": "  "},
+    {"caption": "an owl"},
+]
+
+
+def test_prompts_go_variant_by_variant_over_real_captions():
+    prompts = build_prompts(ITEMS, ["{caption}", "{caption} at night"], variants_per_caption=3, max_prompts=10)
+
+    assert [(p["prompt"], p["source_row"]) for p in prompts] == [
+        ("a fox", 0), ("an owl", 3),
+        ("a fox at night", 0), ("an owl at night", 3),
+        ("a fox", 0), ("an owl", 3),
+    ]
+    assert prompts[2]["template"] == "{caption} at night"
+
+
+def test_max_prompts_cut_keeps_every_source_caption():
+    prompts = build_prompts(ITEMS, ["{caption}", "{caption} at night"], variants_per_caption=3, max_prompts=3)
+    assert [p["source_row"] for p in prompts] == [0, 3, 0]
+
+
+def test_template_without_placeholder_is_rejected():
+    with pytest.raises(ValueError, match="placeholder"):
+        build_prompts(ITEMS, ["a fox"], variants_per_caption=1, max_prompts=10)
+
+
+def unit(*vector):
+    vector = np.array(vector, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_select_in_band_rejects_off_topic_and_redundant_rows():
+    embeddings = np.stack([unit(1, 0), unit(0, 1), unit(1, 0.01), unit(1, 1), unit(0.2, 1)])
+    real_best = np.array([0.8, 0.3, 0.8, 0.8, 0.8])
+    overall_best = np.array([0.8, 0.3, 0.8, 0.8, 0.99])
+
+    kept, off_topic, redundant = select_in_band(embeddings, real_best, overall_best,
+                                                min_similarity=0.5, max_similarity=0.95)
+    # 1 is off-topic, 2 copies the kept row 0, 4 copies an existing reference
+    assert (kept, off_topic, redundant) == ([0, 3], 1, 2)
+
+
+def test_band_edges_are_inclusive():
+    embeddings = np.stack([unit(1, 0)])
+    kept, _, _ = select_in_band(embeddings, np.array([0.5]), np.array([0.95]),
+                                min_similarity=0.5, max_similarity=0.95)
+    assert kept == [0]
+
+
+def normalized(value):
+    return (value - torch.tensor(CLIP_MEAN)) / torch.tensor(CLIP_STD)
+
+
+def test_pixel_values_of_a_flat_image_are_the_normalized_color():
+    pixels = clip_pixel_values(torch.full((2, 3, 64, 96), 0.5))
+    assert pixels.shape == (2, 3, 224, 224)
+    assert torch.allclose(pixels[0, :, 100, 100], normalized(0.5), atol=1e-4)
+
+
+def test_pixel_values_center_crop_a_wide_image():
+    images = torch.zeros(1, 3, 100, 300)
+    images[..., 100:200] = 1.0
+    pixels = clip_pixel_values(images, size=32)
+
+    assert pixels.shape == (1, 3, 32, 32)
+    # Only the bright middle third survives the crop
+    assert torch.allclose(pixels[0, :, 16, 1], normalized(1.0), atol=1e-3)
+    assert torch.allclose(pixels[0, :, 16, 30], normalized(1.0), atol=1e-3)
+
+
+def done(fn, *args):
+    future = Future()
+    future.set_result(fn(*args))
+    return future
+
+
+def test_run_scores_real_rows_exactly_even_when_the_compact_scan_misses_them(store_root):
+    store = ReferenceStore(store_root)
+    store.replace("c", np.stack([unit(1, 0, 0), unit(0, 1, 0)]), [{"caption": "a fox"}, {"caption": "an owl"}])
+    generated = np.stack([unit(1, 0.5, 0), unit(0, 0, 1)])
+
+    def nothing_scored_exactly(references, embeddings):
+        return np.full((len(embeddings), len(references)), -np.inf)
+
+    result = augment.run(
+        store, "c", [{"prompt": "a fox", "template": "{caption}", "source_row": 0}] * 2,
+        submit=lambda lane, fn, *args: done(fn, *args),
+        generate=lambda prompts, seed: torch.zeros(len(prompts), 3, 8, 8),
+        encode=lambda images, texts: (generated, None),
+        similarities=nothing_scored_exactly,
+        batch_size=2, min_similarity=0.5, max_similarity=0.95, seed=0, provenance={},
+    )
+
+    assert result["accepted"] == 1 and result["rejected"] == {"off_topic": 1, "redundant": 0}
+    synthetic = store.get("c").items[-1]
+    assert synthetic["provenance"]["similarity"] == pytest.approx(float(generated[0, 0]), abs=1e-4)
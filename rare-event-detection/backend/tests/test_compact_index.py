@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from compact_index import Float16Index, PQIndex, _synthetic, _top_k, encode_pq, rerank_similarities, train_pq
+
+
+@pytest.fixture(scope="module")
+def fixture():
+    embeddings = _synthetic(4000, 64, seed=0)
+    queries = embeddings[np.random.default_rng(1).choice(len(embeddings), 8, replace=False)]
+    queries = queries + 0.3 * _synthetic(8, 64, seed=2)
+    return embeddings, queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def pq_index(embeddings):
+    codebooks = train_pq(embeddings, m=8)
+    return PQIndex(codebooks, encode_pq(codebooks, embeddings))
+
+
+@pytest.mark.parametrize("build", [lambda e: Float16Index(e.astype(np.float16)), pq_index], ids=["float16", "pq"])
+def test_rerank_top_k_agrees_with_float32(fixture, build):
+    embeddings, queries = fixture
+    exact = queries @ embeddings.T
+    scores, mask = rerank_similarities(build(embeddings), embeddings, queries, candidates=200)
+    ranked = np.where(mask, scores, -np.inf)
+
+    for t in range(len(queries)):
+        assert list(_top_k(ranked[t], 10)) == list(_top_k(exact[t], 10))
+        assert ranked[t].max() == pytest.approx(exact[t].max(), abs=1e-6)
+        # Entries that were re-ranked are float32-exact
+        np.testing.assert_allclose(scores[t, mask[t]], exact[t, mask[t]], atol=1e-6)
+    assert (mask.sum(axis=1) == 200).all()
+
+
+def test_rows_appended_after_the_index_are_exact(fixture):
+    embeddings, queries = fixture
+    index = Float16Index(embeddings[:3000].astype(np.float16))
+    scores, mask = rerank_similarities(index, embeddings, queries, candidates=50)
+
+    assert scores.shape == mask.shape == (len(queries), len(embeddings))
+    assert mask[:, 3000:].all()
+    np.testing.assert_allclose(scores[:, 3000:], queries @ embeddings[3000:].T, atol=1e-6)
+    assert (mask[:, :3000].sum(axis=1) == 50).all()
+
+
+def test_candidates_are_capped_at_the_indexed_rows(fixture):
+    embeddings, queries = fixture
+    small = embeddings[:20]
+    scores, mask = rerank_similarities(Float16Index(small.astype(np.float16)), small, queries, candidates=256)
+
+    assert mask.all()
+    np.testing.assert_allclose(scores, queries @ small.T, atol=1e-6)
@@ -0,0 +1,65 @@
+import base64
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app import compute_patch_heatmap, encode_heatmap_png
+
+
+def decode_png(data_uri):
+    prefix = "data:image/png;base64,"
+    assert data_uri.startswith(prefix)
+    return np.asarray(Image.open(io.BytesIO(base64.b64decode(data_uri[len(prefix):]))))
+
+
+def test_heatmap_is_on_the_patch_grid_and_scaled_to_unit_range(unit_rows):
+    patches = unit_rows(49)
+    heatmap = compute_patch_heatmap(patches, patches[10])
+
+    assert heatmap.shape == (7, 7)
+    assert heatmap.min() == 0.0 and heatmap.max() == pytest.approx(1.0)
+    # Row-major patches: patch 10 is row 1, column 3
+    assert np.unravel_index(heatmap.argmax(), heatmap.shape) == (1, 3)
+
+
+def test_flat_scores_give_an_all_zero_heatmap():
+    patches = np.ones((16, 4), dtype=np.float32)
+    heatmap = compute_patch_heatmap(patches, np.ones((1, 4), dtype=np.float32))
+    assert heatmap.shape == (4, 4) and not heatmap.any()
+
+
+def test_png_keeps_the_grid_shape_and_values(unit_rows):
+    patches = unit_rows(49)
+    heatmap = compute_patch_heatmap(patches, patches[0])
+    pixels = decode_png(encode_heatmap_png(heatmap))
+
+    assert pixels.shape == (7, 7) and pixels.dtype == np.uint8
+    assert np.abs(pixels / 255.0 - heatmap).max() <= 0.5 / 255 + 1e-9
+
+
+@pytest.mark.parametrize("heatmap_format", ["array", "png"])
+def test_classify_returns_a_heatmap_for_the_best_reference(client, upload, image_bytes, heatmap_format):
+    upload("heatmap", colors=("red", "blue"))
+    response = client.post("/classify", files={"file": ("q.jpg", image_bytes("red"), "image/jpeg")},
+                           data={"collection": "heatmap", "heatmap": "true", "heatmap_format": heatmap_format})
+    assert response.status_code == 200, response.text
+    result = response.json()
+
+    rows, cols = result["heatmap_shape"]
+    grid = np.array(result["heatmap"]) if heatmap_format == "array" else decode_png(result["heatmap"]) / 255.0
+    assert grid.shape == (rows, cols) and rows == cols > 1
+    assert 0.0 <= grid.min() and grid.max() <= 1.0
+    assert result["heatmap_reference"] == 0
+
+
+@pytest.mark.parametrize("data, detail", [
+    ({"heatmap": "true", "heatmap_format": "jpeg"}, "heatmap_format"),
+    ({"heatmap": "true", "tiled": "true"}, "tiled mode"),
+])
+def test_invalid_heatmap_requests_are_rejected(client, upload, image_bytes, data, detail):
+    upload("heatmap", colors=("red", "blue"))
+    response = client.post("/classify", files={"file": ("q.jpg", image_bytes("red"), "image/jpeg")},
+                           data={"collection": "heatmap", **data})
+    assert response.status_code == 400 and detail in response.json()["detail"]
@@ -0,0 +1,86 @@
+import threading
+import time
+
+import pytest
+
+from lanes import (PRIORITY_BATCH, PRIORITY_INTERACTIVE, DeadlineExceeded, LaneOverloaded, ModelLane,
+                   RequestBudget)
+
+
+@pytest.fixture
+def lane():
+    lane = ModelLane("test", num_threads=1)
+    yield lane
+    lane.shutdown()
+
+
+def occupy(lane: ModelLane, seconds: float = 0.0):
+    """Start a job that holds the lane until the returned event is set"""
+    release, started = threading.Event(), threading.Event()
+
+    def job():
+        started.set()
+        release.wait(5)
+        time.sleep(seconds)
+
+    future = lane.submit(job)
+    assert started.wait(5)
+    return release, future
+
+
+def test_idle_lane_admits(lane):
+    lane.admit(RequestBudget.from_timeout(PRIORITY_INTERACTIVE, 1.0))
+    lane.admit(RequestBudget(PRIORITY_BATCH))
+    assert lane.stats()["classes"]["interactive"]["admitted"] == 1
+    assert lane.stats()["classes"]["batch"]["admitted"] == 1
+
+
+def test_admit_sheds_when_the_wait_exceeds_the_deadline(lane):
+    release, running = occupy(lane)
+    try:
+        lane.submit(lambda: None)
+        time.sleep(0.2)
+        with pytest.raises(LaneOverloaded) as shed:
+            lane.admit(RequestBudget.from_timeout(PRIORITY_INTERACTIVE, 0.05))
+        assert shed.value.retry_after >= 1
+        # Without a deadline the configured maximum queue wait still applies
+        lane.max_queue_wait = {PRIORITY_INTERACTIVE: 0.05, PRIORITY_BATCH: 0.05}
+        with pytest.raises(LaneOverloaded):
+            lane.admit(RequestBudget(PRIORITY_INTERACTIVE))
+        assert lane.stats()["classes"]["interactive"]["shed"] == 2
+    finally:
+        release.set()
+    running.result(5)
+
+
+def test_admit_sheds_an_already_expired_budget(lane):
+    with pytest.raises(LaneOverloaded):
+        lane.admit(RequestBudget(PRIORITY_INTERACTIVE, deadline=time.monotonic() - 1))
+
+
+def test_queued_work_past_its_deadline_is_dropped(lane):
+    calls = []
+    release, running = occupy(lane)
+    expiring = lane.submit(calls.append, "expired", budget=RequestBudget.from_timeout(PRIORITY_INTERACTIVE, 0.05))
+    patient = lane.submit(calls.append, "patient", budget=RequestBudget.from_timeout(PRIORITY_INTERACTIVE, 10))
+    time.sleep(0.1)
+    release.set()
+
+    with pytest.raises(DeadlineExceeded):
+        expiring.result(5)
+    patient.result(5)
+    running.result(5)
+    assert calls == ["patient"]
+    assert lane.stats()["classes"]["interactive"]["expired"] == 1
+
+
+def test_interactive_work_runs_before_batch_work(lane):
+    order = []
+    release, running = occupy(lane)
+    batch = lane.submit(order.append, "batch", budget=RequestBudget(PRIORITY_BATCH))
+    interactive = lane.submit(order.append, "interactive", budget=RequestBudget(PRIORITY_INTERACTIVE))
+    release.set()
+
+    for future in (running, batch, interactive):
+        future.result(5)
+    assert order == ["interactive", "batch"]
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from perceptual_hash import HASH_BITS, NearDuplicateIndex, dhash, phash
+
+
+def noise(seed, size=(128, 96)):
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8))
+
+
+def bits_apart(a, b):
+    return bin(a ^ b).count("1")
+
+
+@pytest.mark.parametrize("image_hash", [dhash, phash])
+def test_hash_is_stable_under_resizing_and_far_from_other_images(image_hash):
+    image = noise(0)
+    assert 0 <= image_hash(image) < 2 ** HASH_BITS
+    assert bits_apart(image_hash(image), image_hash(image.resize((256, 192)))) <= 4
+    assert bits_apart(image_hash(image), image_hash(noise(1))) > 10
+
+
+def key(value, colors=0):
+    return value, np.full(12, colors, dtype=np.int16)
+
+
+def test_lookup_returns_the_closest_hash_within_max_distance():
+    index = NearDuplicateIndex(capacity=4, max_distance=4)
+    assert index.lookup(key(0)) is None
+    index.add(key(0b1111), "four bits")
+    index.add(key(0b1), "one bit")
+
+    assert index.lookup(key(0)) == ("one bit", 1)
+    assert index.lookup(key(0b1111)) == ("four bits", 0)
+    assert index.lookup(key(0b1111 << 8)) is None
+    assert index.stats()["lookups"] == 4 and index.stats()["hits"] == 2
+
+
+def test_full_ring_evicts_the_oldest_entry():
+    index = NearDuplicateIndex(capacity=3, max_distance=0)
+    for i in range(5):
+        index.add(key(1 << (8 * i)), i)
+
+    assert index.stats()["entries"] == 3
+    assert index.lookup(key(1)) is None and index.lookup(key(1 << 8)) is None
+    assert [index.lookup(key(1 << (8 * i)))[0] for i in range(2, 5)] == [2, 3, 4]
+
+
+def test_flat_images_of_different_colors_are_not_duplicates():
+    index = NearDuplicateIndex(capacity=4, max_distance=4)
+    red, blue = Image.new("RGB", (64, 64), "red"), Image.new("RGB", (64, 64), "blue")
+    assert index.hash(red)[0] == index.hash(blue)[0]
+
+    index.add(index.hash(red), "red")
+    assert index.lookup(index.hash(blue)) is None
+    assert index.lookup(index.hash(Image.new("RGB", (64, 64), (250, 5, 5)))) == ("red", 0)
+
+
+def test_color_gap_beyond_the_limit_skips_to_the_next_candidate():
+    index = NearDuplicateIndex(capacity=4, max_distance=4, max_color_distance=16)
+    index.add(key(0, colors=100), "exact hash, other color")
+    index.add(key(0b11, colors=10), "close hash, same color")
+    assert index.lookup(key(0, colors=0)) == ("close hash, same color", 2)
+
+
+def test_unknown_algorithm_is_rejected():
+    with pytest.raises(ValueError, match="Unknown hash algorithm"):
+        NearDuplicateIndex(capacity=4, algorithm="ahash")
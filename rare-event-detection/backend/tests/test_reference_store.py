@@ -0,0 +1,149 @@
+import threading
+
+import numpy as np
+import pytest
+
+from reference_store import ReferenceStore
+
+
+def items(n: int, start: int = 0):
+    return [{"caption": f"reference {i}"} for i in range(start, start + n)]
+
+
+def chunks(unit_rows, *sizes, dim=16, fail_after=None):
+    """(embeddings, items, None) chunks for import_chunks, optionally raising part way"""
+    start = 0
+    for i, size in enumerate(sizes):
+        if i == fail_after:
+            raise ValueError("broken upload")
+        yield unit_rows(size, dim, seed=start), items(size, start), None
+        start += size
+
+
+def test_replace_publishes_a_new_version(store_root, unit_rows):
+    store = ReferenceStore(store_root)
+    first = store.replace("default", unit_rows(3), items(3), "clip")
+    second = store.replace("default", unit_rows(2, seed=1), items(2))
+
+    assert (first.version, len(first)) == ("v1", 3)
+    assert (second.version, len(second)) == ("v2", 2)
+    np.testing.assert_array_equal(store.get("default").embeddings, unit_rows(2, seed=1))
+    assert store.get("default").captions == ["reference 0", "reference 1"]
+
+
+def test_append_extends_the_live_version(store_root, unit_rows):
+    store = ReferenceStore(store_root)
+    store.replace("default", unit_rows(3), items(3))
+    references = store.append("default", unit_rows(2, seed=1), items(2, start=3))
+
+    assert (references.version, len(references)) == ("v1", 5)
+    np.testing.assert_array_equal(references.embeddings[3:], unit_rows(2, seed=1))
+    assert references.captions[-1] == "reference 4"
+
+
+def test_append_creates_a_missing_collection(store_root, unit_rows):
+    references = ReferenceStore(store_root).append("new", unit_rows(2), items(2))
+    assert (references.version, len(references)) == ("v1", 2)
+
+
+def test_append_with_wrong_dimension_leaves_rows_untouched(store_root, unit_rows):
+    store = ReferenceStore(store_root)
+    store.replace("default", unit_rows(3), items(3))
+
+    with pytest.raises(ValueError):
+        store.append("default", unit_rows(2, dim=8), items(2))
+    with pytest.raises(ValueError):
+        store.append("default", unit_rows(2), items(2), text_embeddings=unit_rows(2))
+
+    references = store.get("default")
+    assert (references.version, len(references)) == ("v1", 3)
+
+
+def test_import_chunks_replaces_once_every_chunk_is_written(store_root, unit_rows):
+    store = ReferenceStore(store_root)
+    store.replace("default", unit_rows(3), items(3))
+    references = store.import_chunks("default", chunks(unit_rows, 4, 4, 2), dim=16)
+
+    assert (references.version, len(references)) == ("v2", 10)
+    assert references.captions == [f"reference {i}" for i in range(10)]
+
+
+def test_failed_import_keeps_the_previous_version(store_root, unit_rows):
+    store = ReferenceStore(store_root)
+    store.replace("default", unit_rows(3), items(3))
+
+    with pytest.raises(ValueError):
+        store.import_chunks("default", chunks(unit_rows, 4, 4, 2, fail_after=2), dim=16)
+
+    references = store.get("default")
+    assert (references.version, len(references)) == ("v1", 3)
+    np.testing.assert_array_equal(references.embeddings, unit_rows(3))
+
+
+def test_failed_append_import_publishes_no_rows(store_root, unit_rows):
+    store = ReferenceStore(store_root)
+    store.replace("default", unit_rows(3), items(3))
+
+    with pytest.raises(ValueError):
+        store.import_chunks("default", chunks(unit_rows, 4, 4, fail_after=1), dim=16, append=True)
+    assert len(store.get("default")) == 3
+
+    # The rolled-back rows are overwritten by the next append, not left in between
+    references = store.import_chunks("default", chunks(unit_rows, 2), dim=16, append=True)
+    assert (references.version, len(references)) == ("v1", 5)
+    np.testing.assert_array_equal(references.embeddings[3:], unit_rows(2, seed=0))
+    assert references.captions[3:] == ["reference 0", "reference 1"]
+
+
+def test_import_dimension_mismatch_is_rejected(store_root, unit_rows):
+    store = ReferenceStore(store_root)
+    store.replace("default", unit_rows(3), items(3))
+
+    with pytest.raises(ValueError):
+        store.import_chunks("default", chunks(unit_rows, 2, dim=8), dim=8, append=True)
+    with pytest.raises(ValueError):
+        store.import_chunks("default", chunks(unit_rows, 2, dim=8), dim=16)
+    assert (store.get("default").version, len(store.get("default"))) == ("v1", 3)
+
+
+def test_second_store_on_the_same_root_sees_changes(store_root, unit_rows):
+    writer, reader = ReferenceStore(store_root), ReferenceStore(store_root)
+    assert reader.get("default") is None
+
+    writer.replace("default", unit_rows(3), items(3))
+    assert (reader.get("default").version, len(reader.get("default"))) == ("v1", 3)
+
+    writer.append("default", unit_rows(2, seed=1), items(2, start=3))
+    references = reader.get("default")
+    assert (references.version, len(references)) == ("v1", 5)
+    assert references.captions[-1] == "reference 4"
+
+    writer.replace("default", unit_rows(1, seed=2), items(1))
+    references = reader.get("default")
+    assert (references.version, len(references)) == ("v2", 1)
+    np.testing.assert_array_equal(references.embeddings, unit_rows(1, seed=2))
+    assert reader.collections() == ["default"]
+
+
+def test_readers_do_not_wait_for_a_writer(store_root, unit_rows):
+    store = ReferenceStore(store_root)
+    store.replace("default", unit_rows(3), items(3))
+    holding, release = threading.Event(), threading.Event()
+
+    def writer():
+        with store._locked():
+            holding.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        assert holding.wait(5)
+        seen = []
+        reader = threading.Thread(target=lambda: seen.append(len(store.get("default"))))
+        reader.start()
+        reader.join(2)
+        assert seen == [3]
+    finally:
+        release.set()
+        thread.join(5)
@@ -0,0 +1,89 @@
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+from app import STREAM_FRAME_HEADER
+
+
+def frame(seq, image=b""):
+    return STREAM_FRAME_HEADER.pack(seq) + image
+
+
+@pytest.fixture
+def stream(client, upload):
+    upload("stream", colors=("red", "blue"))
+
+    def connect(**params):
+        query = "&".join(f"{key}={value}" for key, value in {"collection": "stream", **params}.items())
+        return client.websocket_connect(f"/ws/classify?{query}")
+    return connect
+
+
+def test_results_come_back_in_order_tagged_with_their_seq(stream, image_bytes):
+    with stream() as ws:
+        assert ws.receive_json()["type"] == "ready"
+        for seq, color in enumerate(["red", "blue", "green", "red"]):
+            ws.send_bytes(frame(100 + seq, image_bytes(color)))
+        results = [ws.receive_json() for _ in range(4)]
+
+    assert [r["seq"] for r in results] == [100, 101, 102, 103]
+    assert all(r["type"] == "result" for r in results)
+    assert results[0]["reference"] == results[3]["reference"] == 0 and results[1]["reference"] == 1
+
+
+def test_bad_frames_are_answered_in_place(stream, image_bytes):
+    with stream() as ws:
+        ws.receive_json()
+        ws.send_bytes(frame(1, image_bytes("red")))
+        ws.send_bytes(frame(2))
+        ws.send_bytes(b"\x00\x01")
+        ws.send_text("not a frame")
+        ws.send_bytes(frame(5, b"not an image"))
+        ws.send_bytes(frame(6, image_bytes("blue")))
+        results = [ws.receive_json() for _ in range(6)]
+
+    assert [(r["type"], r["seq"]) for r in results] == [
+        ("result", 1), ("error", 2), ("error", None), ("error", None), ("error", 5), ("result", 6)
+    ]
+    assert "Empty image" in results[1]["detail"]
+    assert "8-byte sequence header" in results[2]["detail"]
+    assert "binary frame" in results[3]["detail"]
+    assert "Cannot decode" in results[4]["detail"]
+
+
+def test_batches_never_exceed_the_credit_window(stream, image_bytes):
+    with stream(credits=2, max_batch=16) as ws:
+        assert ws.receive_json()["credits"] == 2
+        for seq in range(8):
+            ws.send_bytes(frame(seq, image_bytes("red")))
+        results = [ws.receive_json() for _ in range(8)]
+
+    assert [r["seq"] for r in results] == list(range(8))
+    assert max(r["batch_size"] for r in results) <= 2
+
+
+@pytest.mark.parametrize("params, detail", [
+    ({"credits": 0}, "credits"),
+    ({"collection": "missing"}, "No reference images"),
+])
+def test_invalid_streams_are_refused_with_1008(stream, params, detail):
+    with stream(**params) as ws:
+        assert detail in ws.receive_json()["detail"]
+        with pytest.raises(WebSocketDisconnect) as closed:
+            ws.receive_json()
+    assert closed.value.code == 1008
+
+
+def test_unexpected_errors_close_the_stream_with_1011(backend, stream, image_bytes, monkeypatch):
+    def broken(*args, **kwargs):
+        raise RuntimeError("index corrupted")
+
+    monkeypatch.setattr(backend, "reference_similarities", broken)
+    with stream() as ws:
+        ws.receive_json()
+        ws.send_bytes(frame(1, image_bytes("red")))
+        message = ws.receive_json()
+        with pytest.raises(WebSocketDisconnect) as closed:
+            ws.receive_json()
+
+    assert message["type"] == "error" and "index corrupted" in message["detail"]
+    assert closed.value.code == 1011
@@ -0,0 +1,33 @@
+import pytest
+
+from app import RARE_EVENT_THRESHOLD, STREAM_FRAME_HEADER
+
+
+def classify(client, image_bytes, text_weight):
+    response = client.post("/classify", files={"file": ("q.jpg", image_bytes("red"), "image/jpeg")},
+                           data={"collection": "fusion", "text_weight": str(text_weight)})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_label_stays_on_image_similarity_when_captions_are_blended_in(client, upload, image_bytes):
+    upload("fusion", colors=("red", "blue"))
+    image_only = classify(client, image_bytes, 0.0)
+    text_only = classify(client, image_bytes, 1.0)
+
+    assert image_only["similarity"] > RARE_EVENT_THRESHOLD
+    # Image-caption cosines are on a lower scale; they must not flip the label
+    assert text_only["fused_similarity"] == pytest.approx(max(text_only["text_similarities"]), abs=1e-5)
+    assert text_only["fused_similarity"] < RARE_EVENT_THRESHOLD
+    assert text_only["label"] == image_only["label"] == "Rare Event"
+
+
+def test_stream_labels_on_similarity_and_reports_the_fused_score(client, upload, image_bytes):
+    upload("fusion", colors=("red", "blue"))
+    with client.websocket_connect("/ws/classify?collection=fusion&text_weight=1.0") as ws:
+        ws.receive_json()
+        ws.send_bytes(STREAM_FRAME_HEADER.pack(0) + image_bytes("red"))
+        result = ws.receive_json()
+
+    assert result["similarity"] > RARE_EVENT_THRESHOLD > result["score"]
+    assert result["label"] == "Rare Event"
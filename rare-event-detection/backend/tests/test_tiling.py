@@ -0,0 +1,72 @@
+import pytest
+from fastapi import HTTPException
+
+from app import MAX_TILES, TileLimitExceeded, parse_tile_scales, tile_boxes, tile_grids
+
+
+def check_covers(width, height, boxes):
+    """Every box is square and inside the image, and the boxes reach every edge"""
+    for left, top, right, bottom in boxes:
+        assert right - left == bottom - top
+        assert 0 <= left and 0 <= top and right <= width and bottom <= height
+    assert min(box[0] for box in boxes) == 0 and max(box[2] for box in boxes) == width
+    assert min(box[1] for box in boxes) == 0 and max(box[3] for box in boxes) == height
+
+
+def test_scale_one_on_a_square_image_is_the_whole_image():
+    assert tile_boxes(640, 640, 1, 0.25) == (1, 1, [(0, 0, 640, 640)])
+
+
+def test_square_image_gets_scale_by_scale_tiles():
+    rows, cols, boxes = tile_boxes(640, 640, 3, 0.25)
+    assert (rows, cols, len(boxes)) == (3, 3, 9)
+    check_covers(640, 640, boxes)
+    # Row-major order
+    assert boxes[1][0] > boxes[0][0] and boxes[1][1] == boxes[0][1]
+
+
+def test_elongated_image_gets_more_tiles_along_the_longer_side():
+    rows, cols, boxes = tile_boxes(1920, 1080, 2, 0.25)
+    assert rows == 2 and cols > rows
+    assert len(boxes) == rows * cols
+    check_covers(1920, 1080, boxes)
+
+    rows, cols, boxes = tile_boxes(480, 1600, 2, 0.25)
+    assert cols == 2 and rows > cols
+    check_covers(480, 1600, boxes)
+
+
+def test_overlap_shrinks_the_stride():
+    _, _, apart = tile_boxes(640, 640, 2, 0.0)
+    _, _, overlapping = tile_boxes(640, 640, 2, 0.5)
+    assert apart[1][0] == apart[0][2]
+    assert overlapping[1][0] < overlapping[0][2]
+
+
+def test_grids_within_the_limit_are_returned_per_scale():
+    grids = tile_grids(1920, 1080, [1, 2, 3], 0.25)
+    assert [rows for rows, _, _ in grids] == [1, 2, 3]
+    assert sum(len(boxes) for _, _, boxes in grids) <= MAX_TILES
+
+
+@pytest.mark.parametrize("size", [(4000, 500), (10000, 100)])
+def test_elongated_images_are_capped_on_the_real_tile_count(size):
+    # 1 + 4 + 9 tiles for a square image, but far more along a long side
+    with pytest.raises(TileLimitExceeded, match=f"at most {MAX_TILES}"):
+        tile_grids(*size, [1, 2, 3], 0.25)
+
+
+def test_huge_scales_are_rejected_without_cutting_tiles():
+    with pytest.raises(TileLimitExceeded):
+        tile_grids(640, 480, [10 ** 6], 0.25)
+
+
+def test_parse_tile_scales_sorts_and_deduplicates():
+    assert parse_tile_scales("3, 1,2,2") == [1, 2, 3]
+
+
+@pytest.mark.parametrize("spec", ["", "a,b", "0,1", "-2"])
+def test_parse_tile_scales_rejects_bad_input(spec):
+    with pytest.raises(HTTPException) as error:
+        parse_tile_scales(spec)
+    assert error.value.status_code == 400
@@ -0,0 +1,152 @@
+from concurrent.futures import Future
+
+import cv2
+import numpy as np
+import pytest
+
+from lanes import DeadlineExceeded
+from video import FrameSampler, Timeline, open_video
+
+FPS = 25
+
+
+@pytest.fixture(scope="module")
+def video_path(tmp_path_factory):
+    """10 s at 25 fps: gray, red from 3 s to 6 s, then gray again"""
+    path = str(tmp_path_factory.mktemp("video") / "clip.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), FPS, (320, 180))
+    for i in range(10 * FPS):
+        color = (0, 0, 255) if 3 * FPS <= i < 6 * FPS else (128, 128, 128)
+        writer.write(np.full((180, 320, 3), color, np.uint8))
+    writer.release()
+    return path
+
+
+def sample(path, sampler, batch_size=8):
+    cap, info = open_video(path)
+    try:
+        return [[timestamp for timestamp, _ in batch] for batch in sampler.batches(cap, info, batch_size)]
+    finally:
+        cap.release()
+
+
+def test_samples_at_the_requested_rate(video_path):
+    sampler = FrameSampler(sample_fps=2)
+    batches = sample(video_path, sampler)
+
+    timestamps = [t for batch in batches for t in batch]
+    assert [len(batch) for batch in batches] == [8, 8, 4]
+    assert timestamps == pytest.approx([0.5 * i for i in range(20)], abs=1 / FPS)
+    assert (sampler.decoded, sampler.sampled, sampler.truncated) == (10 * FPS, 20, False)
+    assert sampler.last_timestamp == timestamps[-1]
+
+
+def test_images_are_downscaled_to_the_target_side(video_path):
+    cap, info = open_video(video_path)
+    try:
+        frames = FrameSampler(sample_fps=1, target_side=90).frames(cap, info)
+        _, small = next(frames)
+    finally:
+        cap.release()
+    assert small.size == (160, 90)
+
+    cap, info = open_video(video_path)
+    try:
+        # Never upscaled
+        _, full = next(FrameSampler(sample_fps=1).frames(cap, info))
+    finally:
+        cap.release()
+    assert full.size == (320, 180)
+
+
+def test_max_frames_truncates_at_the_last_sample(video_path):
+    sampler = FrameSampler(sample_fps=2, max_frames=5)
+    timestamps = [t for batch in sample(video_path, sampler) for t in batch]
+
+    assert len(timestamps) == 5 and sampler.truncated
+    assert sampler.last_timestamp == timestamps[-1] == pytest.approx(2.0, abs=1 / FPS)
+
+
+def test_max_frames_beyond_the_video_is_not_truncated(video_path):
+    sampler = FrameSampler(sample_fps=2, max_frames=21)
+    sample(video_path, sampler)
+    assert sampler.sampled == 20 and not sampler.truncated
+
+
+def test_scene_threshold_keeps_one_sample_per_scene(video_path):
+    sampler = FrameSampler(sample_fps=5, scene_threshold=10)
+    timestamps = [t for batch in sample(video_path, sampler) for t in batch]
+
+    assert sampler.candidates == 50
+    assert timestamps == pytest.approx([0.0, 3.0, 6.0], abs=1 / FPS)
+
+
+def test_timeline_merges_samples_with_the_same_label():
+    timeline = Timeline(threshold=0.7)
+    for t, score in enumerate([0.5, 0.5, 0.9, 0.95, 0.4]):
+        timeline.add(float(t), score, reference=t)
+    segments = timeline.finish(10.0)
+
+    assert [(s["start"], s["end"], s["label"], s["samples"]) for s in segments] == [
+        (0.0, 2.0, "Normal", 2), (2.0, 4.0, "Rare Event", 2), (4.0, 10.0, "Normal", 1)
+    ]
+    assert segments[1]["max_score"] == 0.95 and segments[1]["peak_time"] == 3.0 and segments[1]["reference"] == 3
+    assert segments[1]["mean_score"] == pytest.approx(0.925)
+
+
+def test_timeline_finish_never_cuts_the_last_segment_short():
+    timeline = Timeline(threshold=0.7)
+    timeline.add(0.0, 0.9, 0)
+    timeline.add(2.0, 0.9, 0)
+    assert timeline.finish(1.0)[0]["end"] == 2.0
+
+
+@pytest.fixture
+def video_upload(video_path):
+    with open(video_path, "rb") as f:
+        return {"file": ("clip.avi", f.read(), "video/x-msvideo")}
+
+
+def expire_after(backend, monkeypatch, batches):
+    """Let the CLIP lane score `batches` batches, then fail every later one with DeadlineExceeded"""
+    lane = backend.lanes["clip"]
+    submit, calls = lane.submit, []
+
+    def submit_then_expire(fn, *args, budget=None):
+        calls.append(fn)
+        if len(calls) <= batches:
+            return submit(fn, *args, budget=budget)
+        future = Future()
+        future.set_exception(DeadlineExceeded("Deadline passed in the 'clip' queue"))
+        return future
+
+    monkeypatch.setattr(lane, "submit", submit_then_expire)
+
+
+def test_deadline_part_way_returns_the_partial_timeline(backend, client, upload, video_upload, monkeypatch):
+    upload("video", colors=("red", "blue"))
+    expire_after(backend, monkeypatch, batches=1)
+    response = client.post("/classify_video", files=video_upload,
+                           data={"collection": "video", "sample_fps": "2", "batch_size": "8"})
+
+    assert response.status_code == 200, response.text
+    result = response.json()
+    assert result["truncated"] and result["deadline_exceeded"]
+    assert result["sampled_frames"] == 8
+    assert result["analyzed_until"] == pytest.approx(3.5, abs=1 / FPS)
+    assert result["segments"][-1]["end"] == result["analyzed_until"]
+
+
+def test_deadline_before_any_batch_is_a_timeout(backend, client, upload, video_upload, monkeypatch):
+    upload("video", colors=("red", "blue"))
+    expire_after(backend, monkeypatch, batches=0)
+    response = client.post("/classify_video", files=video_upload, data={"collection": "video"})
+    assert response.status_code == 504
+
+
+def test_video_batch_size_has_its_own_limit(backend, client, upload, video_upload):
+    upload("video", colors=("red", "blue"))
+    response = client.post("/classify_video", files=video_upload,
+                           data={"collection": "video", "batch_size": str(backend.MAX_VIDEO_BATCH + 1)})
+    assert response.status_code == 400
+    assert str(backend.MAX_VIDEO_BATCH) in response.json()["detail"]
@@ -0,0 +1,144 @@
+"""
+Frame sampling and timelines for video classification.
+
+Frames are decoded one at a time with OpenCV and handed on in small batches of
+downscaled images, so memory stays flat however long the video is. Frames
+between samples are only grabbed, never converted or copied. A sample is
+taken every 1/sample_fps seconds; in scene-change mode such a candidate is
+only kept when it differs enough from the last kept frame, so static
+footage costs one CLIP forward per scene instead of one per interval.
+"""
+
+from dataclasses import dataclass, field
+from typing import Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+SCENE_PROBE_SIZE = (64, 36)
+
+
+@dataclass
+class VideoInfo:
+    fps: float
+    frame_count: int
+    width: int
+    height: int
+
+    @property
+    def duration(self) -> float:
+        return self.frame_count / self.fps if self.fps > 0 else 0.0
+
+
+def open_video(path: str):
+    """Open a video file, returning (capture, VideoInfo)"""
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise ValueError("Cannot decode video file")
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    info = VideoInfo(
+        fps=fps if fps and fps > 0 else 25.0,
+        frame_count=int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0),
+        width=int(cap.get(cv2.CAP_PROP_FRAME_WIDTH) or 0),
+        height=int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT) or 0),
+    )
+    return cap, info
+
+
+@dataclass
+class FrameSampler:
+    """Pick frames by rate and, optionally, by scene change"""
+    sample_fps: float = 1.0
+    scene_threshold: Optional[float] = None
+    max_frames: Optional[int] = None
+    target_side: int = 224
+    decoded: int = 0
+    candidates: int = 0
+    sampled: int = 0
+    last_timestamp: float = 0.0
+    truncated: bool = False
+    _last_probe: Optional[np.ndarray] = None
+
+    def _scene_changed(self, frame: np.ndarray) -> bool:
+        # Mean absolute difference of tiny grayscale thumbnails, on a 0-255 scale
+        probe = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), SCENE_PROBE_SIZE,
+                           interpolation=cv2.INTER_AREA).astype(np.int16)
+        changed = self._last_probe is None or float(np.abs(probe - self._last_probe).mean()) > self.scene_threshold
+        if changed:
+            self._last_probe = probe
+        return changed
+
+    def _to_image(self, frame: np.ndarray) -> Image.Image:
+        # Shrink before handing over: CLIP only sees 224 px anyway
+        height, width = frame.shape[:2]
+        scale = self.target_side / min(height, width)
+        if scale < 1:
+            frame = cv2.resize(frame, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+        return Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+
+    def frames(self, cap, info: VideoInfo) -> Iterator[Tuple[float, Image.Image]]:
+        """Yield (timestamp, image) for every sampled frame"""
+        interval = 1.0 / self.sample_fps
+        next_sample = 0.0
+        index = 0
+        while cap.grab():
+            timestamp = index / info.fps
+            index += 1
+            self.decoded += 1
+            if timestamp + 1e-9 < next_sample:
+                continue
+            next_sample += interval * max(1, int((timestamp - next_sample) / interval) + 1)
+            ok, frame = cap.retrieve()
+            if not ok:
+                continue
+            self.candidates += 1
+            if self.scene_threshold is not None and not self._scene_changed(frame):
+                continue
+            self.sampled += 1
+            self.last_timestamp = timestamp
+            yield timestamp, self._to_image(frame)
+            if self.max_frames is not None and self.sampled >= self.max_frames:
+                # Cut short only if the video goes on
+                self.truncated = cap.grab()
+                break
+
+    def batches(self, cap, info: VideoInfo, batch_size: int) -> Iterator[List[Tuple[float, Image.Image]]]:
+        batch = []
+        for sample in self.frames(cap, info):
+            batch.append(sample)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+@dataclass
+class Timeline:
+    """Merge consecutive samples with the same label into segments, incrementally"""
+    threshold: float
+    segments: List[dict] = field(default_factory=list)
+
+    def add(self, timestamp: float, score: float, reference: int):
+        label = "Rare Event" if score > self.threshold else "Normal"
+        current = self.segments[-1] if self.segments else None
+        if current is not None:
+            current["end"] = timestamp
+        if current is None or current["label"] != label:
+            current = {"start": timestamp, "end": timestamp, "label": label, "samples": 0,
+                       "max_score": score, "mean_score": 0.0, "peak_time": timestamp, "reference": reference}
+            self.segments.append(current)
+        current["samples"] += 1
+        current["mean_score"] += (score - current["mean_score"]) / current["samples"]
+        if score > current["max_score"]:
+            current.update(max_score=score, peak_time=timestamp, reference=reference)
+
+    def finish(self, end: float) -> List[dict]:
+        """Extend the last segment to the end of the analyzed span and round for output"""
+        if self.segments:
+            self.segments[-1]["end"] = max(self.segments[-1]["end"], end)
+        return [
+            {key: round(value, 4) if isinstance(value, float) else value for key, value in segment.items()}
+            for segment in self.segments
+        ]
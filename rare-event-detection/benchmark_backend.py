@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Load-testing and benchmark suite for the Rare Event Detection backend API.
+
+By default it starts its own backend with STUB_MODELS=1 (tiny random
+CLIP/BLIP/SD models with the real interfaces), so it runs fully offline on a
+CPU box. Each endpoint is driven at one or more concurrency levels and the
+p50/p95/p99 latency and throughput are written to a JSON results file.
+Pass --baseline to compare against a stored run and flag regressions.
+
+Examples:
+    python benchmark_backend.py --output bench.json --save-baseline baseline.json
+    python benchmark_backend.py --baseline baseline.json --concurrency 1 4 8
+    python benchmark_backend.py --url http://localhost:8000 --endpoints classify
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from test_backend import create_test_image
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+ENDPOINTS = ["health", "classify", "describe", "generate"]
+
+# Metrics where a larger value is worse, and the ones where a smaller value is worse
+LATENCY_METRICS = ["p50_ms", "p95_ms", "p99_ms"]
+THROUGHPUT_METRICS = ["throughput_rps"]
+
+
+def image_bytes(color, text=""):
+    """Encode a synthetic test image as JPEG bytes"""
+    buffer = io.BytesIO()
+    create_test_image(color, text=text).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def percentile(sorted_values, q):
+    """Linear-interpolated percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    pos = (len(sorted_values) - 1) * q / 100.0
+    lower = int(pos)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (pos - lower)
+
+
+def free_port():
+    """Ask the OS for an unused TCP port"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_stub_server(port, extra_env=None):
+    """Launch uvicorn with stub models and wait until /health answers"""
+    env = dict(os.environ, STUB_MODELS="1", **(extra_env or {}))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Stub server exited with code {process.returncode}")
+        try:
+            if requests.get(f"{url}/health", timeout=1).status_code == 200:
+                return process, url
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.25)
+    process.terminate()
+    raise RuntimeError("Stub server did not become healthy in time")
+
+
+def upload_references(url):
+    """Upload the same four synthetic references test_backend.py uses"""
+    references = [
+        ("red", "Fire", "A dangerous fire spreading"),
+        ("blue", "Flood", "Severe flooding in the area"),
+        ("gray", "Storm", "Powerful storm with lightning"),
+        ("orange", "Volcano", "Volcanic eruption with lava"),
+    ]
+    files = [("files", (f"{text.lower()}.jpg", image_bytes(color, text), "image/jpeg"))
+             for color, text, _ in references]
+    captions = [caption for _, _, caption in references]
+    response = requests.post(f"{url}/upload_references", files=files, data={"captions": captions},
+                             timeout=120)
+    response.raise_for_status()
+
+
+def make_request_fn(endpoint, url, generate_steps):
+    """Return a callable issuing one request to the endpoint with a given session"""
+    payload = image_bytes("purple", "Rare Event")
+
+    if endpoint == "health":
+        return lambda session: session.get(f"{url}/health", timeout=300)
+    if endpoint in ("classify", "describe"):
+        return lambda session: session.post(
+            f"{url}/{endpoint}", files={"file": ("test.jpg", payload, "image/jpeg")}, timeout=300
+        )
+    if endpoint == "generate":
+        data = {"caption": "A rare purple lightning storm over mountains"}
+        if generate_steps:
+            data["num_inference_steps"] = str(generate_steps)
+        return lambda session: session.post(f"{url}/generate", data=data, timeout=600)
+    raise ValueError(f"Unknown endpoint: {endpoint}")
+
+
+def run_load(request_fn, concurrency, total_requests, warmup):
+    """Fire total_requests requests with a fixed number of concurrent clients"""
+    local = threading.local()
+
+    def call():
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            ok = request_fn(local.session).status_code == 200
+        except requests.RequestException:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda _: call(), range(warmup)))
+        wall_start = time.perf_counter()
+        results = list(pool.map(lambda _: call(), range(total_requests)))
+        wall = time.perf_counter() - wall_start
+
+    latencies = sorted(1000.0 * elapsed for elapsed, ok in results if ok)
+    errors = sum(1 for _, ok in results if not ok)
+    return {
+        "concurrency": concurrency,
+        "requests": total_requests,
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "mean_ms": round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+        "throughput_rps": round(len(latencies) / wall, 3) if wall > 0 else 0.0,
+    }
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """List every metric that is worse than the baseline by more than tolerance"""
+    regressions = []
+    for endpoint, levels in results["endpoints"].items():
+        for level, current in levels.items():
+            previous = baseline.get("endpoints", {}).get(endpoint, {}).get(level)
+            if not previous:
+                continue
+            for metric in LATENCY_METRICS:
+                if previous[metric] > 0 and current[metric] > previous[metric] * (1 + tolerance):
+                    regressions.append((endpoint, level, metric, previous[metric], current[metric]))
+            for metric in THROUGHPUT_METRICS:
+                if previous[metric] > 0 and current[metric] < previous[metric] * (1 - tolerance):
+                    regressions.append((endpoint, level, metric, previous[metric], current[metric]))
+            if current["errors"] > previous["errors"]:
+                regressions.append((endpoint, level, "errors", previous["errors"], current["errors"]))
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Rare Event Detection API")
+    parser.add_argument("--url", help="Benchmark an already running server instead of a stub one")
+    parser.add_argument("--endpoints", nargs="+", default=ENDPOINTS, choices=ENDPOINTS)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4])
+    parser.add_argument("--requests", type=int, default=40, help="Requests per concurrency level")
+    parser.add_argument("--generate-requests", type=int, default=4,
+                        help="Requests per level for /generate, which is much slower")
+    parser.add_argument("--generate-steps", type=int, default=0,
+                        help="Override num_inference_steps for /generate (0 keeps the server default)")
+    parser.add_argument("--warmup", type=int, default=2, help="Unmeasured requests before each level")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="Baseline JSON file to compare against")
+    parser.add_argument("--save-baseline", help="Also write these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed relative slowdown before flagging a regression")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run the benchmark and return the process exit code"""
+    args = parse_args(argv)
+
+    print("⏱️  Rare Event Detection API Benchmark")
+    print("=" * 50)
+
+    server = None
+    url = args.url
+    if not url:
+        print("🧪 Starting stub-model backend (offline)...")
+        server, url = start_stub_server(free_port())
+
+    try:
+        if "classify" in args.endpoints:
+            upload_references(url)
+
+        results = {
+            "meta": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "url": url if args.url else "stub",
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "cpu_count": os.cpu_count(),
+            },
+            "endpoints": {},
+        }
+
+        for endpoint in args.endpoints:
+            request_fn = make_request_fn(endpoint, url, args.generate_steps)
+            total = args.generate_requests if endpoint == "generate" else args.requests
+            results["endpoints"][endpoint] = {}
+            for concurrency in args.concurrency:
+                stats = run_load(request_fn, concurrency, total, args.warmup)
+                results["endpoints"][endpoint][f"c{concurrency}"] = stats
+                print(f"{endpoint:10} c={concurrency:<3} p50={stats['p50_ms']:9.2f}ms "
+                      f"p95={stats['p95_ms']:9.2f}ms p99={stats['p99_ms']:9.2f}ms "
+                      f"{stats['throughput_rps']:8.2f} req/s errors={stats['errors']}")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\n💾 Results written to {args.output}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Baseline written to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+            for endpoint, level, metric, before, after in regressions:
+                print(f"   {endpoint} {level} {metric}: {before} -> {after}")
+            return 1
+        print(f"\n✅ No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
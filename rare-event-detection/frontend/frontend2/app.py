@@ -1,11 +1,16 @@
 
+import io
 import json
 import os
+import time
+from concurrent.futures import wait
 from pathlib import Path
 from PIL import Image
 
 import streamlit as st
 
+import backend_client as api
+
 st.set_page_config(page_title="VLM-Inspector", page_icon="👁️", layout="wide")
 
 st.markdown("""
@@ -67,6 +72,13 @@ st.markdown("""
 # Tweak these until it feels right on your screen
 HERO_TOP_VH = 8      # how far to push the big logo *down*
 NAV_GAP_VH  = 18     # vertical gap between hero and the bottom logos
+
+# Image caches: decoded images, thumbnails and overlays survive reruns
+IMAGE_CACHE_ENTRIES = 32    # decoded full-resolution images kept in memory
+THUMB_CACHE_ENTRIES = 512   # encoded thumbnails / overlays
+THUMB_MAX_SIDE = 640        # longest side served to the browser
+CLASSIFY_CACHE_ENTRIES = 64 # classification responses kept per browser session
+GEN_POLL_SECONDS = 1.0      # refresh interval of the generation panel while images are pending
 # ---------- Config ----------
 CONFIG_PATH = Path(__file__).parent / "demo_config.json"
 with open(CONFIG_PATH, "r") as f:
@@ -112,27 +124,83 @@ def safe_image(src, **kwargs) -> bool:
     """Render an image safely. Returns True if shown, False otherwise."""
     if not src:
         return False
-    src = resolve_path(src)
-    try:
-        if isinstance(src, Path):
-            if not src.exists():
-                return False
-            st.image(str(src), **kwargs)
-        else:
+    if is_url(src):
+        try:
             st.image(src, **kwargs)   # URL or data: URI
+            return True
+        except Exception:
+            return False
+    return show_thumbnail(src, **kwargs)
+
+
+
+# ---------- Image cache ----------
+# Cache keys include the file's mtime, so editing an asset invalidates its entries.
+def file_mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+@st.cache_resource(max_entries=IMAGE_CACHE_ENTRIES, show_spinner=False)
+def _decode_image(path: str, mtime: float, mode: str) -> Image.Image:
+    # Shared across reruns and sessions; callers must not mutate the result
+    im = Image.open(path)
+    return im.convert(mode)
+
+def _encode(im: Image.Image) -> bytes:
+    buf = io.BytesIO()
+    if im.mode in ("RGBA", "LA", "P"):
+        im.save(buf, format="PNG", optimize=True)
+    else:
+        im.save(buf, format="JPEG", quality=88)
+    return buf.getvalue()
+
+@st.cache_data(max_entries=THUMB_CACHE_ENTRIES, show_spinner=False)
+def _thumbnail(path: str, mtime: float, max_side: int) -> bytes:
+    im = Image.open(path)
+    im.draft("RGB", (max_side, max_side))   # JPEG: decode at reduced scale directly
+    im = im.convert("RGBA" if "A" in im.getbands() or im.mode == "P" else "RGB")
+    im.thumbnail((max_side, max_side))
+    return _encode(im)
+
+@st.cache_data(max_entries=THUMB_CACHE_ENTRIES, show_spinner=False)
+def _thumbnail_from_bytes(data: bytes, max_side: int) -> bytes:
+    im = Image.open(io.BytesIO(data)).convert("RGB")
+    im.thumbnail((max_side, max_side))
+    return _encode(im)
+
+def thumbnail(path, max_side: int = THUMB_MAX_SIDE):
+    """Downscaled, encoded copy of an image file (None if it is missing)"""
+    p = resolve_path(path)
+    mtime = file_mtime(p)
+    if mtime is None:
+        return None
+    return _thumbnail(str(p), mtime, max_side)
+
+def show_thumbnail(path, **kwargs) -> bool:
+    """st.image on a cached thumbnail instead of the full-resolution file"""
+    try:
+        data = thumbnail(path)
+        if data is None:
+            return False
+        st.image(data, **kwargs)
         return True
     except Exception:
         return False
 
+def show_upload(f, **kwargs):
+    """st.image on a cached thumbnail of an uploaded file"""
+    st.image(_thumbnail_from_bytes(f.getvalue(), THUMB_MAX_SIDE), **kwargs)
 
 
 # ---------- Helpers ----------
 def load_img(path, use_rgba=False):
     p = Path(path)
-    if not p.exists():
+    mtime = file_mtime(p)
+    if mtime is None:
         return None
-    im = Image.open(p)
-    return im.convert("RGBA") if use_rgba else im.convert("RGB")
+    return _decode_image(str(p), mtime, "RGBA" if use_rgba else "RGB")
 
 def hex_to_rgba(hex_color: str, alpha: float = 0.28) -> str:
     if not hex_color:
@@ -141,16 +209,40 @@ def hex_to_rgba(hex_color: str, alpha: float = 0.28) -> str:
     r, g, b = int(h[0:2], 16), int(h[2:4], 16), int(h[4:6], 16)
     return f"rgba({r},{g},{b},{alpha})"
 
-def overlay_heatmap(base_img_path, heatmap_path, alpha=0.40):
-    base = load_img(base_img_path, use_rgba=True)
-    heat = load_img(heatmap_path, use_rgba=True)
-    if base is None or heat is None:
-        return base  # show whatever we have
-    heat = heat.resize(base.size)
+@st.cache_data(max_entries=THUMB_CACHE_ENTRIES, show_spinner=False)
+def _overlay(base_path: str, base_mtime: float, heat_path: str, heat_mtime: float,
+             alpha: float, max_side: int) -> bytes:
+    # Composite at thumbnail resolution: the browser never sees more pixels than this
+    base = load_img(base_path, use_rgba=True).copy()
+    base.thumbnail((max_side, max_side))
+    heat = load_img(heat_path, use_rgba=True).resize(base.size)
     out = Image.alpha_composite(base, Image.blend(Image.new("RGBA", base.size, (0,0,0,0)), heat, 1.0))
     # Control final opacity via alpha of composite against base
     out = Image.blend(base, out, alpha)
-    return out.convert("RGB")
+    return _encode(out.convert("RGB"))
+
+def overlay_heatmap(base_img_path, heatmap_path, alpha=0.40):
+    base_mtime = file_mtime(base_img_path)
+    heat_mtime = file_mtime(heatmap_path)
+    if base_mtime is None:
+        return None
+    if heat_mtime is None:
+        return thumbnail(base_img_path)  # show whatever we have
+    return _overlay(str(base_img_path), base_mtime, str(heatmap_path), heat_mtime,
+                    round(float(alpha), 3), THUMB_MAX_SIDE)
+
+@st.cache_data(max_entries=THUMB_CACHE_ENTRIES, show_spinner=False)
+def _overlay_upload(data: bytes, heat_png: bytes, alpha: float, max_side: int) -> bytes:
+    # The backend heatmap covers CLIP's center crop of the upload; paint it there
+    base = Image.open(io.BytesIO(data)).convert("RGBA")
+    base.thumbnail((max_side, max_side))
+    side = min(base.size)
+    heat = Image.open(io.BytesIO(heat_png)).convert("L").resize((side, side), Image.BILINEAR)
+    red = Image.new("RGBA", (side, side), (239, 68, 68, 0))
+    red.putalpha(heat.point(lambda v: round(v * alpha)))
+    layer = Image.new("RGBA", base.size, (0, 0, 0, 0))
+    layer.paste(red, ((base.width - side) // 2, (base.height - side) // 2))
+    return _encode(Image.alpha_composite(base, layer).convert("RGB"))
 
 def section_header(text, color="#0f172a"):
     st.markdown(f"<h3 style='margin-top:0.5rem;margin-bottom:0.5rem;color:{color}'>{text}</h3>", unsafe_allow_html=True)
@@ -293,6 +385,92 @@ def render_desc():
             if st.button("Close"):
                 st.session_state["desc_open"] = False
 
+# ---------- Backend ----------
+@st.cache_data(ttl=10, show_spinner=False)
+def backend_online() -> bool:
+    # Short-lived so a backend started after the UI is picked up
+    return api.is_available()
+
+if hasattr(st, "fragment"):
+    fragment = st.fragment
+elif hasattr(st, "experimental_fragment"):
+    fragment = st.experimental_fragment
+else:
+    fragment = None
+
+def train_references(domain_key: str, fewshot, captions):
+    """Upload the few-shot examples as the domain's collection; returns an error message or None"""
+    if not fewshot:
+        return "No few-shot examples configured."
+    try:
+        images = [(Path(p).name, resolve_path(p).read_bytes()) for p in fewshot]
+        response = api.upload_references(domain_key, images, captions)
+    except (OSError, api.BackendError) as e:
+        return str(e)
+    st.session_state.setdefault("reference_versions", {})[domain_key] = response["version"]
+    return None
+
+def show_generation(domain_key: str):
+    """Show generated images as they finish, without blocking the rest of the page"""
+    jobs = st.session_state.get(f"gen_jobs_{domain_key}", [])
+    pending = any(not future.done() for _, future in jobs)
+
+    def panel():
+        cols = st.columns(len(jobs))
+        for i, (col, (prompt, future)) in enumerate(zip(cols, jobs)):
+            with col:
+                if not future.done():
+                    st.info("Generating…")
+                    continue
+                try:
+                    result = future.result()
+                except api.BackendError as e:
+                    st.error(str(e))
+                    continue
+                safe_image(result["image"], use_container_width=True)
+                if st.button("Description", key=f"desc_gen_{domain_key}_{i}", use_container_width=True):
+                    open_desc("Generated sample description", prompt)
+        if pending and all(future.done() for _, future in jobs):
+            st.rerun()  # full rerun: stops the polling and re-enables the dialog
+
+    if not pending:
+        panel()
+    elif fragment is not None:
+        fragment(panel, run_every=GEN_POLL_SECONDS)()
+    else:
+        with st.spinner("Generating…"):
+            wait([future for _, future in jobs])
+        pending = False
+        panel()
+
+def show_classifications(domain_key: str, uploads, results, captions):
+    for idx, (f, result) in enumerate(zip(uploads, results), start=1):
+        st.markdown(f"**Result {idx} — Uploaded: {getattr(f, 'name', f'image {idx}')}**")
+        if "error" in result:
+            st.error(result["error"])
+            continue
+
+        if result.get("heatmap"):
+            overlay = _overlay_upload(f.getvalue(), api.decode_data_uri(result["heatmap"]), 0.55, THUMB_MAX_SIDE)
+            st.image(overlay, caption="Heatmap overlay", use_container_width=True)
+        else:
+            show_upload(f, use_container_width=True)
+
+        similarities = result.get("all_similarities", [])
+        best = max(range(len(similarities)), key=similarities.__getitem__) if similarities else None
+        closest = captions[best] if best is not None and best < len(captions) else None
+        rare = result["label"] == "Rare Event"
+        if domain_key == "manufacturing":
+            st.markdown(f"**Presence of fatigue cracks**: {'Yes' if rare else 'No'}")
+        else:
+            st.markdown(f"**Status**: {result['label']}")
+        st.markdown(f"**Similarity**: {result['similarity']:.3f}")
+        if closest:
+            st.markdown(f"**Closest few-shot example**: {closest}")
+
+        if idx < len(results):
+            st.markdown("---")
+
 def render_app(domain_key: str):
     # Back button (top-left)
     st.button("← Back to home", on_click=go_home)
@@ -305,6 +483,8 @@ def render_app(domain_key: str):
     trained = st.session_state["trained"].get(domain_key, False)
 
     accent_color = accent(domain_key)
+    # Live mode talks to the API; without it the canned results from demo_config.json are shown
+    live = backend_online()
 
     st.divider()
     left, mid, right = st.columns([1, 1, 1])
@@ -315,16 +495,15 @@ def render_app(domain_key: str):
 
         fs = D.get("fewshot", [])
         caps_cfg = D.get("fewshot_captions", [])
+        captions = caps_cfg if isinstance(caps_cfg, list) and len(caps_cfg) == len(fs) \
+                else [f"Example {i+1}" for i in range(len(fs))]
 
         if fs:
             st.markdown("**Few-shot examples**")
-            captions = caps_cfg if isinstance(caps_cfg, list) and len(caps_cfg) == len(fs) \
-                    else [f"Example {i+1}" for i in range(len(fs))]
-
             cols = st.columns(len(fs))
             for i, (col, img_path) in enumerate(zip(cols, fs)):
                 with col:
-                    st.image(str(resolve_path(img_path)), use_container_width=True)
+                    show_thumbnail(img_path, use_container_width=True)
                     cap = captions[i] if i < len(captions) else f"Example {i+1}"
                     if st.button("Description", key=f"desc_fs_{domain_key}_{i}", use_container_width=True):
                         open_desc("Few-shot description", cap)
@@ -332,11 +511,19 @@ def render_app(domain_key: str):
         clicked = st.button("Train Model (few-shot)", type="primary", use_container_width=True)
         if clicked:
             with st.status("Training few-shot model…", expanded=False) as status:
-                import time; time.sleep(0.6)  # demo pause
-                st.session_state["trained"][domain_key] = True
-                status.update(label="Model successfully trained ✔", state="complete")
-            trained = True
-            st.toast("Model successfully trained ✔", icon="✅")
+                if live:
+                    error = train_references(domain_key, fs, captions)
+                else:
+                    error = None
+                    time.sleep(0.6)  # demo pause
+                if error:
+                    status.update(label=f"Training failed: {error}", state="error")
+                else:
+                    st.session_state["trained"][domain_key] = True
+                    status.update(label="Model successfully trained ✔", state="complete")
+            if not error:
+                trained = True
+                st.toast("Model successfully trained ✔", icon="✅")
         if trained:
             st.success("Status: trained", icon="🧠")
         else:
@@ -347,19 +534,24 @@ def render_app(domain_key: str):
         section_header("Generate new samples", color=accent_color)
 
         gen_cfg = D.get("generated", {})
+        gen_items = gen_cfg if isinstance(gen_cfg, list) else [gen_cfg]
+        gen_items = [g for g in gen_items if isinstance(g, dict) and (g.get("image") or g.get("caption"))]
         if st.button("Generate Image(s)", use_container_width=True, disabled=not trained):
             st.session_state[f"show_gen_{domain_key}"] = True
-
-        if st.session_state.get(f"show_gen_{domain_key}"):
-            gen_items = gen_cfg if isinstance(gen_cfg, list) else [gen_cfg]
-            gen_items = [g for g in gen_items if isinstance(g, dict) and (g.get("image") or g.get("caption"))]
-
+            if live:
+                # Requests run in the background; the panel fills in as each image finishes
+                prompts = [g["caption"] for g in gen_items if g.get("caption")] or captions[:1]
+                st.session_state[f"gen_jobs_{domain_key}"] = [(p, api.submit_generation(p)) for p in prompts]
+
+        if st.session_state.get(f"gen_jobs_{domain_key}"):
+            show_generation(domain_key)
+        elif st.session_state.get(f"show_gen_{domain_key}"):
             if not gen_items:
                 st.info("No generated samples configured.")
             elif len(gen_items) == 1:
                 item = gen_items[0]
                 if item.get("image"):
-                    st.image(str(resolve_path(item["image"])), use_container_width=True)
+                    show_thumbnail(item["image"], use_container_width=True)
                 if st.button("Description", key=f"desc_gen_{domain_key}_0", use_container_width=True):
                     open_desc("Generated sample description", item.get("caption", "No description provided."))
             else:
@@ -367,7 +559,7 @@ def render_app(domain_key: str):
                 for i, (col, item) in enumerate(zip(cols, gen_items)):
                     with col:
                         if item.get("image"):
-                            st.image(str(resolve_path(item["image"])), use_container_width=True)
+                            show_thumbnail(item["image"], use_container_width=True)
                         if st.button("Description", key=f"desc_gen_{domain_key}_{i}", use_container_width=True):
                             open_desc("Generated sample description", item.get("caption", "No description provided."))
 
@@ -384,25 +576,40 @@ def render_app(domain_key: str):
                 accept_multiple_files=True,
                 key=f"up_{domain_key}",
             ) or []
-            uploads = uploads[:2]
             if uploads:
                 st.caption(f"{len(uploads)} image(s) selected.")
-                cols = st.columns(len(uploads))
-                for col, f in zip(cols, uploads):
-                    with col:
-                        st.image(f, caption=getattr(f, "name", "uploaded"), use_container_width=True)
+                for start in range(0, len(uploads), 4):
+                    row = uploads[start:start + 4]
+                    for col, f in zip(st.columns(4), row):
+                        with col:
+                            show_upload(f, caption=getattr(f, "name", "uploaded"), use_container_width=True)
         else:
-            _ = st.file_uploader(
+            upload = st.file_uploader(
                 "Upload image",
                 type=["jpg", "jpeg", "png"],
                 key=f"up_{domain_key}",
             )
-            uploads = []  # keep var defined
+            uploads = [upload] if upload else []
 
         if st.button("Classify", use_container_width=True, disabled=not trained):
             st.session_state[f"show_cls_{domain_key}"] = True
 
-        if st.session_state.get(f"show_cls_{domain_key}"):
+        version = st.session_state.get("reference_versions", {}).get(domain_key)
+        if st.session_state.get(f"show_cls_{domain_key}") and live and version is None:
+            st.warning("Train the model again to upload the few-shot examples to the backend.")
+        elif st.session_state.get(f"show_cls_{domain_key}") and live:
+            if not uploads:
+                st.info("Upload an image to classify.")
+            else:
+                # Cached per upload hash: reruns only send images the backend has not scored yet
+                with st.spinner(f"Classifying {len(uploads)} image(s)…"):
+                    results = api.classify_many(
+                        domain_key, [(f.name, f.getvalue()) for f in uploads],
+                        cache=st.session_state.setdefault("classify_cache", {}), version=version,
+                        max_entries=CLASSIFY_CACHE_ENTRIES,
+                    )
+                show_classifications(domain_key, uploads, results, captions)
+        elif st.session_state.get(f"show_cls_{domain_key}"):
             cls_cfg = D.get("classification", {})
             cls_items = cls_cfg if isinstance(cls_cfg, list) else [cls_cfg]
             cls_items = [c for c in cls_items if isinstance(c, dict)]
@@ -426,9 +633,9 @@ def render_app(domain_key: str):
                         if result is not None:
                             st.image(result, caption="Heatmap overlay", use_container_width=True)
                         else:
-                            st.image(str(resolve_path(test)), caption="", use_container_width=True)
+                            show_thumbnail(test, caption="", use_container_width=True)
                     elif test:
-                        st.image(str(resolve_path(test)), caption="", use_container_width=True)
+                        show_thumbnail(test, caption="", use_container_width=True)
 
                     pred = item.get("predicted_class", "—")
                     why  = item.get("why", "")
@@ -454,9 +661,9 @@ def render_app(domain_key: str):
     with st.expander("Demo notes & tips"):
         st.markdown(
             """
-- This is a **demo-only** interface. All outputs are preloaded from `/assets` via `demo_config.json`.
+- With the backend running (`BACKEND_URL`, default `http://localhost:8000`), training uploads the few-shot examples, generation calls Stable Diffusion and uploads are classified for real.
+- Without it this is a **demo-only** interface: all outputs are preloaded from `/assets` via `demo_config.json`.
 - Replace images and texts in the `assets/<domain>/` folders and edit `demo_config.json` to update the demo.
-- The **Upload image** control is for realism; the classification output is still the canned result.
 - Use **Streamlit Community Cloud** to deploy quickly: push to GitHub, then “New app” → select repo.
             """
         )
@@ -0,0 +1,142 @@
+"""
+Client for the Rare Event Detection API used by the Streamlit UI.
+
+One requests.Session per process keeps connections alive across reruns and
+users (urllib3 pools them per host), and a small thread pool sends
+independent requests concurrently. Nothing here touches st.session_state:
+callers pass in the dict used as the response cache, so worker threads never
+need the Streamlit script context.
+
+Configuration:
+    BACKEND_URL        API base URL (default http://localhost:8000)
+    BACKEND_POOL_SIZE  pooled connections and concurrent requests (default 8)
+"""
+
+import base64
+import hashlib
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000").rstrip("/")
+POOL_SIZE = int(os.getenv("BACKEND_POOL_SIZE", "8"))
+TIMEOUTS = {"health": 2, "upload": 600, "classify": 60, "generate": 900}
+
+_lock = threading.Lock()
+_session = None
+_executor = None
+
+
+class BackendError(Exception):
+    """A request the API rejected or could not serve"""
+
+
+def session() -> requests.Session:
+    """Process-wide keep-alive session (retries connection errors only)"""
+    global _session
+    with _lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=POOL_SIZE,
+                                  max_retries=Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.2))
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+def executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="backend")
+        return _executor
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def decode_data_uri(uri: str) -> bytes:
+    return base64.b64decode(uri.split(",", 1)[1])
+
+
+def _request(method: str, path: str, timeout: float, **kwargs) -> dict:
+    try:
+        response = session().request(method, f"{BACKEND_URL}{path}", timeout=timeout, **kwargs)
+    except requests.RequestException as e:
+        raise BackendError(f"Backend unreachable: {e}")
+    if response.status_code != 200:
+        try:
+            detail = response.json().get("detail", response.text)
+        except ValueError:
+            detail = response.text
+        if response.status_code == 429:
+            detail = f"{detail} (retry in {response.headers.get('Retry-After', '?')}s)"
+        raise BackendError(f"{response.status_code}: {detail}")
+    return response.json()
+
+
+def is_available() -> bool:
+    try:
+        return _request("GET", "/health", TIMEOUTS["health"]).get("status") == "healthy"
+    except BackendError:
+        return False
+
+
+def upload_references(collection: str, images: List[Tuple[str, bytes]], captions: List[str]) -> dict:
+    """Replace a collection with these images and captions in one multipart request"""
+    files = [("files", (name, data, "application/octet-stream")) for name, data in images]
+    return _request("POST", "/upload_references", TIMEOUTS["upload"],
+                    files=files, data={"captions": captions, "collection": collection})
+
+
+def classify(collection: str, name: str, data: bytes, heatmap: bool = True) -> dict:
+    return _request("POST", "/classify", TIMEOUTS["classify"],
+                    files={"file": (name, data, "application/octet-stream")},
+                    data={"collection": collection, "heatmap": str(heatmap).lower(), "heatmap_format": "png"})
+
+
+def classify_many(collection: str, uploads: List[Tuple[str, bytes]], cache: Dict,
+                  version: Optional[str] = None, max_entries: int = 64) -> List[dict]:
+    """
+    Classify several uploads concurrently, reusing cached results
+
+    Results are cached by (collection, reference version, content hash), so
+    reruns and re-uploads of the same bytes cost nothing and retraining
+    invalidates them. Entries of the collection's older versions are dropped,
+    and beyond max_entries the least recently used go first (the dict's
+    insertion order is kept as recency order). Failures come back as
+    {"error": ...} and are not cached.
+    """
+    for key in [key for key in cache if key[0] == collection and key[1] != version]:
+        del cache[key]
+    keys = [(collection, version, content_hash(data)) for _, data in uploads]
+    futures = {}
+    for (name, data), key in zip(uploads, keys):
+        if key not in cache and key not in futures:
+            futures[key] = executor().submit(classify, collection, name, data)
+    results = []
+    for key in keys:
+        if key in futures and key not in cache:
+            try:
+                cache[key] = futures[key].result()
+            except BackendError as e:
+                results.append({"error": str(e)})
+                continue
+        # Re-inserting marks the entry as the most recently used
+        cache[key] = cache.pop(key)
+        results.append(cache[key])
+    while len(cache) > max_entries:
+        del cache[next(iter(cache))]
+    return results
+
+
+def submit_generation(caption: str, num_inference_steps: int = 20) -> Future:
+    """Start a /generate call in the background; the future yields the response"""
+    return executor().submit(_request, "POST", "/generate", TIMEOUTS["generate"],
+                             data={"caption": caption, "num_inference_steps": num_inference_steps})
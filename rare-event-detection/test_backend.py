@@ -94,12 +94,13 @@ def test_upload_references():
             temp_files.append(filepath)
             
             files.append(('files', (filename, open(filepath, 'rb'), 'image/jpeg')))
-            captions.append(('captions', caption))
+            captions.append(caption)
         
         # Upload references
         response = requests.post(
             f"{API_BASE_URL}/upload_references",
-            files=files + captions
+            files=files,
+            data={'captions': captions}
         )
         
         # Close file handles
@@ -165,6 +166,115 @@ def test_classify_image():
         except:
             pass
 
+def test_search_references():
+    """Test text and image search over the uploaded references"""
+    print("\n🔎 Testing reference search...")
+    
+    try:
+        response = requests.post(f"{API_BASE_URL}/search", data={'text': 'a fire', 'modality': 'text', 'top_k': 2})
+        if response.status_code != 200:
+            print(f"❌ Text search failed: {response.status_code}")
+            print(f"   Response: {response.text}")
+            return False
+        text_results = response.json().get('results', [])
+        
+        # The red reference image itself must come back first with similarity ~1
+        buffer = io.BytesIO()
+        create_test_image('red', text="Fire").save(buffer, format='JPEG')
+        files = {'file': ('fire.jpg', buffer.getvalue(), 'image/jpeg')}
+        response = requests.post(f"{API_BASE_URL}/search", files=files, data={'top_k': 3})
+        if response.status_code != 200:
+            print(f"❌ Image search failed: {response.status_code}")
+            print(f"   Response: {response.text}")
+            return False
+        image_results = response.json().get('results', [])
+        scores = [r['score'] for r in image_results]
+        
+        if len(text_results) != 2 or len(image_results) != 3 or scores != sorted(scores, reverse=True):
+            print(f"❌ Unexpected search results: {text_results} {image_results}")
+            return False
+        if image_results[0]['index'] != 0 or image_results[0]['score'] < 0.99:
+            print(f"❌ Reference image not found first: {image_results[0]}")
+            return False
+        
+        print(f"✅ Search successful!")
+        print(f"   Text 'a fire': {[r['caption'] for r in text_results]}")
+        print(f"   Image: {[(r['caption'], round(r['score'], 4)) for r in image_results]}")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Search error: {e}")
+        return False
+
+def export_part(part, snapshot=None):
+    """Download one part of the default collection, pinned to a snapshot if given"""
+    params = {'part': part}
+    if snapshot:
+        params['snapshot'] = snapshot
+    response = requests.get(f"{API_BASE_URL}/export_references", params=params)
+    response.raise_for_status()
+    return response
+
+def test_export_import_references():
+    """Test exporting the references and importing them into another collection"""
+    print("\n📦 Testing reference export / import round trip...")
+    
+    try:
+        import numpy as np
+        
+        embeddings = export_part('embeddings')
+        snapshot = embeddings.headers['X-Reference-Snapshot']
+        items = export_part('items', snapshot)
+        text_embeddings = export_part('text_embeddings', snapshot)
+        
+        response = requests.post(
+            f"{API_BASE_URL}/import_references",
+            files={
+                'embeddings': ('refs.npy', embeddings.content),
+                'items': ('items.jsonl', items.content),
+                'text_embeddings': ('text.npy', text_embeddings.content)
+            },
+            data={
+                'model_id': embeddings.headers['X-Model-Id'],
+                'collection': 'roundtrip',
+                'mode': 'replace'
+            }
+        )
+        if response.status_code != 200:
+            print(f"❌ Import failed: {response.status_code}")
+            print(f"   Response: {response.text}")
+            return False
+        count = response.json().get('count')
+        
+        # The imported collection must export the same rows and captions
+        reexported = requests.get(f"{API_BASE_URL}/export_references",
+                                  params={'collection': 'roundtrip'})
+        reexported_items = requests.get(f"{API_BASE_URL}/export_references",
+                                        params={'collection': 'roundtrip', 'part': 'items'})
+        original = np.load(io.BytesIO(embeddings.content))
+        roundtrip = np.load(io.BytesIO(reexported.content))
+        
+        if count != original.shape[0] or not np.allclose(original, roundtrip, atol=1e-6):
+            print(f"❌ Imported embeddings differ ({count} rows imported, {original.shape[0]} exported)")
+            return False
+        if reexported_items.text.splitlines() != items.text.splitlines():
+            print(f"❌ Imported captions differ")
+            return False
+        
+        # Exports of the same snapshot are byte-identical
+        if export_part('embeddings', snapshot).content != embeddings.content:
+            print(f"❌ Snapshot {snapshot} exported different rows")
+            return False
+        
+        print(f"✅ Export / import successful!")
+        print(f"   Snapshot: {snapshot}")
+        print(f"   Rows: {count}, dim {original.shape[1]}")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Export / import error: {e}")
+        return False
+
 def test_describe_image():
     """Test image description"""
     print("\n📝 Testing image description...")
@@ -259,10 +369,14 @@ def main():
         
         if results['upload']:
             results['classify'] = test_classify_image()
+            results['search'] = test_search_references()
+            results['export'] = test_export_import_references()
             results['describe'] = test_describe_image()
         else:
-            print("\n⚠️ Skipping classification and description tests (no references uploaded)")
+            print("\n⚠️ Skipping classification, search, export and description tests (no references uploaded)")
             results['classify'] = False
+            results['search'] = False
+            results['export'] = False
             results['describe'] = False
         
         results['generate'] = test_generate_image()
@@ -271,6 +385,8 @@ def main():
         results.update({
             'upload': False,
             'classify': False,
+            'search': False,
+            'export': False,
             'describe': False,
             'generate': False
         })